@@ -0,0 +1,172 @@
+"""
+Бенчмарк: пропускная способность главной страницы под WSGI и ASGI.
+
+Моделирует много одновременных медленных клиентов и медленный SQLite:
+  * каждый SQL-запрос задерживается на --db-latency мс;
+  * каждый клиент читает ответ --client-delay мс.
+
+WSGI-режим - пул из --workers потоков, как у синхронного сервера: пока
+клиент читает ответ, поток занят. ASGI-режим - приложение вызывается
+напрямую из цикла событий, как это делает uvicorn: ожидание клиента и
+запросов к базе не занимает рабочий поток.
+
+Запуск из корня проекта:
+    python benchmarks/async_views.py --requests 200 --concurrency 50
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fanfiction.settings')
+
+
+def setup_database(path, db_latency):
+    """Временная база с данными и искусственной задержкой запросов"""
+    import django
+    from django.conf import settings
+
+    settings.DATABASES['default']['NAME'] = path
+    # Бенчмарк меряет только основную базу
+    settings.DATABASES.pop('replica', None)
+    django.setup()
+
+    from django.core.management import call_command
+    from django.db.backends.signals import connection_created
+
+    call_command('migrate', verbosity=0)
+
+    from users.models import CustomUser, Fanfic
+
+    author = CustomUser.objects.create_user(username='bench', password='bench-password')
+    Fanfic.objects.bulk_create([
+        Fanfic(
+            title=f'Фанфик {i}', content='Текст ' * 200, author=author,
+            status='published', tags='фэнтези, драма, романтика', views_count=i,
+        )
+        for i in range(300)
+    ])
+
+    def slow_query(execute, sql, params, many, context):
+        time.sleep(db_latency)
+        return execute(sql, params, many, context)
+
+    def add_latency(sender, connection, **kwargs):
+        # Объект соединения переиспользуется после переподключения
+        if slow_query not in connection.execute_wrappers:
+            connection.execute_wrappers.append(slow_query)
+
+    connection_created.connect(add_latency, weak=False)
+
+
+def run_wsgi(total, concurrency, workers, client_delay):
+    from django.core.wsgi import get_wsgi_application
+
+    application = get_wsgi_application()
+
+    def one_request():
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': '/', 'QUERY_STRING': '',
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+            'HTTP_USER_AGENT': 'bench', 'wsgi.input': io.BytesIO(), 'wsgi.url_scheme': 'http',
+            'wsgi.errors': sys.stderr, 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+            'wsgi.run_once': False, 'wsgi.version': (1, 0),
+        }
+        statuses = []
+        body = b''.join(application(environ, lambda status, headers: statuses.append(status)))
+        # Медленный клиент держит рабочий поток, пока читает ответ
+        time.sleep(client_delay)
+        assert statuses[0].startswith('200'), statuses
+        return len(body)
+
+    # Клиентов больше, чем потоков сервера: лишние ждут в очереди
+    with ThreadPoolExecutor(max_workers=min(workers, concurrency)) as pool:
+        started = time.perf_counter()
+        list(pool.map(lambda _: one_request(), range(total)))
+        return time.perf_counter() - started
+
+
+def run_asgi(total, concurrency, client_delay):
+    from django.core.asgi import get_asgi_application
+
+    application = get_asgi_application()
+
+    async def one_request():
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': 'GET', 'scheme': 'http', 'path': '/', 'raw_path': b'/',
+            'query_string': b'', 'root_path': '', 'headers': [(b'host', b'localhost')],
+            'client': ('127.0.0.1', 50000), 'server': ('localhost', 80),
+        }
+        statuses = []
+        request_sent = False
+        response_done = asyncio.Event()
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            # Дальше клиент только ждет ответа, потом отключается
+            await response_done.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                statuses.append(message['status'])
+            elif not message.get('more_body'):
+                # Медленный клиент не занимает поток - только корутину
+                await asyncio.sleep(client_delay)
+                response_done.set()
+
+        await application(scope, receive, send)
+        assert statuses == [200], statuses
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def limited():
+            async with semaphore:
+                await one_request()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(limited() for _ in range(total)))
+        return time.perf_counter() - started
+
+    return asyncio.run(main())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=4, help='потоков у WSGI-сервера')
+    parser.add_argument('--db-latency', type=float, default=5.0, help='мс на SQL-запрос')
+    parser.add_argument('--client-delay', type=float, default=300.0, help='мс на чтение ответа клиентом')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_database(os.path.join(tmp, 'bench.sqlite3'), args.db_latency / 1000)
+
+        results = {}
+        # index_view печатает отладочные сообщения - глушим их
+        with contextlib.redirect_stdout(io.StringIO()):
+            results['WSGI'] = run_wsgi(args.requests, args.concurrency, args.workers, args.client_delay / 1000)
+            results['ASGI'] = run_asgi(args.requests, args.concurrency, args.client_delay / 1000)
+
+    print(f'{args.requests} запросов, {args.concurrency} клиентов, '
+          f'SQL +{args.db_latency} мс, клиент +{args.client_delay} мс')
+    for name, elapsed in results.items():
+        print(f'{name}: {elapsed:.2f} с, {args.requests / elapsed:.1f} запросов/с')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Бенчмарк: память на одну страницу списка - объекты Fanfic против карточек.
+
+Строит страницу списка двумя способами и меряет tracemalloc:
+  * модели - list(queryset.select_related('author')) и обращения шаблона
+    карточки (get_tags_list, уровень популярности, автор, комментарии);
+  * карточки - fanfic_cards(queryset) из users/cards.py с теми же полями.
+
+Для каждого способа печатает пик памяти и число живых блоков на страницу.
+
+Запуск из корня проекта:
+    python benchmarks/listing_cards.py --fanfics 300 --page-size 12
+"""
+
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fanfiction.settings')
+
+
+def setup_database(path, total, content_size):
+    """Временная база с фанфиками и комментариями"""
+    import django
+    from django.conf import settings
+
+    settings.DATABASES['default']['NAME'] = path
+    # Бенчмарк меряет только основную базу
+    settings.DATABASES.pop('replica', None)
+    settings.DATABASES.pop('analytics', None)
+    django.setup()
+
+    from django.core.management import call_command
+
+    call_command('migrate', verbosity=0)
+
+    from users.models import Comment, CustomUser, Fanfic
+
+    authors = [
+        CustomUser.objects.create_user(username=f'bench{i}', password='bench-password', nickname=f'Автор {i}')
+        for i in range(10)
+    ]
+    Fanfic.objects.bulk_create([
+        Fanfic(
+            title=f'Фанфик {i}', description='Описание истории. ' * 40, content='Текст главы. ' * content_size,
+            author=authors[i % len(authors)], status='published',
+            tags='фэнтези, драма, романтика, приключения', views_count=i * 7,
+        )
+        for i in range(total)
+    ])
+    Comment.objects.bulk_create([
+        Comment(fanfic=fanfic, author=authors[0], content='Комментарий')
+        for fanfic in Fanfic.objects.all()[:total // 2]
+    ])
+
+
+def render_models(queryset):
+    fanfics = list(queryset.select_related('author'))
+    for fanfic in fanfics:
+        (fanfic.title, fanfic.description[:150], fanfic.author.username, fanfic.views_count,
+         fanfic.get_tags_list(), fanfic.get_popularity_badge_class(), fanfic.get_popularity_text(),
+         fanfic.get_comments_count())
+    return fanfics
+
+
+def render_cards(queryset):
+    from users.cards import fanfic_cards
+
+    fanfics = fanfic_cards(queryset)
+    for fanfic in fanfics:
+        (fanfic.title, fanfic.description[:150], fanfic.author.username, fanfic.views_count,
+         fanfic.tags_list, fanfic.popularity_badge_class, fanfic.popularity_text,
+         fanfic.comments_count)
+    return fanfics
+
+
+def measure(build, queryset, pages, page_size):
+    """Средний пик памяти и число живых блоков на страницу"""
+    peaks, blocks = [], []
+    for number in range(pages):
+        page = queryset[number * page_size:(number + 1) * page_size]
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        result = build(page)
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        blocks.append(sum(stat.count_diff for stat in after.compare_to(before, 'filename')))
+        peaks.append(peak)
+        del result
+    return sum(peaks) / len(peaks), sum(blocks) / len(blocks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fanfics', type=int, default=300)
+    parser.add_argument('--page-size', type=int, default=12)
+    parser.add_argument('--pages', type=int, default=10)
+    parser.add_argument('--content-size', type=int, default=500, help='повторов фразы в тексте главы')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_database(os.path.join(tmp, 'bench.sqlite3'), args.fanfics, args.content_size)
+
+        from users.models import Fanfic
+
+        queryset = Fanfic.objects.filter(status='published').order_by('-views_count', '-created_at')
+        # Прогрев: компиляция запросов и кэши Django не входят в замер
+        render_models(queryset[:args.page_size])
+        render_cards(queryset[:args.page_size])
+
+        results = {
+            'модели': measure(render_models, queryset, args.pages, args.page_size),
+            'карточки': measure(render_cards, queryset, args.pages, args.page_size),
+        }
+
+    print(f'{args.fanfics} фанфиков, страница {args.page_size}, {args.pages} страниц')
+    for name, (peak, blocks) in results.items():
+        print(f'{name}: пик {peak / 1024:.1f} КБ, блоков {blocks:.0f} на страницу')
+
+
+if __name__ == '__main__':
+    main()
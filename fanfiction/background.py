@@ -0,0 +1,53 @@
+"""
+Фоновые периодические задачи внутри процесса.
+
+Используются для сброса буферов, обслуживания базы и обновления
+кэшей без отдельного планировщика.
+"""
+
+import logging
+import threading
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    """Daemon-поток, который вызывает функцию раз в interval секунд"""
+
+    def __init__(self, name, func, interval):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Запускает поток (повторный вызов ничего не делает)"""
+        with self._lock:
+            if self.is_running:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.func()
+            except Exception:
+                logger.exception('Ошибка в фоновой задаче %s', self.name)
+            finally:
+                # Поток живет долго - не держим устаревшие соединения
+                close_old_connections()
@@ -0,0 +1,137 @@
+"""
+Фильтр Блума: множество ключей в фиксированной памяти.
+
+Фильтр из size бит отвечает на вопрос «ключ уже добавлялся?» без ложных
+отрицаний и с малой долей ложных срабатываний (2048 бит и 5 хэшей - около
+0.05% при сотне ключей). Удалить ключ нельзя, поэтому для «видели за
+последние N секунд» используется RotatingBloomFilter из двух поколений:
+
+    seen = RotatingBloomFilter(window=1800)
+    if seen.add('42'):
+        ...  # ключ новый за окно
+    value = seen.dumps()
+    seen = RotatingBloomFilter.loads(value, window=1800)
+
+dumps() сжимает биты zlib и кодирует в base64: фильтр с несколькими
+ключами занимает десятки байт и помещается в cookie.
+"""
+
+import base64
+import binascii
+import hashlib
+import time
+import zlib
+
+DEFAULT_SIZE = 2048
+DEFAULT_HASHES = 5
+
+
+class BloomFilter:
+    """Фильтр Блума из size бит с hashes хэш-функциями"""
+
+    __slots__ = ('size', 'hashes', 'bits')
+
+    def __init__(self, size=DEFAULT_SIZE, hashes=DEFAULT_HASHES, bits=None):
+        if size <= 0 or size % 8:
+            raise ValueError('Размер фильтра Блума должен быть положительным и кратным 8')
+        self.size = size
+        self.hashes = hashes
+        if bits is None:
+            bits = bytearray(size // 8)
+        elif len(bits) != size // 8:
+            raise ValueError(f'Ожидалось {size // 8} байт, получено {len(bits)}')
+        self.bits = bytearray(bits)
+
+    def _positions(self, key):
+        if isinstance(key, str):
+            key = key.encode()
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        # Двойное хэширование: k позиций из двух 64-битных половин
+        first = int.from_bytes(digest[:8], 'big')
+        second = int.from_bytes(digest[8:], 'big') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        """Добавляет ключ; возвращает True, если его в фильтре не было"""
+        added = False
+        for position in self._positions(key):
+            byte, mask = position >> 3, 1 << (position & 7)
+            if not self.bits[byte] & mask:
+                self.bits[byte] |= mask
+                added = True
+        return added
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def __bool__(self):
+        return any(self.bits)
+
+    def __repr__(self):
+        return f'<BloomFilter size={self.size} hashes={self.hashes}>'
+
+
+class RotatingBloomFilter:
+    """Ключи, добавленные за последние window секунд (два поколения)
+
+    Новые ключи попадают в текущее поколение. Когда ему исполняется window
+    секунд, оно становится предыдущим, а старое предыдущее отбрасывается.
+    Проверка смотрит оба поколения, поэтому ключ помнится не меньше window
+    и не больше 2 * window секунд.
+    """
+
+    __slots__ = ('window', 'current', 'previous', 'started_at')
+
+    def __init__(self, window, size=DEFAULT_SIZE, hashes=DEFAULT_HASHES, current=None, previous=None, started_at=None):
+        self.window = window
+        self.current = current if current is not None else BloomFilter(size, hashes)
+        self.previous = previous if previous is not None else BloomFilter(size, hashes)
+        self.started_at = started_at if started_at is not None else int(time.time())
+
+    def rotate(self, now=None):
+        """Сменяет поколения, если текущему исполнилось window секунд"""
+        now = int(now if now is not None else time.time())
+        age = now - self.started_at
+        if age < self.window:
+            return False
+        size, hashes = self.current.size, self.current.hashes
+        # Простоял дольше двух окон - помнить больше нечего
+        self.previous = self.current if age < 2 * self.window else BloomFilter(size, hashes)
+        self.current = BloomFilter(size, hashes)
+        self.started_at = now
+        return True
+
+    def add(self, key, now=None):
+        """Добавляет ключ; возвращает True, если его не было за окно"""
+        self.rotate(now)
+        if key in self.previous:
+            return False
+        return self.current.add(key)
+
+    def __contains__(self, key):
+        return key in self.current or key in self.previous
+
+    def dumps(self):
+        payload = zlib.compress(self.started_at.to_bytes(8, 'big') + bytes(self.current.bits) + bytes(self.previous.bits))
+        return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+    @classmethod
+    def loads(cls, value, window, size=DEFAULT_SIZE, hashes=DEFAULT_HASHES):
+        """Восстанавливает фильтр из dumps(); None, если значение испорчено
+        или записано с другим размером фильтра"""
+        try:
+            payload = zlib.decompress(base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)))
+        except (ValueError, binascii.Error, zlib.error):
+            return None
+        if len(payload) != 8 + size // 4:
+            return None
+        middle = 8 + size // 8
+        return cls(
+            window, size, hashes,
+            current=BloomFilter(size, hashes, payload[8:middle]),
+            previous=BloomFilter(size, hashes, payload[middle:]),
+            started_at=int.from_bytes(payload[:8], 'big'),
+        )
+
+    def __repr__(self):
+        return f'<RotatingBloomFilter window={self.window} started_at={self.started_at}>'
@@ -0,0 +1,162 @@
+"""
+SQLite-бэкенд с профилем соединения для конкурентной нагрузки.
+
+Каждое новое соединение получает PRAGMA из DEFAULT_PRAGMAS (их можно
+переопределить в OPTIONS['pragmas']): WAL-журнал, чтобы читатели не
+ждали писателя, synchronous=NORMAL, mmap и увеличенный кэш страниц.
+
+Дополнительные ключи OPTIONS:
+  pragmas                   - словарь PRAGMA поверх DEFAULT_PRAGMAS;
+  checkpoint_interval       - период фонового WAL-checkpoint в секундах
+                              (0 - не запускать);
+  checkpoint_truncate_pages - размер журнала, после которого журнал
+                              обрезается (TRUNCATE).
+
+Ожидание блокировки записи измеряется на BEGIN: с
+transaction_mode='IMMEDIATE' транзакция берет блокировку сразу, и время
+BEGIN - это время ожидания писателя. Статистика доступна в метриках
+под ключом 'sqlite'.
+
+Каждая запись поднимает версию своей таблицы для кэша запросов
+(fanfiction/query_cache.py).
+"""
+
+import threading
+import time
+
+from django.db.backends.sqlite3 import base as sqlite3_base
+from django.db.utils import OperationalError
+
+from fanfiction import metrics
+from fanfiction.query_cache import track_writes
+
+from .checkpoint import get_checkpointer
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # в КБ: 64 МБ
+    'temp_store': 'MEMORY',
+    'busy_timeout': 20000,
+}
+
+# Ожидание дольше этого порога считаем заметным
+SLOW_LOCK_WAIT = 0.010
+
+
+class LockStats:
+    """Статистика ожидания блокировки записи для одной базы"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.transactions = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.slow_waits = 0
+        self.locked_errors = 0
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.transactions += 1
+            self.total_wait += seconds
+            self.max_wait = max(self.max_wait, seconds)
+            if seconds >= SLOW_LOCK_WAIT:
+                self.slow_waits += 1
+
+    def record_locked(self):
+        with self._lock:
+            self.locked_errors += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'transactions': self.transactions,
+                'avg_wait_ms': round(self.total_wait / self.transactions * 1000, 3) if self.transactions else 0.0,
+                'max_wait_ms': round(self.max_wait * 1000, 3),
+                'slow_waits': self.slow_waits,
+                'locked_errors': self.locked_errors,
+            }
+
+
+_lock_stats = {}
+_checkpoint_paths = {}
+_stats_lock = threading.Lock()
+
+
+def get_lock_stats(alias):
+    with _stats_lock:
+        if alias not in _lock_stats:
+            _lock_stats[alias] = LockStats()
+        return _lock_stats[alias]
+
+
+def sqlite_metrics():
+    """Метрики всех SQLite-баз процесса"""
+    with _stats_lock:
+        aliases = sorted(_lock_stats)
+    result = {}
+    for alias in aliases:
+        result[alias] = get_lock_stats(alias).snapshot()
+        path = _checkpoint_paths.get(alias)
+        if path:
+            result[alias]['checkpoint'] = get_checkpointer(path).stats()
+    return result
+
+
+metrics.register('sqlite', sqlite_metrics)
+
+
+def _is_locked_error(exc):
+    return 'locked' in str(exc) or 'busy' in str(exc)
+
+
+class DatabaseWrapper(sqlite3_base.DatabaseWrapper):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock_stats = get_lock_stats(self.alias)
+        self.execute_wrappers.append(self._count_locked_errors)
+        self.execute_wrappers.append(track_writes)
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        self.pragmas = {**DEFAULT_PRAGMAS, **kwargs.pop('pragmas', {})}
+        self.checkpoint_interval = kwargs.pop('checkpoint_interval', 0)
+        self.checkpoint_truncate_pages = kwargs.pop('checkpoint_truncate_pages', 4096)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        pragmas = dict(self.pragmas)
+
+        use_checkpointer = self.checkpoint_interval and not self.is_in_memory_db()
+        if use_checkpointer:
+            # Журнал переносит фоновый поток; автоматический checkpoint
+            # на запросе остается страховкой на случай его отставания
+            pragmas.setdefault('wal_autocheckpoint', self.checkpoint_truncate_pages)
+
+        for name, value in pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+
+        if use_checkpointer:
+            path = str(self.settings_dict['NAME'])
+            _checkpoint_paths[self.alias] = path
+            get_checkpointer(
+                path,
+                interval=self.checkpoint_interval,
+                truncate_pages=self.checkpoint_truncate_pages,
+            )
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        started = time.perf_counter()
+        super()._start_transaction_under_autocommit()
+        self.lock_stats.record_wait(time.perf_counter() - started)
+
+    def _count_locked_errors(self, execute, sql, params, many, context):
+        try:
+            return execute(sql, params, many, context)
+        except OperationalError as exc:
+            if _is_locked_error(exc):
+                self.lock_stats.record_locked()
+            raise
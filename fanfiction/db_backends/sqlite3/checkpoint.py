@@ -0,0 +1,88 @@
+"""
+Фоновые WAL-checkpoint'ы для SQLite.
+
+Пока WAL-журнал не перенесен в основной файл, он растет, а читатели
+просматривают его целиком. Обычно checkpoint выполняет запрос, который
+закоммитил транзакцию и перешел порог wal_autocheckpoint - то есть
+пользовательский запрос. Здесь это делает отдельный поток со своим
+соединением:
+  * каждые interval секунд - PASSIVE (не ждет читателей и писателей);
+  * если журнал больше truncate_pages страниц - TRUNCATE, чтобы вернуть
+    место на диске.
+"""
+
+import sqlite3
+import threading
+import time
+
+from fanfiction.background import PeriodicTask
+
+
+class WalCheckpointer:
+    """Периодический checkpoint WAL-журнала одного файла базы"""
+
+    def __init__(self, path, interval=30.0, truncate_pages=4096, busy_timeout_ms=100):
+        self.path = str(path)
+        self.interval = interval
+        self.truncate_pages = truncate_pages
+        self.busy_timeout_ms = busy_timeout_ms
+        self._lock = threading.Lock()
+        self._stats = {
+            'runs': 0,
+            'truncates': 0,
+            'busy': 0,
+            'last_wal_pages': 0,
+            'last_checkpointed_pages': 0,
+            'last_duration_ms': 0.0,
+            'last_run_at': None,
+        }
+        self._task = PeriodicTask(f'wal-checkpoint:{self.path}', self.run, interval)
+
+    def start(self):
+        self._task.start()
+
+    def stop(self):
+        self._task.stop()
+
+    def run(self):
+        """Один проход: PASSIVE, при большом журнале - TRUNCATE"""
+        started = time.perf_counter()
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000)
+        try:
+            busy, wal_pages, checkpointed = conn.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchone()
+            truncated = False
+            if not busy and wal_pages >= self.truncate_pages:
+                busy, wal_pages, checkpointed = conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+                truncated = not busy
+        finally:
+            conn.close()
+
+        with self._lock:
+            self._stats['runs'] += 1
+            self._stats['truncates'] += int(truncated)
+            self._stats['busy'] += int(bool(busy))
+            self._stats['last_wal_pages'] = wal_pages
+            self._stats['last_checkpointed_pages'] = checkpointed
+            self._stats['last_duration_ms'] = round((time.perf_counter() - started) * 1000, 3)
+            self._stats['last_run_at'] = time.time()
+
+        return busy, wal_pages, checkpointed
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+_checkpointers = {}
+_checkpointers_lock = threading.Lock()
+
+
+def get_checkpointer(path, **kwargs):
+    """Один checkpointer на файл базы в процессе; запускается при первом вызове"""
+    key = str(path)
+    with _checkpointers_lock:
+        checkpointer = _checkpointers.get(key)
+        if checkpointer is None:
+            checkpointer = _checkpointers[key] = WalCheckpointer(key, **kwargs)
+            checkpointer.start()
+    return checkpointer
@@ -0,0 +1,237 @@
+"""
+Шина сброса локальных кэшей между процессами.
+
+Кэш объектов, кэш страниц, версии таблиц кэша запросов и наборы закладок
+живут в памяти процесса: запись в одном воркере сбрасывает их только у
+него, остальные отдают старое до истечения срока. Шина - таблица в
+отдельном файле SQLite (INVALIDATION_BUS_PATH), в которую только
+дописываются события (вид, ключ, процесс, время):
+
+    invalidation.subscribe('object', forget_object)   # при импорте модуля кэша
+    invalidation.publish('object', 'users.fanfic:12')  # при изменении
+
+publish() сбрасывать ничего не должен - локальный кэш вызывающий сбросил
+сам; событие уходит в шину после коммита текущей транзакции (иначе
+другой процесс успел бы перечитать старую строку). Фоновая задача
+каждого процесса раз в INVALIDATION_BUS_INTERVAL секунд одной
+транзакцией дописывает накопленные события (повторы схлопываются) и
+читает чужие события после последнего прочитанного id, вызывая
+подписчиков. Так кэши других процессов сбрасываются не позже чем
+через два интервала; задержка от публикации до применения видна в
+метриках. События старше INVALIDATION_BUS_RETENTION секунд удаляются.
+"""
+
+import atexit
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+
+from fanfiction import metrics
+from fanfiction.background import PeriodicTask
+from fanfiction.replica import PRIMARY_ALIAS
+
+logger = logging.getLogger(__name__)
+
+# Сколько чужих событий читать за один проход
+READ_BATCH = 1000
+
+# Как часто удалять старые события, секунд
+PRUNE_INTERVAL = 60
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    origin TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    created_at REAL NOT NULL
+)
+'''
+
+_handlers = {}
+
+
+def subscribe(kind, handler):
+    """Регистрирует сброс локального кэша: handler(key) для событий вида kind"""
+    _handlers.setdefault(kind, []).append(handler)
+
+
+class InvalidationBus:
+    """Публикация и чтение событий сброса для одного процесса"""
+
+    def __init__(self, path, interval=0.5, retention=3600):
+        self.path = str(path)
+        self.interval = interval
+        self.retention = retention
+        self.origin = uuid.uuid4().hex
+        self._outbox = {}
+        self._outbox_lock = threading.Lock()
+        self._poll_lock = threading.Lock()
+        self._last_id = None
+        self._pruned_at = 0.0
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'published': 0, 'received': 0, 'applied': 0, 'errors': 0,
+            'last_lag_ms': 0.0, 'max_lag_ms': 0.0, 'total_lag_ms': 0.0,
+        }
+        self._task = PeriodicTask('invalidation-bus', self.poll, interval)
+
+    def start(self):
+        self._task.start()
+
+    def stop(self, timeout=None):
+        self._task.stop(timeout)
+
+    def publish(self, kind, key='', using=PRIMARY_ALIAS):
+        """Ставит событие в очередь на отправку (после коммита транзакции using)"""
+        if transaction.get_connection(using).in_atomic_block:
+            transaction.on_commit(lambda: self._enqueue(kind, key), using=using)
+        else:
+            self._enqueue(kind, key)
+
+    def _enqueue(self, kind, key):
+        with self._outbox_lock:
+            # Повтор одного события до отправки схлопывается, время - первое
+            self._outbox.setdefault((kind, str(key)), time.time())
+
+    def _connect(self):
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(SCHEMA)
+        return conn
+
+    def flush(self):
+        """Отправляет накопленные события, не читая чужие"""
+        with self._poll_lock:
+            conn = self._connect()
+            try:
+                self._flush(conn)
+            finally:
+                conn.close()
+
+    def poll(self):
+        """Отправляет накопленные события и применяет чужие"""
+        with self._poll_lock:
+            conn = self._connect()
+            try:
+                self._flush(conn)
+                self._receive(conn)
+            finally:
+                conn.close()
+
+    def _flush(self, conn):
+        with self._outbox_lock:
+            outbox, self._outbox = self._outbox, {}
+        if not outbox:
+            return
+        conn.executemany(
+            'INSERT INTO events (origin, kind, key, created_at) VALUES (?, ?, ?, ?)',
+            [(self.origin, kind, key, created_at) for (kind, key), created_at in outbox.items()],
+        )
+        with self._stats_lock:
+            self._stats['published'] += len(outbox)
+
+    def _receive(self, conn):
+        if self._last_id is None:
+            # Новый процесс начинает с текущего конца шины: его кэши пусты
+            self._last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM events').fetchone()[0]
+            return
+
+        rows = conn.execute(
+            'SELECT id, origin, kind, key, created_at FROM events WHERE id > ? ORDER BY id LIMIT ?',
+            (self._last_id, READ_BATCH),
+        ).fetchall()
+        now = time.time()
+        for event_id, origin, kind, key, created_at in rows:
+            self._last_id = event_id
+            if origin == self.origin:
+                continue
+            self._apply(kind, key)
+            lag_ms = max(0.0, (now - created_at) * 1000)
+            with self._stats_lock:
+                self._stats['received'] += 1
+                self._stats['last_lag_ms'] = round(lag_ms, 3)
+                self._stats['max_lag_ms'] = round(max(self._stats['max_lag_ms'], lag_ms), 3)
+                self._stats['total_lag_ms'] += lag_ms
+
+        if time.monotonic() - self._pruned_at >= PRUNE_INTERVAL:
+            self._pruned_at = time.monotonic()
+            conn.execute('DELETE FROM events WHERE created_at < ?', (now - self.retention,))
+
+    def _apply(self, kind, key):
+        for handler in _handlers.get(kind, ()):
+            try:
+                handler(key)
+            except Exception:
+                logger.exception('Не удалось применить сброс %s:%s', kind, key)
+                with self._stats_lock:
+                    self._stats['errors'] += 1
+                continue
+            with self._stats_lock:
+                self._stats['applied'] += 1
+
+    def stats(self):
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        with self._outbox_lock:
+            snapshot['pending'] = len(self._outbox)
+        total_lag_ms = snapshot.pop('total_lag_ms')
+        snapshot['avg_lag_ms'] = round(total_lag_ms / snapshot['received'], 3) if snapshot['received'] else 0.0
+        snapshot['last_id'] = self._last_id
+        return snapshot
+
+
+_bus = None
+_bus_lock = threading.Lock()
+
+
+def get_bus():
+    """Шина процесса по настройкам"""
+    global _bus
+    with _bus_lock:
+        if _bus is None:
+            _bus = InvalidationBus(
+                getattr(settings, 'INVALIDATION_BUS_PATH', Path(settings.BASE_DIR) / 'cache' / 'invalidation.sqlite3'),
+                interval=getattr(settings, 'INVALIDATION_BUS_INTERVAL', 0.5),
+                retention=getattr(settings, 'INVALIDATION_BUS_RETENTION', 3600),
+            )
+            # Последние события короткой команды не должны остаться в очереди
+            atexit.register(_bus.flush)
+        return _bus
+
+
+def publish(kind, key='', using=PRIMARY_ALIAS):
+    """Сообщает другим процессам, что их кэш kind/key устарел"""
+    if getattr(settings, 'INVALIDATION_BUS_ENABLED', True):
+        get_bus().publish(kind, key, using)
+
+
+def flush():
+    """Отправляет накопленные события сейчас (циклы команд manage.py без чтения шины)"""
+    if getattr(settings, 'INVALIDATION_BUS_ENABLED', True):
+        get_bus().flush()
+
+
+def start_in_process_tail():
+    """Запускает чтение шины в этом процессе, если оно включено"""
+    if not getattr(settings, 'INVALIDATION_BUS_ENABLED', True):
+        return False
+    get_bus().start()
+    return True
+
+
+def invalidation_metrics():
+    if not getattr(settings, 'INVALIDATION_BUS_ENABLED', True):
+        return {'enabled': False}
+    return {'enabled': True, **get_bus().stats()}
+
+
+metrics.register('invalidation_bus', invalidation_metrics)
@@ -0,0 +1,30 @@
+"""
+Реестр внутренних метрик процесса.
+
+Подсистемы (база данных, кэши, очереди записи) регистрируют функцию,
+возвращающую словарь со своей статистикой; collect() собирает все
+в один снимок для страницы метрик.
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+_providers = {}
+
+
+def register(name, provider):
+    """Регистрирует источник метрик (повторная регистрация заменяет старый)"""
+    _providers[name] = provider
+
+
+def collect():
+    """Снимок всех зарегистрированных метрик"""
+    snapshot = {}
+    for name, provider in sorted(_providers.items()):
+        try:
+            snapshot[name] = provider()
+        except Exception as exc:
+            logger.exception('Не удалось собрать метрики %s', name)
+            snapshot[name] = {'error': str(exc)}
+    return snapshot
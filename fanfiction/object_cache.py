@@ -0,0 +1,270 @@
+"""
+Read-through кэш объектов моделей по первичному ключу.
+
+Страница фанфика, комментарии, закладки и страница автора на каждый
+запрос заново читали одну и ту же строку фанфика или пользователя.
+ObjectCache держит объекты одной модели в памяти процесса:
+
+    fanfics = ObjectCache(Fanfic)
+    fanfic = fanfics.get_cached(pk)            # None, если строки нет
+    fanfic = await fanfics.aget_or_404(pk)
+    author = users.get_cached_by('username', username)
+
+Объекты хранятся сериализованными (pickle): каждый вызов получает свою
+копию, и правка объекта во view не портит кэш. Все кэши процесса делят
+одну LRU-очередь, ограниченную суммарным размером в байтах
+(OBJECT_CACHE_MAX_BYTES), а не числом записей - фанфик с длинной главой
+весит в сотни раз больше пользователя. Слишком большие объекты (больше
+1/16 бюджета) не кэшируются.
+
+Запись сбрасывается сигналами post_save/post_delete модели - сразу и еще
+раз после коммита транзакции, чтобы параллельный запрос не успел
+положить в кэш старую строку. update() и удаление по id сигналов не
+отправляют: такие места вызывают invalidate() сами. Другие процессы
+сбрасывают объект по событию шины (fanfiction/invalidation.py), а без
+нее он живет там не дольше OBJECT_CACHE_TIMEOUT секунд. Промахи
+читаются из основной базы: реплика может отставать и вернуть строку до записи.
+"""
+
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.http import Http404
+
+from fanfiction import invalidation, metrics
+from fanfiction.replica import PRIMARY_ALIAS
+
+# Сколько объектов загружать одним запросом при прогреве
+WARM_BATCH = 500
+
+
+class ByteLRU:
+    """LRU-словарь байтовых значений с ограничением суммарного размера"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key, now=None):
+        now = now if now is not None else time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= now:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout):
+        """Сохраняет значение; False, если оно не влезает в бюджет"""
+        if len(value) > self.max_bytes // 16:
+            return False
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic() + timeout)
+            self._bytes += len(value)
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        value, _ = self._entries.pop(key)
+        self._bytes -= len(value)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries), 'bytes': self._bytes,
+                'max_bytes': self.max_bytes, 'evictions': self.evictions,
+            }
+
+
+_store = None
+_store_lock = threading.Lock()
+_caches = []
+
+
+def get_store():
+    """Общая LRU-очередь всех кэшей объектов процесса"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ByteLRU(getattr(settings, 'OBJECT_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+        return _store
+
+
+def clear_all():
+    get_store().clear()
+
+
+class ObjectCache:
+    """Кэш объектов одной модели по pk"""
+
+    def __init__(self, model, using=PRIMARY_ALIAS):
+        self.model = model
+        self.label = model._meta.label_lower
+        self.using = using
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+        for name, signal in (('post_save', post_save), ('post_delete', post_delete)):
+            signal.connect(self._on_change, sender=model, weak=False, dispatch_uid=f'object_cache:{self.label}:{name}')
+        _caches.append(self)
+
+    def _key(self, pk):
+        return (self.label, int(pk))
+
+    def _timeout(self):
+        return getattr(settings, 'OBJECT_CACHE_TIMEOUT', 30)
+
+    def _count(self, hit):
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _lookup(self, pk):
+        if not self._timeout():
+            return None
+        blob = get_store().get(self._key(pk))
+        self._count(blob is not None)
+        return pickle.loads(blob) if blob is not None else None
+
+    def _remember(self, obj):
+        if obj is not None and self._timeout():
+            get_store().set(self._key(obj.pk), pickle.dumps(obj, pickle.HIGHEST_PROTOCOL), self._timeout())
+        return obj
+
+    def _queryset(self):
+        return self.model._default_manager.using(self.using)
+
+    def get_cached(self, pk):
+        """Объект по pk из кэша или из базы; None, если строки нет"""
+        try:
+            pk = int(pk)
+        except (TypeError, ValueError):
+            return None
+        obj = self._lookup(pk)
+        if obj is None:
+            obj = self._remember(self._queryset().filter(pk=pk).first())
+        return obj
+
+    async def aget_cached(self, pk):
+        try:
+            pk = int(pk)
+        except (TypeError, ValueError):
+            return None
+        obj = self._lookup(pk)
+        if obj is None:
+            obj = self._remember(await self._queryset().filter(pk=pk).afirst())
+        return obj
+
+    def warm(self, pks):
+        """Загружает в кэш недостающие объекты пачками; возвращает их число"""
+        if not self._timeout():
+            return 0
+        store = get_store()
+        missing = sorted({int(pk) for pk in pks if store.get(self._key(pk)) is None})
+        loaded = 0
+        for start in range(0, len(missing), WARM_BATCH):
+            for obj in self._queryset().filter(pk__in=missing[start:start + WARM_BATCH]):
+                self._remember(obj)
+                loaded += 1
+        return loaded
+
+    def get_or_404(self, pk):
+        obj = self.get_cached(pk)
+        if obj is None:
+            raise Http404(f'{self.model._meta.object_name} не найден')
+        return obj
+
+    async def aget_or_404(self, pk):
+        obj = await self.aget_cached(pk)
+        if obj is None:
+            raise Http404(f'{self.model._meta.object_name} не найден')
+        return obj
+
+    def get_cached_by(self, field, value):
+        """Объект по уникальному полю: кэш помнит pk для значения поля"""
+        alias = (self.label, field, value)
+        store = get_store()
+        blob = store.get(alias) if self._timeout() else None
+        if blob is not None:
+            obj = self.get_cached(int(blob))
+            # Поле могло измениться - тогда ищем заново
+            if obj is not None and getattr(obj, field) == value:
+                return obj
+        obj = self._remember(self._queryset().filter(**{field: value}).first())
+        if obj is not None and self._timeout():
+            store.set(alias, str(obj.pk).encode(), self._timeout())
+        return obj
+
+    def invalidate(self, *pks):
+        """Сбрасывает объекты сейчас и еще раз после коммита текущей транзакции"""
+        pks = [pk for pk in pks if pk is not None]
+        if not pks:
+            return
+        self._forget(pks)
+        connection = transaction.get_connection(self.using)
+        if connection.in_atomic_block:
+            transaction.on_commit(lambda: self._forget(pks), using=self.using)
+        for pk in pks:
+            invalidation.publish('object', f'{self.label}:{pk}', using=self.using)
+
+    def _forget(self, pks):
+        store = get_store()
+        for pk in pks:
+            store.delete(self._key(pk))
+
+    def _on_change(self, sender, instance, **kwargs):
+        self.invalidate(instance.pk)
+
+    def stats(self):
+        with self._stats_lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+def _forget_published(key):
+    """Событие шины от другого процесса: 'метка модели:pk'"""
+    label, pk = key.rsplit(':', 1)
+    for cache in _caches:
+        if cache.label == label:
+            cache._forget([int(pk)])
+
+
+invalidation.subscribe('object', _forget_published)
+
+
+def object_cache_metrics():
+    snapshot = get_store().stats()
+    for cache in _caches:
+        snapshot[cache.label] = cache.stats()
+    return snapshot
+
+
+metrics.register('object_cache', object_cache_metrics)
@@ -0,0 +1,198 @@
+"""
+Кэш целых страниц для анонимных посетителей.
+
+Главная, популярное, новинки, теги и страница фанфика у всех анонимных
+посетителей одинаковы, но рендерились заново на каждый запрос. Декоратор
+anonymous_page_cache сохраняет готовый ответ в кэше Django и отдает его
+следующим анонимным посетителям без запросов к базе и рендера шаблона:
+
+    @anonymous_page_cache
+    @use_read_replica
+    async def index_view(request):
+        ...
+
+Кэш используется только для GET/HEAD-запросов без входа и без
+flash-сообщений; ключ - хост, путь и нормализованная строка запроса
+(параметры отсортированы, метки рекламных кампаний отброшены). В ключ
+входит номер версии: bump_version() после изменения фанфиков или
+комментариев делает недействительными сразу все страницы. Кэш Django
+локален для процесса, поэтому в других процессах страница живет не
+дольше PAGE_CACHE_TIMEOUT секунд - этим же сроком ограничена
+устаревшая статистика (счетчики просмотров меняются без сигналов).
+"""
+
+import threading
+from functools import wraps
+from hashlib import md5
+from urllib.parse import urlencode
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+
+from fanfiction import invalidation, metrics
+
+VERSION_KEY = 'page_cache:version'
+PAGE_KEY = 'page_cache:{}:{}'
+
+# Параметры, которые не меняют страницу
+IGNORED_PARAMS = ('fbclid', 'gclid', 'yclid')
+IGNORED_PREFIXES = ('utm_',)
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'stored': 0, 'bypassed': 0, 'bumps': 0}
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def _timeout():
+    return getattr(settings, 'PAGE_CACHE_TIMEOUT', 60)
+
+
+def bump_version():
+    """Делает недействительными все закэшированные страницы (во всех процессах)"""
+    _bump()
+    invalidation.publish('page')
+
+
+def _bump(key=''):
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        # Версии еще нет (или ее вытеснили) - начинаем заново
+        cache.set(VERSION_KEY, 1, None)
+    _count('bumps')
+
+
+invalidation.subscribe('page', _bump)
+
+
+def _version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, None)
+        version = cache.get(VERSION_KEY, 1)
+    return version
+
+
+def normalized_query(request):
+    """Строка запроса без меток кампаний, параметры по порядку"""
+    return urlencode(sorted(
+        (name, value)
+        for name, values in request.GET.lists()
+        if name not in IGNORED_PARAMS and not name.startswith(IGNORED_PREFIXES)
+        for value in values
+    ))
+
+
+def page_key(request):
+    raw = f'{request.get_host()}{request.path}?{normalized_query(request)}'
+    return PAGE_KEY.format(_version(), md5(raw.encode(), usedforsecurity=False).hexdigest())
+
+
+def _is_cacheable_request(request):
+    """Анонимный GET без flash-сообщений и не AJAX"""
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if request.META.get('HTTP_X_REQUESTED_WITH') == 'XMLHttpRequest':
+        return False
+    if request.user.is_authenticated:
+        return False
+    # len() загружает сообщения и помечает их прочитанными - возвращаем метку
+    storage = messages.get_messages(request)
+    used = storage.used
+    try:
+        return len(storage) == 0
+    finally:
+        storage.used = used
+
+
+def _needs_session(request):
+    # Без cookie сессии пользователь и сообщения определяются без базы
+    return settings.SESSION_COOKIE_NAME in request.COOKIES
+
+
+def _cached_response(request, key):
+    entry = cache.get(key)
+    if entry is None:
+        _count('misses')
+        return None
+    _count('hits')
+    status, headers, content = entry
+    etag = headers.get('ETag')
+    if etag:
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+    response = HttpResponse(content, status=status)
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
+def _store(request, key, response):
+    """Сохраняет ответ, если он одинаков для всех анонимных посетителей"""
+    if response.status_code != 200 or response.streaming or response.cookies:
+        return
+    # В странице CSRF-токен этого посетителя
+    if request.META.get('CSRF_COOKIE_USED'):
+        return
+    cache_control = response.get('Cache-Control', '')
+    if 'private' in cache_control or 'no-store' in cache_control:
+        return
+    cache.set(key, (response.status_code, dict(response.headers), response.content), _timeout())
+    _count('stored')
+
+
+def anonymous_page_cache(view_func):
+    """Кэширует ответы view для анонимных посетителей (синхронных и async)"""
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def wrapper(request, *args, **kwargs):
+            if not _timeout():
+                return await view_func(request, *args, **kwargs)
+            if _needs_session(request):
+                cacheable = await sync_to_async(_is_cacheable_request)(request)
+            else:
+                cacheable = _is_cacheable_request(request)
+            if not cacheable:
+                _count('bypassed')
+                return await view_func(request, *args, **kwargs)
+
+            key = page_key(request)
+            response = _cached_response(request, key)
+            if response is None:
+                response = await view_func(request, *args, **kwargs)
+                _store(request, key, response)
+            return response
+        return wrapper
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if not _timeout():
+            return view_func(request, *args, **kwargs)
+        if not _is_cacheable_request(request):
+            _count('bypassed')
+            return view_func(request, *args, **kwargs)
+
+        key = page_key(request)
+        response = _cached_response(request, key)
+        if response is None:
+            response = view_func(request, *args, **kwargs)
+            _store(request, key, response)
+        return response
+    return wrapper
+
+
+def page_cache_metrics():
+    with _stats_lock:
+        return dict(_stats)
+
+
+metrics.register('page_cache', page_cache_metrics)
@@ -0,0 +1,262 @@
+"""
+Кэш результатов запросов ORM с версиями таблиц.
+
+Списки популярных и новых фанфиков, страницы тегов и списки профиля
+между записями раз за разом выполняют один и тот же SQL. Queryset модели
+с менеджером CachingQuerySet.as_manager() можно пометить кэшируемым:
+
+    fanfics = Fanfic.objects.filter(status='published').cached()
+    cards = fanfic_cards(fanfics.order_by('-created_at')[:10])
+    fresh = fanfics.uncached()       # отказ для конкретной выборки
+
+Метка переходит ко всем queryset, построенным из помеченного (filter,
+values, срезы). Строки, count() и exists() кэшируются в кэше Django по
+ключу из SQL, параметров и версий всех таблиц, упомянутых в SQL (в том
+числе в подзапросах).
+
+Версии таблиц поднимает обертка execute соединений (подключается в
+fanfiction/db_backends/sqlite3): любой INSERT, UPDATE, DELETE или
+REPLACE - через ORM, update(), bulk_create или сырой SQL - меняет версию
+своей таблицы сразу и еще раз после коммита транзакции, так что старые
+результаты просто перестают находиться. DDL сбрасывает все версии.
+
+Выборки из реплики, которая еще не догнала последнюю запись в их таблицы
+(снимок начат раньше записи), дополнительно помечаются меткой снимка: ее
+строки попадают в кэш под новой версией, но только до следующего
+обновления снимка, как и без кэша. Снимок, начатый после записи, уже
+совпадает с основной базой - его результаты живут до следующей записи,
+а не до следующего снимка.
+
+Версии живут в памяти процесса: записи других процессов (команды
+manage.py, другие воркеры) поднимают их через шину сброса
+(fanfiction/invalidation.py), а без нее видны не позже чем через
+QUERY_CACHE_TIMEOUT секунд. В шину попадают только записи в таблицы,
+которые могут читать кэшируемые выборки (_shared_tables), - сессии,
+аналитика и прочие таблицы событий не порождают.
+"""
+
+import re
+import threading
+import time
+import uuid
+from hashlib import md5
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.db import connections, transaction
+from django.db.models import QuerySet
+
+from fanfiction import invalidation, metrics
+from fanfiction.replica import PRIMARY_ALIAS, REPLICA_ALIAS, replica_stamp
+from fanfiction.routers import ANALYTICS_ALIAS, is_analytics_model
+
+QUERY_KEY = 'query_cache:{}'
+
+WRITE_RE = re.compile(
+    r'^\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)\s+["`\[]?(\w+)',
+    re.IGNORECASE,
+)
+DDL_RE = re.compile(r'^\s*(?:CREATE|DROP|ALTER)\b', re.IGNORECASE)
+
+# Ключи кэша принадлежат процессу: версии таблиц в других процессах свои
+_process_token = uuid.uuid4().hex
+
+_lock = threading.Lock()
+_versions = {}
+# Время последней записи в таблицу (time.time())
+_written_at = {}
+_epoch = 0
+_table_names = None
+_shared_table_names = None
+_stats = {'hits': 0, 'misses': 0, 'uncacheable': 0, 'bumps': 0}
+
+
+def _count(name):
+    with _lock:
+        _stats[name] += 1
+
+
+def _timeout():
+    return getattr(settings, 'QUERY_CACHE_TIMEOUT', 60)
+
+
+def bump_table(table):
+    """Делает недействительными все результаты, читавшие таблицу"""
+    with _lock:
+        _versions[table] = _versions.get(table, 0) + 1
+        _written_at[table] = time.time()
+        _stats['bumps'] += 1
+
+
+def clear():
+    """Делает недействительными все закэшированные результаты"""
+    global _epoch
+    with _lock:
+        _epoch += 1
+
+
+def track_writes(execute, sql, params, many, context):
+    """Обертка execute: запись в таблицу поднимает ее версию"""
+    result = execute(sql, params, many, context)
+    if sql[:6].upper() == 'SELECT':
+        return result
+
+    match = WRITE_RE.match(sql)
+    if match:
+        table = match.group(1)
+        bump_table(table)
+        connection = context['connection']
+        # Параллельный запрос мог прочитать старые строки под новой версией
+        # до коммита - поднимаем версию еще раз, когда запись станет видна
+        if connection.in_atomic_block:
+            transaction.on_commit(lambda: bump_table(table), using=connection.alias)
+        if connection.alias != ANALYTICS_ALIAS and table in _shared_tables():
+            invalidation.publish('table', table, using=connection.alias)
+    elif DDL_RE.match(sql):
+        clear()
+    return result
+
+
+invalidation.subscribe('table', bump_table)
+
+
+def _tables():
+    """Имена таблиц всех моделей вместе с их видом в SQL"""
+    global _table_names
+    if _table_names is None:
+        quote = connections[PRIMARY_ALIAS].ops.quote_name
+        _table_names = sorted({
+            (model._meta.db_table, quote(model._meta.db_table))
+            for model in apps.get_models(include_auto_created=True)
+        })
+    return _table_names
+
+
+def _shared_tables():
+    """Таблицы, которые читают кэшируемые выборки в других процессах
+
+    Модели с менеджером CachingQuerySet и связанные с ними модели (их
+    таблицы попадают в выборки через соединения и подзапросы), кроме
+    моделей аналитики.
+    """
+    global _shared_table_names
+    if _shared_table_names is None:
+        models = set()
+        for model in apps.get_models():
+            if not issubclass(model._default_manager._queryset_class, CachingQuerySet):
+                continue
+            models.add(model)
+            models.update(field.related_model for field in model._meta.get_fields() if field.related_model)
+        _shared_table_names = frozenset(
+            model._meta.db_table for model in models if not is_analytics_model(model)
+        )
+    return _shared_table_names
+
+
+def tables_in(sql):
+    return [table for table, quoted in _tables() if quoted in sql]
+
+
+def _versions_of(tables):
+    with _lock:
+        return _epoch, tuple(_versions.get(table, 0) for table in tables)
+
+
+def _last_write(tables):
+    with _lock:
+        return max((_written_at.get(table, 0.0) for table in tables), default=0.0)
+
+
+class CachingQuerySet(QuerySet):
+    """QuerySet с кэшем результатов по версиям таблиц (см. .cached())"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._query_cache_timeout = None
+
+    def cached(self, timeout=None):
+        """Кэшировать результаты этой выборки (timeout - срок в секундах)"""
+        clone = self._chain()
+        clone._query_cache_timeout = timeout if timeout is not None else _timeout()
+        return clone
+
+    def uncached(self):
+        """Выполнять эту выборку без кэша"""
+        clone = self._chain()
+        clone._query_cache_timeout = None
+        return clone
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._query_cache_timeout = self._query_cache_timeout
+        return clone
+
+    def _cache_key(self, kind):
+        """Ключ результата или None, если выборку кэшировать нельзя"""
+        if not self._query_cache_timeout or not _timeout():
+            return None
+        if self._prefetch_related_lookups or self.query.select_for_update:
+            _count('uncacheable')
+            return None
+
+        db = self.db
+        try:
+            sql, params = self.query.get_compiler(using=db).as_sql()
+        except EmptyResultSet:
+            _count('uncacheable')
+            return None
+
+        tables = tables_in(sql)
+        stamp = None
+        if db == REPLICA_ALIAS:
+            stamp = replica_stamp()
+            # Снимок начат после последней записи - реплика догнала основную базу
+            if stamp is not None and stamp > _last_write(tables):
+                stamp = None
+        raw = repr((
+            _process_token, db, stamp, kind, self._iterable_class.__name__, self._fields,
+            sql, params, _versions_of(tables),
+        ))
+        return QUERY_KEY.format(md5(raw.encode(), usedforsecurity=False).hexdigest())
+
+    def _cached_call(self, kind, compute):
+        key = self._cache_key(kind)
+        if key is None:
+            return compute()
+        value = cache.get(key)
+        if value is not None:
+            _count('hits')
+            return value
+        _count('misses')
+        value = compute()
+        cache.set(key, value, self._query_cache_timeout)
+        return value
+
+    def _fetch_all(self):
+        if self._result_cache is None and self._query_cache_timeout:
+            self._result_cache = self._cached_call('rows', lambda: list(self._iterable_class(self)))
+        super()._fetch_all()
+
+    def count(self):
+        if self._result_cache is not None or not self._query_cache_timeout:
+            return super().count()
+        return self._cached_call('count', super().count)
+
+    def exists(self):
+        if self._result_cache is not None or not self._query_cache_timeout:
+            return super().exists()
+        return self._cached_call('exists', super().exists)
+
+
+def query_cache_metrics():
+    with _lock:
+        snapshot = dict(_stats)
+        snapshot['tables'] = dict(sorted(_versions.items()))
+    lookups = snapshot['hits'] + snapshot['misses']
+    snapshot['hit_ratio'] = round(snapshot['hits'] / lookups, 3) if lookups else 0.0
+    return snapshot
+
+
+metrics.register('query_cache', query_cache_metrics)
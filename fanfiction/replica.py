@@ -0,0 +1,172 @@
+"""
+Локальная read-реплика SQLite.
+
+Реплика - снимок основной базы, сделанный через backup API SQLite и
+периодически обновляемый. Снимок пишется во временный файл и атомарно
+подменяет старый (os.replace), поэтому читатели видят либо старую, либо
+новую версию целиком. Время изменения файла - момент начала снимка: все,
+что закоммичено раньше, в снимке есть. Соединения закрываются в конце
+каждого запроса, так что следующий запрос открывает уже новый файл.
+
+Фоновое обновление запускается в каждом процессе сервера, но снимки
+делает только тот, кто держит файловую блокировку рядом с репликой
+(<реплика>.lock); остальные ждут, пока она освободится.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+
+from fanfiction import metrics
+from fanfiction.background import PeriodicTask
+from fanfiction.single_flight import KeyLock
+
+logger = logging.getLogger(__name__)
+
+REPLICA_ALIAS = 'replica'
+PRIMARY_ALIAS = 'default'
+
+
+class ReplicaSnapshotter:
+    """Копирует основную базу в файл реплики"""
+
+    def __init__(self, source_path, replica_path, interval=5.0):
+        self.source_path = str(source_path)
+        self.replica_path = str(replica_path)
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._leader_lock = None
+        self._stats = {'refreshes': 0, 'last_duration_ms': 0.0, 'last_refresh_at': None, 'leader': False}
+        self._task = PeriodicTask('replica-refresh', self.refresh_as_leader, interval)
+
+    def start(self):
+        self._task.start()
+
+    def refresh(self):
+        """Делает новый снимок и атомарно подменяет им реплику"""
+        started = time.perf_counter()
+        started_at = time.time()
+        tmp_path = f'{self.replica_path}.tmp-{os.getpid()}'
+
+        source = sqlite3.connect(self.source_path)
+        target = sqlite3.connect(tmp_path)
+        try:
+            # Чтение в WAL-режиме не блокирует писателей основной базы
+            source.backup(target)
+            # Журнал реплики - обычный: у снимка не должно быть -wal файла,
+            # который можно спутать с журналом предыдущего снимка
+            target.execute('PRAGMA journal_mode = DELETE')
+        finally:
+            target.close()
+            source.close()
+
+        os.utime(tmp_path, (started_at, started_at))
+        os.replace(tmp_path, self.replica_path)
+
+        with self._lock:
+            self._stats['refreshes'] += 1
+            self._stats['last_duration_ms'] = round((time.perf_counter() - started) * 1000, 3)
+            self._stats['last_refresh_at'] = time.time()
+
+    def refresh_as_leader(self):
+        """Шаг фоновой задачи: снимки делает один процесс на сервер
+
+        Блокировка берется без ожидания и держится, пока процесс жив; после
+        его остановки ее возьмет следующий. True, если снимок сделан.
+        """
+        if self._leader_lock is None:
+            lock = KeyLock(Path(f'{self.replica_path}.lock'))
+            if not lock.acquire():
+                return False
+            self._leader_lock = lock
+            with self._lock:
+                self._stats['leader'] = True
+        self.refresh()
+        return True
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+_snapshotter = None
+_snapshotter_lock = threading.Lock()
+_freshness = {'checked_at': 0.0, 'fresh': False}
+
+
+def get_snapshotter():
+    """Снимальщик реплики по настройкам (None, если реплика не настроена)"""
+    global _snapshotter
+    if REPLICA_ALIAS not in settings.DATABASES:
+        return None
+    with _snapshotter_lock:
+        if _snapshotter is None:
+            _snapshotter = ReplicaSnapshotter(
+                settings.DATABASES[PRIMARY_ALIAS]['NAME'],
+                settings.DATABASES[REPLICA_ALIAS]['NAME'],
+                interval=getattr(settings, 'REPLICA_REFRESH_INTERVAL', 5.0),
+            )
+    return _snapshotter
+
+
+def start_in_process_refresh():
+    """Запускает обновление реплики в этом процессе, если оно включено"""
+    snapshotter = get_snapshotter()
+    if snapshotter is None or not getattr(settings, 'REPLICA_REFRESH_IN_PROCESS', False):
+        return False
+    # Тестовую базу в памяти копировать некуда и незачем
+    if connections[PRIMARY_ALIAS].is_in_memory_db():
+        return False
+    snapshotter.start()
+    return True
+
+
+def replica_is_fresh():
+    """Можно ли читать из реплики: файл есть и отстает не больше REPLICA_MAX_LAG"""
+    if REPLICA_ALIAS not in settings.DATABASES:
+        return False
+
+    replica = connections[REPLICA_ALIAS]
+    # В тестах реплика - зеркало тестовой базы в памяти
+    if replica.is_in_memory_db():
+        return True
+
+    now = time.monotonic()
+    if now - _freshness['checked_at'] < 1.0:
+        return _freshness['fresh']
+
+    try:
+        age = time.time() - os.path.getmtime(replica.settings_dict['NAME'])
+        fresh = age <= getattr(settings, 'REPLICA_MAX_LAG', 30.0)
+    except OSError:
+        fresh = False
+
+    _freshness.update(checked_at=now, fresh=fresh)
+    return fresh
+
+
+def replica_stamp():
+    """Метка текущего снимка реплики - время его начала; меняется при каждом обновлении"""
+    replica = connections[REPLICA_ALIAS]
+    if replica.is_in_memory_db():
+        return 0
+    try:
+        return os.path.getmtime(replica.settings_dict['NAME'])
+    except OSError:
+        return None
+
+
+def replica_metrics():
+    snapshotter = get_snapshotter()
+    if snapshotter is None:
+        return {'configured': False}
+    return {'configured': True, 'fresh': replica_is_fresh(), **snapshotter.stats()}
+
+
+metrics.register('replica', replica_metrics)
@@ -0,0 +1,214 @@
+"""
+Маршрутизация запросов к базам данных.
+
+ReadReplicaRouter отправляет чтения публичных страниц (списки и поиск,
+помеченные декоратором use_read_replica) в read-реплику, а все записи -
+в основную базу. В реплику идут только модели из REPLICA_READ_MODELS.
+Запрос, который что-то записал, до конца читает из основной базы, а
+клиент получает cookie и еще REPLICA_PIN_SECONDS секунд читает из
+основной базы - так он сразу видит свои изменения.
+
+AnalyticsRouter держит модели из ANALYTICS_MODELS (история просмотров,
+сессии) в отдельном файле SQLite со своим WAL и своей блокировкой записи,
+чтобы всплески аналитики не задерживали комментарии и закладки. Между
+базами данные связаны только по id.
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.utils.decorators import sync_and_async_middleware
+
+from fanfiction.replica import PRIMARY_ALIAS, REPLICA_ALIAS, replica_is_fresh
+
+PIN_COOKIE = 'primary_pin'
+ANALYTICS_ALIAS = 'analytics'
+
+
+class RoutingState:
+    """Состояние маршрутизации одного запроса"""
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.use_replica = False
+        self.wrote = False
+
+
+_routing_state = ContextVar('routing_state', default=None)
+
+
+def current_state():
+    return _routing_state.get()
+
+
+def mark_wrote():
+    """Отмечает, что текущий запрос записал данные в основную базу"""
+    state = current_state()
+    if state is not None:
+        state.wrote = True
+
+
+def analytics_db():
+    """Алиас базы аналитики
+
+    В тестах база аналитики - зеркало тестовой базы в памяти, и ее таблицы
+    доступны только через основное соединение.
+    """
+    if ANALYTICS_ALIAS not in settings.DATABASES:
+        return PRIMARY_ALIAS
+    mirror = settings.DATABASES[ANALYTICS_ALIAS].get('TEST', {}).get('MIRROR')
+    if mirror == PRIMARY_ALIAS and connections[PRIMARY_ALIAS].is_in_memory_db():
+        return PRIMARY_ALIAS
+    return ANALYTICS_ALIAS
+
+
+def is_analytics_model(model):
+    return model._meta.label_lower in getattr(settings, 'ANALYTICS_MODELS', ())
+
+
+class AnalyticsRouter:
+    """Модели аналитики - в отдельную базу, остальное решают следующие роутеры"""
+
+    def db_for_read(self, model, **hints):
+        if is_analytics_model(model):
+            return analytics_db()
+        # Фанфик или пользователь, подгружаемый из записи аналитики, лежит в основной базе
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db == ANALYTICS_ALIAS:
+            return PRIMARY_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        if is_analytics_model(model):
+            return analytics_db()
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Записи аналитики ссылаются на основную базу по id
+        if is_analytics_model(obj1) or is_analytics_model(obj2):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        analytics = model_name is not None and (
+            f'{app_label}.{model_name}' in getattr(settings, 'ANALYTICS_MODELS', ())
+        )
+        if db == ANALYTICS_ALIAS:
+            return analytics
+        if analytics:
+            return db == analytics_db()
+        return None
+
+
+class ReadReplicaRouter:
+    """Чтения помеченных страниц - в реплику, записи - в основную базу"""
+
+    def db_for_read(self, model, **hints):
+        state = current_state()
+        if state is None or not state.use_replica or state.pinned or state.wrote:
+            return None
+        # Пользователи и сессии всегда читаются из основной базы
+        if model._meta.label_lower not in settings.REPLICA_READ_MODELS:
+            return None
+        # Открытую транзакцию основной базы видит только ее соединение
+        if connections[PRIMARY_ALIAS].in_atomic_block:
+            return None
+        if not replica_is_fresh():
+            return None
+        return REPLICA_ALIAS
+
+    def db_for_write(self, model, **hints):
+        mark_wrote()
+        return PRIMARY_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплика - копия основной базы, связи между ними допустимы
+        if {obj1._state.db, obj2._state.db} <= {PRIMARY_ALIAS, REPLICA_ALIAS}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схема реплики приходит вместе со снимком
+        if db == REPLICA_ALIAS:
+            return False
+        return None
+
+
+@sync_and_async_middleware
+def primary_pin_middleware(get_response):
+    """Создает состояние маршрутизации и закрепляет писавших клиентов за основной базой"""
+    pin_seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 30)
+
+    def start(request):
+        try:
+            pinned_until = float(request.COOKIES.get(PIN_COOKIE, 0))
+        except ValueError:
+            pinned_until = 0
+        return RoutingState(pinned=pinned_until > time.time())
+
+    def finish(state, response):
+        if state.wrote:
+            response.set_cookie(
+                PIN_COOKIE, str(int(time.time() + pin_seconds)),
+                max_age=pin_seconds, httponly=True, samesite='Lax',
+            )
+        return response
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            state = start(request)
+            token = _routing_state.set(state)
+            try:
+                response = await get_response(request)
+            finally:
+                _routing_state.reset(token)
+            return finish(state, response)
+    else:
+        def middleware(request):
+            state = start(request)
+            token = _routing_state.set(state)
+            try:
+                response = get_response(request)
+            finally:
+                _routing_state.reset(token)
+            return finish(state, response)
+
+    return middleware
+
+
+@contextmanager
+def replica_reads():
+    """Чтения вне запроса (фоновые задачи) маршрутизируются как на страницах с use_read_replica"""
+    state = RoutingState()
+    state.use_replica = True
+    token = _routing_state.set(state)
+    try:
+        yield state
+    finally:
+        _routing_state.reset(token)
+
+
+def use_read_replica(view_func):
+    """Разрешает view читать из реплики (только для публичных страниц чтения)"""
+    def enable():
+        state = current_state()
+        if state is not None:
+            state.use_replica = True
+
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def wrapper(request, *args, **kwargs):
+            enable()
+            return await view_func(request, *args, **kwargs)
+        return wrapper
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        enable()
+        return view_func(request, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,200 @@
+"""
+Сессии в кэше процесса с отложенной записью в базу.
+
+Стандартный движок db читал строку django_session на каждый запрос
+авторизованного пользователя и перезаписывал ее при каждом изменении
+сессии. Этот движок (SESSION_ENGINE = 'fanfiction.session_store') - это
+cached_db, у которого:
+
+  - сессия читается из кэша SESSION_CACHE_ALIAS (локальный кэш
+    процесса), база - только при промахе;
+  - изменение сразу попадает в кэш, а в базу уходит через очередь
+    записи (fanfiction/writer.py), не задерживая ответ; неудачная запись
+    повторяется до SESSION_WRITE_RETRIES раз, после чего копия в кэше
+    выбрасывается - следующий запрос читает то, что есть в базе;
+  - сохранение без изменений в базу не пишется;
+  - создание сессии (вход) и удаление (выход, смена ключа) пишутся в
+    базу сразу - от них зависит, кто авторизован.
+
+Записанное в базу изменение и удаление рассылаются по шине сброса
+(fanfiction/invalidation.py): другие процессы выбрасывают свою копию
+сессии и перечитывают ее из базы. Отложенная запись обновляет только
+существующую строку, поэтому не воскрешает сессию, удаленную выходом.
+Неудачная запись не повторяется и не сбрасывает кэш, если за ней уже
+поставлена более новая запись той же сессии.
+
+Флеш-сообщения лежат в cookie (MESSAGE_STORAGE), а не в сессии: копия
+сессии в кэше одного процесса не видна другим, и сообщение после
+редиректа на другой воркер потерялось бы.
+"""
+
+import copy
+import itertools
+import logging
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.sessions.backends.cached_db import KEY_PREFIX, SessionStore as CachedDBStore
+from django.core.cache import caches
+from django.db import router
+
+from fanfiction import invalidation, metrics, writer
+
+logger = logging.getLogger(__name__)
+
+_stats_lock = threading.Lock()
+_stats = {
+    'db_reads': 0, 'created': 0, 'deferred_writes': 0, 'unchanged': 0, 'deleted': 0,
+    'write_retries': 0, 'write_failures': 0, 'superseded': 0,
+}
+
+# Номер последней поставленной отложенной записи каждой сессии
+_sequence = itertools.count(1)
+_latest = {}
+_latest_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def _write_session(model, session_key, session_data, expire_date, using):
+    """Отложенная запись: обновляет строку сессии, если ее еще не удалили"""
+    updated = model.objects.using(using).filter(session_key=session_key).update(
+        session_data=session_data, expire_date=expire_date,
+    )
+    if updated:
+        invalidation.publish('session', session_key, using=using)
+
+
+def _is_latest(cache_key, number):
+    with _latest_lock:
+        return _latest.get(cache_key) == number
+
+
+def _forget_write(cache_key, number):
+    """Снимает номер записи; True, если она была последней для сессии"""
+    with _latest_lock:
+        if _latest.get(cache_key) != number:
+            return False
+        del _latest[cache_key]
+        return True
+
+
+def _submit_write(cache_key, args, using, number=None, attempt=0):
+    """Ставит отложенную запись в очередь; при ошибке повторяет ее
+
+    Сессия в записи целиком, поэтому неудачу записи, за которой уже
+    поставлена более новая, не повторяем: повтор затер бы новые данные.
+    """
+    if number is None:
+        number = next(_sequence)
+        with _latest_lock:
+            _latest[cache_key] = number
+
+    def failed(error):
+        if not _is_latest(cache_key, number):
+            _count('superseded')
+            logger.warning('Запись сессии не удалась, ее заменит более новая: %r', error)
+            return
+        if attempt < getattr(settings, 'SESSION_WRITE_RETRIES', 3):
+            _count('write_retries')
+            logger.warning('Запись сессии не удалась, повторяем: %r', error)
+            _submit_write(cache_key, args, using, number, attempt + 1)
+            return
+        _count('write_failures')
+        logger.error('Запись сессии не удалась', exc_info=error)
+        if _forget_write(cache_key, number):
+            # Изменение не сохранено - не отдаем его из кэша как сохраненное
+            caches[settings.SESSION_CACHE_ALIAS].delete(cache_key)
+
+    def done(future):
+        if future.exception() is not None:
+            failed(future.exception())
+        else:
+            _forget_write(cache_key, number)
+
+    try:
+        future = writer.submit(_write_session, *args, using, using=using)
+    except Exception as error:
+        failed(error)
+        return
+    future.add_done_callback(done)
+
+
+class SessionStore(CachedDBStore):
+    """cached_db с отложенной записью в базу"""
+
+    def _remember_persisted(self, data):
+        # Данные, которые сейчас лежат в базе
+        self._persisted = copy.deepcopy(data)
+        return data
+
+    def load(self):
+        return self._remember_persisted(super().load())
+
+    async def aload(self):
+        return self._remember_persisted(await super().aload())
+
+    def _get_session_from_db(self):
+        _count('db_reads')
+        return super()._get_session_from_db()
+
+    async def _aget_session_from_db(self):
+        _count('db_reads')
+        return await super()._aget_session_from_db()
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        if must_create:
+            # Новая сессия пишется сразу: ключ должен быть уникальным
+            super().save(must_create)
+            _count('created')
+            self._remember_persisted(self._get_session(no_load=True))
+            return
+
+        data = self._get_session()
+        if data == getattr(self, '_persisted', None):
+            _count('unchanged')
+            return
+
+        self._cache.set(self.cache_key, data, self.get_expiry_age())
+        _submit_write(
+            self.cache_key,
+            (self.model, self.session_key, self.encode(data), self.get_expiry_date()),
+            router.db_for_write(self.model),
+        )
+        _count('deferred_writes')
+        self._remember_persisted(data)
+
+    async def asave(self, must_create=False):
+        await sync_to_async(self.save)(must_create)
+
+    def delete(self, session_key=None):
+        session_key = session_key or self.session_key
+        super().delete(session_key)
+        if session_key is not None:
+            _count('deleted')
+            invalidation.publish('session', session_key, using=router.db_for_write(self.model))
+
+    async def adelete(self, session_key=None):
+        await sync_to_async(self.delete)(session_key)
+
+
+def _forget_session(session_key):
+    """Событие шины: сессию изменили или удалили в другом процессе"""
+    caches[settings.SESSION_CACHE_ALIAS].delete(KEY_PREFIX + session_key)
+
+
+invalidation.subscribe('session', _forget_session)
+
+
+def session_metrics():
+    with _stats_lock:
+        return dict(_stats)
+
+
+metrics.register('sessions', session_metrics)
@@ -31,6 +31,7 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'fanfiction.routers.primary_pin_middleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -59,13 +60,73 @@ TEMPLATES = [
 WSGI_APPLICATION = 'fanfiction.wsgi.application'
 
 # Database
+# Свой бэкенд SQLite: WAL, mmap и прочие PRAGMA на каждом соединении,
+# фоновый WAL-checkpoint и статистика ожидания блокировок
+# (см. fanfiction/db_backends/sqlite3/base.py)
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'fanfiction.db_backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'OPTIONS': {
+            # Транзакция сразу берет блокировку записи и ждет ее в BEGIN,
+            # а не падает с "database is locked" посреди транзакции
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+            'checkpoint_interval': 30,
+        },
+    },
+    # Read-реплика для публичных страниц: снимок основной базы,
+    # обновляемый через backup API (см. fanfiction/replica.py)
+    'replica': {
+        'ENGINE': 'fanfiction.db_backends.sqlite3',
+        'NAME': BASE_DIR / 'db.replica.sqlite3',
+        'OPTIONS': {
+            'pragmas': {'journal_mode': 'DELETE', 'query_only': 'ON'},
+        },
+        'TEST': {'MIRROR': 'default'},
+    },
+    # История просмотров и сессии - отдельный файл со своей блокировкой
+    # записи (см. AnalyticsRouter). Таблицы создаются командой
+    # python manage.py migrate --database=analytics, данные из основной
+    # базы переносит python manage.py copy_analytics_data
+    'analytics': {
+        'ENGINE': 'fanfiction.db_backends.sqlite3',
+        'NAME': BASE_DIR / 'db.analytics.sqlite3',
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+            'checkpoint_interval': 30,
+        },
+        'TEST': {'MIRROR': 'default'},
+    },
 }
 
+DATABASE_ROUTERS = ['fanfiction.routers.AnalyticsRouter', 'fanfiction.routers.ReadReplicaRouter']
+
+# Снимок реплики обновляется каждые REPLICA_REFRESH_INTERVAL секунд одним
+# из процессов сервера (тем, кто держит блокировку рядом с файлом реплики)
+# или командой refresh_replica;
+# реплика старше REPLICA_MAX_LAG секунд не используется
+REPLICA_REFRESH_IN_PROCESS = True
+REPLICA_REFRESH_INTERVAL = 5.0
+REPLICA_MAX_LAG = 30.0
+# Сколько секунд после записи клиент читает только из основной базы
+# (не меньше REPLICA_MAX_LAG - иначе он может не увидеть свою запись)
+REPLICA_PIN_SECONDS = 30
+# Модели, которые публичные страницы читают из реплики
+REPLICA_READ_MODELS = {
+    'users.fanfic', 'users.tag', 'users.suggestedtag', 'users.comment',
+    'users.leaderboardentry', 'users.leaderboardstats',
+}
+# Модели, которые живут в базе аналитики
+ANALYTICS_MODELS = {'users.viewhistory', 'users.viewbucket', 'users.readersketch', 'sessions.session'}
+
+# Очередь записи: записи из запросов выполняет один поток пачками
+# (см. fanfiction/writer.py)
+DB_WRITER_ENABLED = True
+DB_WRITER_QUEUE_SIZE = 1000
+DB_WRITER_BATCH_SIZE = 100
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -102,4 +163,103 @@ AUTH_USER_MODEL = 'users.CustomUser'
 
 # Если у вас есть медиа файлы
 MEDIA_URL = '/media/'
-MEDIA_ROOT = BASE_DIR / 'media'
\ No newline at end of file
+MEDIA_ROOT = BASE_DIR / 'media'
+
+# Учет просмотров: beacon складывает просмотры в буфер процесса,
+# буфер сбрасывается в базу раз в VIEW_FLUSH_INTERVAL секунд
+VIEW_FLUSH_INTERVAL = 2.0
+VIEW_FLUSH_MAX_PENDING = 500
+# Повторный просмотр того же фанфика тем же посетителем в пределах
+# VIEW_DEDUP_WINDOW секунд не засчитывается (users/view_dedup.py, 0 - не
+# отсеивать); фильтр Блума посетителя - VIEW_DEDUP_FILTER_BITS бит
+VIEW_DEDUP_WINDOW = 1800
+VIEW_DEDUP_FILTER_BITS = 2048
+# Повторный просмотр того же фанфика тем же пользователем в пределах
+# окна не обновляет историю
+VIEW_HISTORY_TOUCH_WINDOW = 60.0
+# Хранение истории просмотров: не больше VIEW_HISTORY_MAX_PER_USER записей
+# на пользователя и не старше VIEW_HISTORY_MAX_AGE_DAYS дней
+# (применяется командой prune_view_history)
+VIEW_HISTORY_MAX_PER_USER = 200
+VIEW_HISTORY_MAX_AGE_DAYS = 365
+# Дневные скетчи уникальных читателей (users/readers.py) хранятся
+# READER_SKETCH_MAX_AGE_DAYS дней (применяется командой prune_view_history)
+READER_SKETCH_MAX_AGE_DAYS = 90
+# Рейтинги популярного (users/leaderboards.py): снимки по LEADERBOARD_SIZE
+# мест обновляются раз в LEADERBOARD_REFRESH_INTERVAL секунд в процессе
+# сервера или командой refresh_leaderboards; из процессов сервера
+# обновляет один - тот, кто держит блокировку LEADERBOARD_LOCK_PATH
+LEADERBOARD_SIZE = 50
+LEADERBOARD_REFRESH_IN_PROCESS = True
+LEADERBOARD_REFRESH_INTERVAL = 60.0
+LEADERBOARD_LOCK_PATH = BASE_DIR / 'cache' / 'leaderboards.lock'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        # Страницы и фрагменты карточек - по записи на страницу и карточку
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+    # Сессии (fanfiction/session_store.py) - отдельно, чтобы страницы их не вытесняли
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'sessions',
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+# Сессии читаются из кэша процесса, изменения пишутся в базу через очередь
+# записи (неудачная запись повторяется SESSION_WRITE_RETRIES раз)
+SESSION_ENGINE = 'fanfiction.session_store'
+SESSION_CACHE_ALIAS = 'sessions'
+SESSION_WRITE_RETRIES = 3
+# Флеш-сообщения - только в cookie: они не трогают сессию и доходят до
+# следующего запроса, в каком бы процессе он ни выполнялся
+MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
+# Отметки закладок в списках: у пользователей, у которых закладок не меньше
+# VIEWER_BOOKMARKS_CACHE_MIN, весь набор id закладок берется из кэша
+VIEWER_BOOKMARKS_CACHE_MIN = 100
+VIEWER_BOOKMARKS_CACHE_TIMEOUT = 300
+# Страницы для анонимных посетителей (fanfiction/page_cache.py) кэшируются
+# целиком на PAGE_CACHE_TIMEOUT секунд (0 - не кэшировать)
+PAGE_CACHE_TIMEOUT = 60
+# Фрагменты шаблонов (users/templatetags/fragments.py): ключ меняется при
+# правке фанфика, срок только ограничивает жизнь старых записей
+FRAGMENT_CACHE_TIMEOUT = 600
+# Кэш объектов Fanfic и CustomUser в памяти процесса
+# (fanfiction/object_cache.py): не больше OBJECT_CACHE_MAX_BYTES байт на
+# все модели, объект живет не дольше OBJECT_CACHE_TIMEOUT секунд (0 - выключен)
+OBJECT_CACHE_MAX_BYTES = 16 * 1024 * 1024
+OBJECT_CACHE_TIMEOUT = 30
+# Результаты выборок, помеченных .cached() (fanfiction/query_cache.py), живут
+# до записи в их таблицы, но не дольше QUERY_CACHE_TIMEOUT секунд (0 - выключен)
+QUERY_CACHE_TIMEOUT = 60
+# Дорогие пересчеты (облако тегов, топ, рекомендации) выполняет один запрос
+# на все процессы (fanfiction/single_flight.py): значение старше
+# SINGLE_FLIGHT_SOFT_TTL отдается, пока его пересчитывают, старше
+# SINGLE_FLIGHT_HARD_TTL - запросы ждут пересчета. Процесс держит в памяти
+# байты SINGLE_FLIGHT_MAX_BLOBS последних прочитанных значений
+SINGLE_FLIGHT_DIR = BASE_DIR / 'cache' / 'single_flight'
+SINGLE_FLIGHT_SOFT_TTL = 60
+SINGLE_FLIGHT_HARD_TTL = 3600
+SINGLE_FLIGHT_LOCK_TIMEOUT = 30
+SINGLE_FLIGHT_MAX_BLOBS = 256
+# Горячие списки (рейтинги и новинки) в общем для воркеров файле, который
+# они отображают в память (users/hotlists.py). Пишет его команда
+# refresh_hotlists --loop; сегмент старше HOTLISTS_MAX_AGE секунд не читается
+HOTLISTS_PATH = BASE_DIR / 'cache' / 'hotlists.bin'
+HOTLISTS_NEW_SIZE = 50
+HOTLISTS_MAX_AGE = 300
+# Шина сброса локальных кэшей между процессами (fanfiction/invalidation.py):
+# события лежат в отдельном файле SQLite, каждый процесс читает его раз в
+# INVALIDATION_BUS_INTERVAL секунд; события старше RETENTION секунд удаляются
+INVALIDATION_BUS_ENABLED = True
+INVALIDATION_BUS_PATH = BASE_DIR / 'cache' / 'invalidation.sqlite3'
+INVALIDATION_BUS_INTERVAL = 0.5
+INVALIDATION_BUS_RETENTION = 3600
+# Прогрев кэшей при старте процесса сервера (users/warmup.py): самые читаемые
+# за WARMUP_WINDOW_HOURS часов фанфики, списки главной и страницы WARMUP_TAGS
+# тегов; до конца прогрева /users/ready/ отвечает 503
+WARMUP_ON_START = True
+WARMUP_WINDOW_HOURS = 24
+WARMUP_FANFICS = 200
+WARMUP_TAGS = 10
@@ -0,0 +1,278 @@
+"""
+Защита дорогих пересчетов от лавины запросов.
+
+Когда устаревает облако тегов, топ популярных или рекомендации, все
+одновременные запросы разом начинали один и тот же пересчет по всей
+таблице. single_flight() пускает в пересчет только один запрос:
+
+    tags = single_flight('all_tags', collect_tags, version=tags_version,
+                         soft_ttl=600, hard_ttl=3600)
+
+Значение хранится в файле общего для процессов каталога
+SINGLE_FLIGHT_DIR и считается:
+  свежим      - моложе soft_ttl и той же версии: отдается сразу;
+  устаревшим  - старше soft_ttl или другой версии, но моложе hard_ttl:
+                пересчитывает тот, кто взял блокировку, остальные сразу
+                получают старое значение (stale-while-revalidate);
+  просроченным - старше hard_ttl или его нет: запросы ждут того, кто
+                пересчитывает, и берут его результат (не дольше
+                SINGLE_FLIGHT_LOCK_TIMEOUT секунд, потом считают сами).
+
+Блокировка - flock на файле рядом со значением, поэтому пересчет один
+на все процессы сервера. Где fcntl нет (Windows), блокировка действует
+только внутри процесса. Файл значения подменяется атомарно (os.replace),
+как снимок реплики. Каждый вызов получает свою копию значения.
+
+Версией может служить общий для процессов счетчик: generation(name)
+читает его из файла того же каталога, bump_generation(name) поднимает
+после изменения данных, из которых считается значение.
+"""
+
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from hashlib import md5
+from pathlib import Path
+
+from django.conf import settings
+
+from fanfiction import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Пауза между попытками взять занятую блокировку
+LOCK_POLL_INTERVAL = 0.01
+
+_stats_lock = threading.Lock()
+_stats = {'fresh': 0, 'stale': 0, 'recomputes': 0, 'waits': 0, 'lock_timeouts': 0, 'errors': 0}
+
+# Байты последних прочитанных файлов: не читаем диск, пока файл не сменился;
+# хранятся SINGLE_FLIGHT_MAX_BLOBS последних
+_blobs = OrderedDict()
+_blobs_lock = threading.Lock()
+
+# Блокировки внутри процесса, когда flock недоступен
+_thread_locks = {}
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def _directory():
+    return Path(getattr(settings, 'SINGLE_FLIGHT_DIR', Path(settings.BASE_DIR) / 'cache' / 'single_flight'))
+
+
+def _paths(key):
+    name = md5(key.encode(), usedforsecurity=False).hexdigest()
+    directory = _directory()
+    return directory / f'{name}.pickle', directory / f'{name}.lock'
+
+
+class KeyLock:
+    """Блокировка пересчета одного ключа (flock или threading.Lock)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._thread_lock = None
+
+    def acquire(self, timeout=0):
+        """Берет блокировку; timeout=0 - не ждать. True, если взята"""
+        if fcntl is None:
+            self._thread_lock = _thread_locks.setdefault(str(self.path), threading.Lock())
+            if timeout:
+                return self._thread_lock.acquire(timeout=timeout)
+            return self._thread_lock.acquire(blocking=False)
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, 'a+')
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    self._file.close()
+                    self._file = None
+                    return False
+                time.sleep(LOCK_POLL_INTERVAL)
+
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        elif self._thread_lock is not None:
+            self._thread_lock.release()
+            self._thread_lock = None
+
+
+def _load(path):
+    """(версия, время расчета, значение) или None"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    # os.replace всегда меняет inode: две записи за один тик часов ядра
+    # с одинаковым размером по времени и размеру не различить
+    stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    with _blobs_lock:
+        cached = _blobs.get(path)
+        if cached is not None:
+            _blobs.move_to_end(path)
+    if cached is not None and cached[0] == stamp:
+        blob = cached[1]
+    else:
+        try:
+            blob = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        with _blobs_lock:
+            _blobs[path] = (stamp, blob)
+            _blobs.move_to_end(path)
+            while len(_blobs) > getattr(settings, 'SINGLE_FLIGHT_MAX_BLOBS', 256):
+                _blobs.popitem(last=False)
+    try:
+        return pickle.loads(blob)
+    except Exception:
+        logger.warning('Поврежден файл значения %s', path)
+        return None
+
+
+def _store(path, entry):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f'{path.name}.tmp-{os.getpid()}-{threading.get_ident()}')
+    tmp_path.write_bytes(pickle.dumps(entry, pickle.HIGHEST_PROTOCOL))
+    os.replace(tmp_path, path)
+
+
+def _state(entry, version, soft_ttl, hard_ttl, now):
+    if entry is None:
+        return 'missing'
+    entry_version, computed_at, _ = entry
+    age = now - computed_at
+    if age >= hard_ttl:
+        return 'missing'
+    if age >= soft_ttl or entry_version != version:
+        return 'stale'
+    return 'fresh'
+
+
+def _recompute(path, compute, version):
+    _count('recomputes')
+    value = compute()
+    _store(path, (version, time.time(), value))
+    return value
+
+
+def single_flight(key, compute, version=None, soft_ttl=None, hard_ttl=None):
+    """Значение key: compute() выполняет только один запрос из одновременных"""
+    soft_ttl = soft_ttl if soft_ttl is not None else getattr(settings, 'SINGLE_FLIGHT_SOFT_TTL', 60)
+    hard_ttl = hard_ttl if hard_ttl is not None else getattr(settings, 'SINGLE_FLIGHT_HARD_TTL', 3600)
+    path, lock_path = _paths(key)
+
+    entry = _load(path)
+    state = _state(entry, version, soft_ttl, hard_ttl, time.time())
+    if state == 'fresh':
+        _count('fresh')
+        return entry[2]
+
+    lock = KeyLock(lock_path)
+    if state == 'stale':
+        if not lock.acquire():
+            # Пересчитывает другой запрос - отдаем старое
+            _count('stale')
+            return entry[2]
+        try:
+            # Пока мы брали блокировку, значение могли уже пересчитать
+            entry = _load(path)
+            if _state(entry, version, soft_ttl, hard_ttl, time.time()) == 'fresh':
+                _count('fresh')
+                return entry[2]
+            return _recompute(path, compute, version)
+        except Exception:
+            if entry is None:
+                raise
+            logger.exception('Не удалось пересчитать %s - отдаем старое значение', key)
+            _count('errors')
+            return entry[2]
+        finally:
+            lock.release()
+
+    # Значения нет: ждем того, кто его считает, или считаем сами
+    if not lock.acquire():
+        _count('waits')
+        if not lock.acquire(timeout=getattr(settings, 'SINGLE_FLIGHT_LOCK_TIMEOUT', 30)):
+            _count('lock_timeouts')
+            return compute()
+    try:
+        entry = _load(path)
+        if _state(entry, version, soft_ttl, hard_ttl, time.time()) == 'fresh':
+            _count('fresh')
+            return entry[2]
+        return _recompute(path, compute, version)
+    finally:
+        lock.release()
+
+
+def _generation_paths(name):
+    # Свое расширение: clear() удаляет значения, но не счетчики
+    path, lock_path = _paths(f'generation:{name}')
+    return path.with_suffix('.generation'), lock_path
+
+
+def generation(name):
+    """Общий для процессов счетчик name (0, пока его не поднимали)"""
+    return _load(_generation_paths(name)[0]) or 0
+
+
+def bump_generation(name):
+    """Поднимает счетчик name: значения его версии становятся устаревшими
+
+    Выполняется синхронно (flock и запись файла в несколько байт), чтобы
+    следующий запрос того же клиента уже видел новую версию.
+    """
+    path, lock_path = _generation_paths(name)
+    lock = KeyLock(lock_path)
+    if not lock.acquire(timeout=getattr(settings, 'SINGLE_FLIGHT_LOCK_TIMEOUT', 30)):
+        _count('lock_timeouts')
+        # Без блокировки одновременные подъемы затирают друг друга, и
+        # потерянный подъем оставляет старое значение свежим
+        raise TimeoutError(f'Счетчик {name} занят дольше SINGLE_FLIGHT_LOCK_TIMEOUT секунд')
+    try:
+        _store(path, generation(name) + 1)
+    finally:
+        lock.release()
+
+
+def clear():
+    """Удаляет все сохраненные значения
+
+    Счетчики generation() остаются: начавшись заново с 0, они совпали бы с
+    версиями значений, которые другие процессы еще держат в памяти.
+    """
+    with _blobs_lock:
+        _blobs.clear()
+    directory = _directory()
+    if directory.is_dir():
+        for path in directory.glob('*.pickle'):
+            path.unlink(missing_ok=True)
+
+
+def single_flight_metrics():
+    with _stats_lock:
+        return dict(_stats)
+
+
+metrics.register('single_flight', single_flight_metrics)
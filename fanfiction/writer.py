@@ -0,0 +1,229 @@
+"""
+Единственный писатель базы SQLite.
+
+Запись в SQLite всегда однопоточная: при всплеске запросов потоки
+соревнуются за блокировку, ждут в busy_timeout и иногда получают
+"database is locked". Здесь записи из запросов ставятся в ограниченную
+очередь, а отдельный поток выполняет их пачками (group commit): одна
+транзакция на пачку, каждая операция - в своей точке сохранения, так что
+ошибка одной операции не откатывает остальные.
+
+    # результат нужен - ждем future
+    is_bookmarked = submit(toggle, user_id, fanfic_id).result(timeout=WRITE_TIMEOUT)
+    # "выстрелил и забыл"
+    submit_nowait(write_history, entries, using='analytics')
+
+Операция выполняется сразу в вызывающем потоке, если очередь выключена
+(DB_WRITER_ENABLED = False), база в памяти (тесты) или вызывающий код
+уже внутри транзакции этой базы - операция может зависеть от ее
+незакоммиченных данных.
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from fanfiction import metrics
+from fanfiction.routers import mark_wrote
+from fanfiction.replica import PRIMARY_ALIAS
+
+logger = logging.getLogger(__name__)
+
+# Сколько запрос ждет своей записи, секунд
+WRITE_TIMEOUT = 10.0
+
+
+class WriteQueueFull(Exception):
+    """Очередь записи переполнена дольше put_timeout"""
+
+
+class _Operation:
+    __slots__ = ('func', 'args', 'kwargs', 'future', 'enqueued_at')
+
+    def __init__(self, func, args, kwargs, future):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+
+class WriteQueue:
+    """Очередь записи в одну базу с отдельным потоком-писателем"""
+
+    def __init__(self, using='default', max_size=1000, batch_size=100, put_timeout=5.0):
+        self.using = using
+        self.batch_size = batch_size
+        self.put_timeout = put_timeout
+        self._queue = queue.Queue(maxsize=max_size)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'submitted': 0,
+            'batches': 0,
+            'operations': 0,
+            'errors': 0,
+            'total_commit': 0.0,
+            'max_commit': 0.0,
+            'total_wait': 0.0,
+        }
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=f'db-writer:{self.using}', daemon=True)
+                self._thread.start()
+
+    def runs_inline(self):
+        """Выполнять ли операцию в вызывающем потоке"""
+        if not getattr(settings, 'DB_WRITER_ENABLED', True):
+            return True
+        connection = connections[self.using]
+        return connection.is_in_memory_db() or connection.in_atomic_block
+
+    def submit(self, func, *args, **kwargs):
+        """Ставит операцию в очередь и возвращает Future с ее результатом"""
+        future = Future()
+        # Поток-писатель не видит состояние маршрутизации запроса,
+        # поэтому закрепление за основной базой отмечаем здесь
+        if self.using == PRIMARY_ALIAS:
+            mark_wrote()
+        if self.runs_inline():
+            try:
+                with transaction.atomic(using=self.using):
+                    future.set_result(func(*args, **kwargs))
+            except Exception as exc:
+                future.set_exception(exc)
+            return future
+
+        self.start()
+        try:
+            self._queue.put(_Operation(func, args, kwargs, future), timeout=self.put_timeout)
+        except queue.Full:
+            raise WriteQueueFull(f'Очередь записи {self.using} переполнена')
+        with self._stats_lock:
+            self._stats['submitted'] += 1
+        return future
+
+    def submit_nowait(self, func, *args, **kwargs):
+        """Ставит операцию в очередь, не дожидаясь результата (ошибки пишутся в лог)"""
+        future = self.submit(func, *args, **kwargs)
+        future.add_done_callback(self._log_failure)
+
+    def _log_failure(self, future):
+        exc = future.exception()
+        if exc is not None:
+            logger.error('Фоновая запись в %s не удалась', self.using, exc_info=exc)
+
+    def join(self):
+        """Ждет, пока все поставленные операции будут выполнены"""
+        self._queue.join()
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # Все, что накопилось, пока писали прошлую пачку, идет одной транзакцией
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._commit(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _commit(self, batch):
+        started = time.perf_counter()
+        results = []
+        errors = 0
+        try:
+            connections[self.using].close_if_unusable_or_obsolete()
+            with transaction.atomic(using=self.using):
+                for op in batch:
+                    try:
+                        with transaction.atomic(using=self.using):
+                            results.append((op, op.func(*op.args, **op.kwargs)))
+                    except Exception as exc:
+                        errors += 1
+                        op.future.set_exception(exc)
+        except Exception as exc:
+            # Не удался сам коммит - не записалась вся пачка
+            logger.exception('Коммит пачки записи в %s не удался', self.using)
+            for op, _ in results:
+                op.future.set_exception(exc)
+            errors += len(results)
+            results = []
+
+        finished = time.perf_counter()
+        for op, result in results:
+            op.future.set_result(result)
+
+        commit_time = finished - started
+        with self._stats_lock:
+            self._stats['batches'] += 1
+            self._stats['operations'] += len(batch)
+            self._stats['errors'] += errors
+            self._stats['total_commit'] += commit_time
+            self._stats['max_commit'] = max(self._stats['max_commit'], commit_time)
+            self._stats['total_wait'] += sum(started - op.enqueued_at for op in batch)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        batches = stats['batches']
+        operations = stats['operations']
+        return {
+            'depth': self.depth(),
+            'submitted': stats['submitted'],
+            'batches': batches,
+            'operations': operations,
+            'errors': stats['errors'],
+            'avg_batch_size': round(operations / batches, 2) if batches else 0.0,
+            'avg_commit_ms': round(stats['total_commit'] / batches * 1000, 3) if batches else 0.0,
+            'max_commit_ms': round(stats['max_commit'] * 1000, 3),
+            'avg_queue_wait_ms': round(stats['total_wait'] / operations * 1000, 3) if operations else 0.0,
+        }
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(using='default'):
+    """Очередь записи для базы using (одна на процесс)"""
+    with _writers_lock:
+        if using not in _writers:
+            _writers[using] = WriteQueue(
+                using,
+                max_size=getattr(settings, 'DB_WRITER_QUEUE_SIZE', 1000),
+                batch_size=getattr(settings, 'DB_WRITER_BATCH_SIZE', 100),
+            )
+        return _writers[using]
+
+
+def submit(func, *args, using='default', **kwargs):
+    return get_writer(using).submit(func, *args, **kwargs)
+
+
+def submit_nowait(func, *args, using='default', **kwargs):
+    get_writer(using).submit_nowait(func, *args, **kwargs)
+
+
+def writer_metrics():
+    with _writers_lock:
+        writers = dict(_writers)
+    return {using: writer.stats() for using, writer in sorted(writers.items())}
+
+
+metrics.register('writer', writer_metrics)
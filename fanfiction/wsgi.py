@@ -14,3 +14,14 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fanfiction.settings')
 
 application = get_wsgi_application()
+
+# Приложение загружено - запускаем фоновые задачи процесса: снимок реплики,
+# чтение шины сброса, обновление рейтингов и прогрев кэшей (пока
+# балансировщик ждет готовности)
+from fanfiction import invalidation, replica  # noqa: E402
+from users import leaderboards, warmup  # noqa: E402
+
+replica.start_in_process_refresh()
+invalidation.start_in_process_tail()
+leaderboards.start_in_process_refresh()
+warmup.start_in_process_warmup()
@@ -10,4 +10,26 @@ import pytest
 
 @pytest.fixture
 def sample_fixture():
-    return "test data"
\ No newline at end of file
+    return "test data"
+
+@pytest.fixture(autouse=True)
+def clear_object_cache():
+    """Кэш объектов и кэш запросов живут в памяти процесса, а строки
+    тестов откатываются без записи - очищаем их перед каждым тестом"""
+    from fanfiction import query_cache
+    from fanfiction.object_cache import clear_all
+
+    clear_all()
+    query_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def isolate_file_caches(settings, tmp_path):
+    """Значения single_flight, сегмент горячих списков, блокировка рейтингов
+    и шина сброса лежат в файлах - у каждого теста свой каталог; шина
+    включается только в своих тестах"""
+    settings.SINGLE_FLIGHT_DIR = tmp_path / 'single_flight'
+    settings.HOTLISTS_PATH = tmp_path / 'hotlists.bin'
+    settings.LEADERBOARD_LOCK_PATH = tmp_path / 'leaderboards.lock'
+    settings.INVALIDATION_BUS_ENABLED = False
+    settings.INVALIDATION_BUS_PATH = tmp_path / 'invalidation.sqlite3'
@@ -0,0 +1,109 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+
+class TestAnalyticsRouter(TestCase):
+    """Тесты маршрутизации моделей аналитики"""
+    
+    def test_analytics_models_routing(self):
+        """История и сессии идут в базу аналитики, остальное - нет"""
+        from django.contrib.sessions.models import Session
+        from fanfiction.routers import AnalyticsRouter
+        from users.models import Fanfic, ViewHistory
+        
+        router = AnalyticsRouter()
+        with mock.patch('fanfiction.routers.analytics_db', return_value='analytics'):
+            self.assertEqual(router.db_for_write(ViewHistory), 'analytics')
+            self.assertEqual(router.db_for_read(Session), 'analytics')
+            self.assertIsNone(router.db_for_write(Fanfic))
+            self.assertIsNone(router.db_for_read(Fanfic))
+    
+    def test_related_objects_read_from_primary(self):
+        """Фанфик, подгружаемый из записи истории, читается из основной базы"""
+        from fanfiction.routers import AnalyticsRouter
+        from users.models import Fanfic, ViewHistory
+        
+        entry = ViewHistory(user_id=1, fanfic_id=1)
+        entry._state.db = 'analytics'
+        self.assertEqual(AnalyticsRouter().db_for_read(Fanfic, instance=entry), 'default')
+    
+    def test_allow_migrate(self):
+        """В базу аналитики попадают только ее таблицы"""
+        from fanfiction.routers import AnalyticsRouter
+        
+        router = AnalyticsRouter()
+        with mock.patch('fanfiction.routers.analytics_db', return_value='analytics'):
+            self.assertTrue(router.allow_migrate('analytics', 'users', 'viewhistory'))
+            self.assertTrue(router.allow_migrate('analytics', 'sessions', 'session'))
+            self.assertFalse(router.allow_migrate('analytics', 'users', 'fanfic'))
+            self.assertFalse(router.allow_migrate('default', 'users', 'viewhistory'))
+            self.assertIsNone(router.allow_migrate('default', 'users', 'fanfic'))
+    
+    def test_test_mirror_uses_primary(self):
+        """В тестах база аналитики - зеркало основной"""
+        from fanfiction.routers import analytics_db
+        
+        self.assertEqual(analytics_db(), 'default')
+    
+    
+    def test_copy_table(self):
+        """Сессии и история копируются в базу аналитики; повтор ничего не дублирует"""
+        import os
+        import sqlite3
+        import tempfile
+        from users.management.commands.copy_analytics_data import copy_table
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            primary = sqlite3.connect(os.path.join(tmp, 'primary.sqlite3'))
+            analytics = sqlite3.connect(os.path.join(tmp, 'analytics.sqlite3'))
+            for db in (primary, analytics):
+                db.execute('CREATE TABLE django_session (session_key TEXT PRIMARY KEY, session_data TEXT)')
+            primary.executemany(
+                'INSERT INTO django_session VALUES (?, ?)', [(f'key{number}', 'data') for number in range(5)],
+            )
+            primary.commit()
+            analytics.execute("INSERT INTO django_session VALUES ('key0', 'новее')")
+            analytics.commit()
+            
+            self.assertEqual(copy_table(primary, analytics, 'django_session', batch_size=2), 4)
+            self.assertEqual(copy_table(primary, analytics, 'django_session', batch_size=2), 0)
+            self.assertEqual(analytics.execute('SELECT COUNT(*) FROM django_session').fetchone()[0], 5)
+            self.assertEqual(
+                analytics.execute("SELECT session_data FROM django_session WHERE session_key = 'key0'").fetchone(),
+                ('новее',),
+            )
+            primary.close()
+            analytics.close()
+    
+    def test_copy_command_needs_analytics_db(self):
+        """Без отдельной базы аналитики копировать некуда"""
+        from django.core.management import CommandError, call_command
+        
+        with self.assertRaises(CommandError):
+            call_command('copy_analytics_data')
+
+class TestViewHistoryCleanup(TestCase):
+    """История удаляется вместе с фанфиком и пользователем"""
+    
+    def setUp(self):
+        from users.models import Fanfic, ViewHistory
+        
+        User = get_user_model()
+        self.author = User.objects.create_user(username='author', password='authorpass')
+        self.reader = User.objects.create_user(username='reader', password='readerpass')
+        self.fanfic = Fanfic.objects.create(title='Фанфик', content='Текст', author=self.author, status='published')
+        ViewHistory.objects.create(user=self.reader, fanfic=self.fanfic)
+    
+    def test_delete_fanfic(self):
+        from users.models import ViewHistory
+        
+        self.fanfic.delete()
+        self.assertFalse(ViewHistory.objects.exists())
+    
+    def test_delete_user(self):
+        from users.models import ViewHistory
+        
+        self.reader.delete()
+        self.assertFalse(ViewHistory.objects.exists())
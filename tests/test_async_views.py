@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+from django.test import TestCase, TransactionTestCase
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+
+
+def create_fanfics(author):
+    """Несколько опубликованных фанфиков с тегами"""
+    from users.models import Fanfic
+    
+    return [
+        Fanfic.objects.create(
+            title=f'Фанфик {i}',
+            content='Текст',
+            author=author,
+            status='published',
+            tags='фэнтези, драма' if i % 2 else 'фэнтези',
+            views_count=i * 10,
+        )
+        for i in range(4)
+    ]
+
+
+class TestAsyncViews(TestCase):
+    """Тесты асинхронных страниц для чтения"""
+    
+    def setUp(self):
+        User = get_user_model()
+        self.author = User.objects.create_user(username='author', password='authorpass')
+        self.reader = User.objects.create_user(username='reader', password='readerpass')
+        self.fanfics = create_fanfics(self.author)
+    
+    def test_views_are_coroutines(self):
+        """Страницы для чтения объявлены как async"""
+        from users import views
+        
+        for view in [views.index_view, views.fanfic_detail_view, views.get_comments_json,
+                     views.advanced_search_view, views.all_tags_view, views.tag_detail_view,
+                     views.search_by_tags_view]:
+            self.assertTrue(asyncio.iscoroutinefunction(view), view.__name__)
+    
+    def test_index_with_recommendations(self):
+        """Главная собирает популярные, новинки и рекомендации"""
+        from users.models import ViewHistory
+        
+        ViewHistory.objects.create(user=self.reader, fanfic=self.fanfics[1])
+        self.client.force_login(self.reader)
+        
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.status_code, 200)
+        
+        popular = response.context['popular_fanfics']
+        self.assertEqual([f.pk for f in popular], [f.pk for f in reversed(self.fanfics)])
+        self.assertEqual(len(response.context['new_fanfics']), 4)
+        
+        recommended = [f.pk for f in response.context['recommended_fanfics']]
+        self.assertNotIn(self.fanfics[1].pk, recommended)
+        self.assertEqual(len(recommended), 3)
+    
+    def test_tag_pages(self):
+        """Страницы тегов и поиска"""
+        response = self.client.get(reverse('all_tags'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total_fanfics'], 4)
+        self.assertEqual({t['name']: t['count'] for t in response.context['tags_list']},
+                         {'фэнтези': 4, 'драма': 2})
+        
+        response = self.client.get(reverse('tag_detail', args=['драма']))
+        self.assertEqual(response.context['fanfics_count'], 2)
+        
+        response = self.client.get(reverse('tag_search'), {'q': 'фэнтези, драма'})
+        self.assertEqual(response.context['fanfics_count'], 2)
+        
+        response = self.client.get(reverse('advanced_search'), {'tag': 'драма', 'page': 'abc'})
+        self.assertEqual(response.context['total_results'], 2)
+    
+    def test_comments_json(self):
+        """JSON комментариев требует авторизации и возвращает дерево"""
+        from users.models import Comment
+        
+        url = reverse('get_comments_json', args=[self.fanfics[0].pk])
+        self.assertEqual(self.client.get(url).status_code, 302)
+        
+        root = Comment.objects.create(fanfic=self.fanfics[0], author=self.reader, content='Корень')
+        Comment.objects.create(fanfic=self.fanfics[0], author=self.author, content='Ответ', parent=root)
+        
+        self.client.force_login(self.reader)
+        data = self.client.get(url).json()
+        self.assertEqual(data['total'], 1)
+        self.assertEqual(data['comments'][0]['replies'][0]['content'], 'Ответ')
+        self.assertTrue(data['comments'][0]['can_edit'])
+
+
+class TestConcurrentIndexQueries(TransactionTestCase):
+    """Главная вне транзакции выполняет выборки в отдельных потоках"""
+    
+    databases = {'default', 'replica'}
+    
+    def test_index_outside_transaction(self):
+        User = get_user_model()
+        author = User.objects.create_user(username='author', password='authorpass')
+        create_fanfics(author)
+        
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['popular_fanfics']), 4)
+        self.assertEqual(len(response.context['new_fanfics']), 4)
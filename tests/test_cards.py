@@ -0,0 +1,46 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+
+class TestFanficCards(TestCase):
+    """Тесты карточек фанфиков для списков"""
+    
+    def setUp(self):
+        from users.models import Comment, Fanfic
+        
+        User = get_user_model()
+        self.author = User.objects.create_user(username='author', password='authorpass', nickname='Автор')
+        self.fanfic = Fanfic.objects.create(
+            title='Фанфик', content='Текст ' * 1000, description='Слово ' * 100,
+            author=self.author, status='published', tags='Драма, , фэнтези', views_count=600,
+        )
+        Comment.objects.create(fanfic=self.fanfic, author=self.author, content='Виден')
+        Comment.objects.create(fanfic=self.fanfic, author=self.author, content='Удален', is_deleted=True)
+    
+    def test_card_fields_single_query(self):
+        """Карточка собирается одним запросом и повторяет методы модели"""
+        from users.cards import DESCRIPTION_LENGTH, fanfic_cards
+        from users.models import Fanfic
+        
+        with self.assertNumQueries(1):
+            card, = fanfic_cards(Fanfic.objects.filter(pk=self.fanfic.pk))
+            author_name = card.author.display_name
+        
+        self.assertEqual(card.pk, self.fanfic.pk)
+        self.assertEqual(author_name, 'Автор')
+        self.assertEqual(card.author.username, 'author')
+        self.assertEqual(card.tags_list, self.fanfic.get_tags_list())
+        self.assertEqual(card.popularity_text, self.fanfic.get_popularity_text())
+        self.assertEqual(card.popularity_badge_class, self.fanfic.get_popularity_badge_class())
+        self.assertEqual(card.comments_count, 1)
+        self.assertTrue(card.description.endswith('…'))
+        self.assertLessEqual(len(card.description), DESCRIPTION_LENGTH + 1)
+        self.assertFalse(hasattr(card, '__dict__'))
+    
+    def test_listing_pages_render_cards(self):
+        """Страницы списков показывают карточки"""
+        for name in ('index', 'new_fanfics', 'popular_fanfics'):
+            response = self.client.get(reverse(name))
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, 'фэнтези')
@@ -0,0 +1,70 @@
+from django.test import TestCase, TransactionTestCase
+
+
+def create_tag(name):
+    from users.models import Tag
+    
+    return Tag.objects.create(name=name).pk
+
+
+def fail():
+    raise ValueError('ошибка операции')
+
+
+class TestWriteQueueInline(TestCase):
+    """Внутри транзакции операция выполняется сразу"""
+    
+    def test_submit_runs_inline(self):
+        from fanfiction.writer import WriteQueue
+        from users.models import Tag
+        
+        queue = WriteQueue()
+        future = queue.submit(create_tag, 'inline')
+        
+        self.assertTrue(future.done())
+        self.assertTrue(Tag.objects.filter(pk=future.result()).exists())
+        self.assertEqual(queue.depth(), 0)
+
+
+class TestWriteQueueThread(TransactionTestCase):
+    """Тесты потока-писателя"""
+    
+    def make_queue(self):
+        from fanfiction.writer import WriteQueue
+        
+        queue = WriteQueue()
+        # База тестов в памяти - включаем поток явно
+        queue.runs_inline = lambda: False
+        return queue
+    
+    def test_group_commit_isolates_errors(self):
+        """Ошибка одной операции не откатывает остальные в пачке"""
+        from users.models import Tag
+        
+        queue = self.make_queue()
+        first = queue.submit(create_tag, 'first')
+        failed = queue.submit(fail)
+        second = queue.submit(create_tag, 'second')
+        queue.join()
+        
+        self.assertEqual(
+            set(Tag.objects.values_list('pk', flat=True)),
+            {first.result(timeout=5), second.result(timeout=5)},
+        )
+        with self.assertRaises(ValueError):
+            failed.result(timeout=5)
+        
+        stats = queue.stats()
+        self.assertEqual(stats['operations'], 3)
+        self.assertEqual(stats['errors'], 1)
+        self.assertEqual(stats['depth'], 0)
+    
+    def test_submit_nowait(self):
+        """Операция "выстрелил и забыл" тоже выполняется"""
+        from users.models import Tag
+        
+        queue = self.make_queue()
+        self.assertIsNone(queue.submit_nowait(create_tag, 'background'))
+        queue.join()
+        
+        self.assertTrue(Tag.objects.filter(name='background').exists())
@@ -0,0 +1,131 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+
+class TestViewHistoryRetention(TestCase):
+    """Тесты хранения и очистки истории просмотров"""
+    
+    def setUp(self):
+        from users.models import Fanfic, ViewHistory
+        
+        User = get_user_model()
+        self.author = User.objects.create_user(username='author', password='authorpass')
+        self.reader = User.objects.create_user(username='reader', password='readerpass')
+        self.other = User.objects.create_user(username='other', password='otherpass')
+        self.fanfics = [
+            Fanfic.objects.create(title=f'Фанфик {i}', content='Текст', author=self.author, status='published')
+            for i in range(5)
+        ]
+        
+        now = timezone.now()
+        for i, fanfic in enumerate(self.fanfics):
+            ViewHistory.objects.create(user=self.reader, fanfic=fanfic)
+            ViewHistory.objects.filter(user=self.reader, fanfic=fanfic).update(viewed_at=now - timedelta(days=i))
+        ViewHistory.objects.create(user=self.other, fanfic=self.fanfics[0])
+        ViewHistory.objects.filter(user=self.other).update(viewed_at=now - timedelta(days=400))
+    
+    def test_delete_in_batches(self):
+        """Удаление идет пачками до конца выборки"""
+        from users.deletion import delete_in_batches
+        from users.models import ViewHistory
+        
+        deleted = delete_in_batches(ViewHistory.objects.filter(user=self.reader), batch_size=2)
+        
+        self.assertEqual(deleted, 5)
+        self.assertEqual(ViewHistory.objects.count(), 1)
+    
+    def test_prune_by_limit_and_age(self):
+        """Остаются последние записи в пределах лимита и срока"""
+        from users.deletion import prune_view_history
+        from users.models import ViewHistory
+        
+        result = prune_view_history(max_per_user=3, max_age_days=365, batch_size=2)
+        
+        self.assertEqual(result, {'expired': 1, 'over_limit': 2})
+        self.assertEqual(
+            set(ViewHistory.objects.values_list('fanfic_id', flat=True)),
+            {fanfic.pk for fanfic in self.fanfics[:3]},
+        )
+    
+    def test_clear_view_history(self):
+        """Очистка истории удаляет только записи пользователя"""
+        from users.models import ViewHistory
+        
+        self.client.force_login(self.reader)
+        response = self.client.get(reverse('clear_view_history'))
+        
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(ViewHistory.objects.filter(user=self.reader).exists())
+        self.assertTrue(ViewHistory.objects.filter(user=self.other).exists())
+
+
+class TestChunkedDeletion(TestCase):
+    """Тесты удаления фанфиков и аккаунтов снизу вверх"""
+    
+    def setUp(self):
+        from users.models import Bookmark, Comment, CommentLike, Fanfic, ViewHistory
+        
+        User = get_user_model()
+        self.author = User.objects.create_user(username='author', password='authorpass')
+        self.reader = User.objects.create_user(username='reader', password='readerpass')
+        self.fanfic = Fanfic.objects.create(title='Фанфик', content='Текст', author=self.author, status='deleted')
+        self.other_fanfic = Fanfic.objects.create(title='Другой', content='Текст', author=self.reader, status='published')
+        
+        root = Comment.objects.create(fanfic=self.fanfic, author=self.reader, content='Корень')
+        reply = Comment.objects.create(fanfic=self.fanfic, author=self.author, content='Ответ', parent=root)
+        Comment.objects.create(fanfic=self.fanfic, author=self.reader, content='Ответ на ответ', parent=reply)
+        CommentLike.objects.create(comment=root, user=self.author)
+        Bookmark.objects.create(user=self.reader, fanfic=self.fanfic)
+        ViewHistory.objects.create(user=self.reader, fanfic=self.fanfic)
+        
+        # Комментарий автора к чужому фанфику с ответом читателя
+        own = Comment.objects.create(fanfic=self.other_fanfic, author=self.author, content='Мой')
+        Comment.objects.create(fanfic=self.other_fanfic, author=self.reader, content='Ответ мне', parent=own)
+        Comment.objects.create(fanfic=self.other_fanfic, author=self.reader, content='Чужой')
+    
+    def test_delete_fanfics(self):
+        """Фанфик удаляется вместе с комментариями, лайками, закладками и историей"""
+        from users.deletion import delete_fanfics
+        from users.models import Bookmark, Comment, CommentLike, Fanfic, ViewHistory
+        
+        reported = []
+        result = delete_fanfics([self.fanfic.pk], batch_size=2, progress=lambda label, total: reported.append(label))
+        
+        self.assertEqual(result, {
+            'comment_likes': 1, 'comments': 3, 'bookmarks': 1, 'view_history': 1, 'view_buckets': 0,
+            'reader_sketches': 0, 'fanfics': 1,
+        })
+        self.assertIn('comments', reported)
+        self.assertFalse(Fanfic.objects.filter(pk=self.fanfic.pk).exists())
+        self.assertFalse(Comment.objects.filter(fanfic_id=self.fanfic.pk).exists())
+        self.assertFalse(CommentLike.objects.exists())
+        self.assertFalse(Bookmark.objects.exists())
+        self.assertFalse(ViewHistory.objects.exists())
+        self.assertEqual(Comment.objects.filter(fanfic=self.other_fanfic).count(), 3)
+    
+    def test_delete_user(self):
+        """Аккаунт удаляется вместе со своими фанфиками и ветками комментариев"""
+        from users.deletion import delete_user
+        from users.models import Comment, CustomUser, Fanfic
+        
+        result = delete_user(self.author.pk, batch_size=2)
+        
+        self.assertEqual(result['users'], 1)
+        self.assertFalse(CustomUser.objects.filter(pk=self.author.pk).exists())
+        self.assertFalse(Fanfic.objects.filter(author_id=self.author.pk).exists())
+        self.assertEqual(list(Comment.objects.values_list('content', flat=True)), ['Чужой'])
+    
+    def test_empty_trash(self):
+        """Очистка корзины удаляет фанфики через пакетное удаление"""
+        from users.models import Comment, Fanfic
+        
+        self.client.force_login(self.author)
+        response = self.client.get(reverse('empty_trash'))
+        
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Fanfic.objects.filter(pk=self.fanfic.pk).exists())
+        self.assertFalse(Comment.objects.filter(fanfic_id=self.fanfic.pk).exists())
@@ -0,0 +1,96 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+
+class TestFragmentCache(TestCase):
+    """Тесты кэша фрагментов карточек и облака тегов"""
+    
+    def setUp(self):
+        from django.core.cache import cache
+        from users.models import Fanfic
+        
+        cache.clear()
+        User = get_user_model()
+        self.author = User.objects.create_user(username='author', password='authorpass')
+        self.fanfic = Fanfic.objects.create(
+            title='Фанфик', description='Старое описание', content='Текст', author=self.author,
+            status='published', tags='драма, фэнтези',
+        )
+    
+    def render_card(self):
+        from django.template.loader import render_to_string
+        from users.cards import fanfic_cards
+        from users.models import Fanfic
+        
+        card = fanfic_cards(Fanfic.objects.filter(pk=self.fanfic.pk))[0]
+        return render_to_string('users/fanfic_card.html', {'fanfic': card})
+    
+    def test_card_fragment_reused(self):
+        """Повторный рендер карточки берет описание и теги из кэша"""
+        from fanfiction.metrics import collect
+        
+        first = self.render_card()
+        before = collect()['fragment_cache']
+        second = self.render_card()
+        after = collect()['fragment_cache']
+        
+        self.assertEqual(first, second)
+        self.assertEqual(after['hits'], before['hits'] + 1)
+        self.assertEqual(after['misses'], before['misses'])
+    
+    def test_edit_invalidates_card(self):
+        """Правка автора сразу дает новый ключ фрагмента"""
+        self.assertIn('Старое описание', self.render_card())
+        
+        self.fanfic.description = 'Новое описание'
+        self.fanfic.tags = 'детектив'
+        self.fanfic.save()
+        
+        html = self.render_card()
+        self.assertIn('Новое описание', html)
+        self.assertIn('детектив', html)
+        self.assertNotIn('фэнтези', html)
+    
+    def test_views_outside_fragment(self):
+        """Просмотры рендерятся каждый раз, уровень популярности входит в ключ"""
+        from users.models import Fanfic
+        from users.templatetags.fragments import key_part
+        
+        self.render_card()
+        Fanfic.objects.filter(pk=self.fanfic.pk).update(views_count=42)
+        self.assertIn('42 просмотров', self.render_card())
+        
+        self.fanfic.views_count = 5
+        fresh = key_part(self.fanfic)
+        self.fanfic.views_count = 150
+        self.assertNotEqual(key_part(self.fanfic), fresh)
+    
+    def test_tag_cloud_cached_until_fanfics_change(self):
+        """Облако тегов не пересобирается, пока фанфики не изменились"""
+        from users.models import Fanfic
+        
+        self.client.force_login(self.author)
+        url = reverse('all_tags')
+        self.assertContains(self.client.get(url), 'фэнтези')
+        
+        with self.assertNumQueries(2):
+            # пользователь и агрегат версии - без выборки тегов (сессия из кэша)
+            response = self.client.get(url)
+        self.assertContains(response, 'фэнтези')
+        self.assertContains(response, '2 тегов в 1 фанфиках')
+        
+        Fanfic.objects.create(title='Второй', content='Текст', author=self.author, status='published', tags='юмор')
+        response = self.client.get(url)
+        self.assertContains(response, 'юмор')
+        self.assertContains(response, '3 тегов в 2 фанфиках')
+    
+    @override_settings(FRAGMENT_CACHE_TIMEOUT=0)
+    def test_disabled(self):
+        """При нулевом сроке фрагменты не кэшируются"""
+        from fanfiction.metrics import collect
+        
+        before = collect()['fragment_cache']
+        self.render_card()
+        self.render_card()
+        self.assertEqual(collect()['fragment_cache'], before)
@@ -0,0 +1,125 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+
+
+class TestHotLists(TestCase):
+    """Тесты общего сегмента горячих списков"""
+    
+    def setUp(self):
+        from users.leaderboards import refresh_leaderboards
+        from users.models import Fanfic
+        
+        User = get_user_model()
+        self.author = User.objects.create_user(username='author', password='authorpass', nickname='Автор')
+        self.drama = Fanfic.objects.create(
+            title='Драма', description='Описание драмы', content='Текст', author=self.author,
+            status='published', tags='драма', views_count=30,
+        )
+        self.fantasy = Fanfic.objects.create(
+            title='Фэнтези', content='Текст', author=self.author, status='published', tags='фэнтези, драма',
+            views_count=10,
+        )
+        refresh_leaderboards()
+    
+    def test_segment_roundtrip(self):
+        """Карточки читаются из сегмента такими же, общая карточка хранится один раз"""
+        from users.cards import fanfic_cards
+        from users.hotlists import Segment, segment_path, write_segment
+        from users.models import Fanfic
+        
+        cards = fanfic_cards(Fanfic.objects.order_by('-views_count'))
+        write_segment(segment_path(), {
+            'top': (cards, [5, 7], {'fanfics_count': 2, 'total_views': 40, 'avg_views': 20}),
+            'new': (cards[::-1], None, None),
+        })
+        
+        segment = Segment.open(segment_path())
+        self.assertEqual(segment.generation, 1)
+        self.assertEqual(segment.cards_count, 2)
+        self.assertEqual(segment.ids('top'), [self.drama.pk, self.fantasy.pk])
+        
+        card = segment.cards('top')[0]
+        for field in ('pk', 'title', 'description', 'tags_list', 'views_count', 'created_at', 'updated_at', 'popularity'):
+            self.assertEqual(getattr(card, field), getattr(cards[0], field))
+        self.assertEqual(card.author.display_name, 'Автор')
+        self.assertEqual(card.period_views, 5)
+        self.assertIsNone(segment.cards('new')[0].period_views)
+        self.assertEqual(len(segment.cards('new', limit=1)), 1)
+        self.assertIsNone(segment.cards('missing'))
+    
+    def test_boards_served_from_segment(self):
+        """После обновления рейтинги и новинки читаются без запросов"""
+        from users.hotlists import hot_cards, refresh_hotlists
+        from users.leaderboards import leaderboard
+        
+        from_tables = leaderboard(tag='драма', window='all')
+        self.assertEqual(refresh_hotlists()['generation'], 1)
+        
+        with self.assertNumQueries(1):
+            # проверка статуса - одна на набор id, дальше из кэша запросов
+            leaderboard(tag='драма', window='all')
+        with self.assertNumQueries(0):
+            cards, stats = leaderboard(tag='драма', window='all')
+            new = hot_cards('new', limit=1)
+        self.assertEqual([card.pk for card in cards], [card.pk for card in from_tables[0]])
+        self.assertEqual([card.period_views for card in cards], [30, 10])
+        self.assertEqual((stats.fanfics_count, stats.total_views), (2, 40))
+        self.assertEqual([card.pk for card in new], [self.fantasy.pk])
+    
+    def test_unpublished_skipped(self):
+        """Снятый с публикации фанфик пропадает из списков до пересборки сегмента"""
+        from users.hotlists import hot_cards, refresh_hotlists
+        from users.leaderboards import leaderboard
+        from users.models import Fanfic
+        
+        refresh_hotlists()
+        Fanfic.objects.filter(pk=self.drama.pk).update(status='draft')
+        
+        cards, _ = leaderboard(tag='драма', window='all', limit=1)
+        self.assertEqual([card.pk for card in cards], [self.fantasy.pk])
+        self.assertEqual([card.pk for card in hot_cards('new')], [self.fantasy.pk])
+    
+    def test_atomic_swap(self):
+        """Новое поколение подменяет файл, старое отображение остается целым"""
+        from users import hotlists
+        from users.models import Fanfic
+        
+        hotlists.refresh_hotlists()
+        old = hotlists.get_segment()
+        Fanfic.objects.filter(pk=self.drama.pk).update(title='Переименовано')
+        self.assertEqual(hotlists.refresh_hotlists()['generation'], 2)
+        
+        self.assertEqual(old.cards('new')[1].title, 'Драма')
+        current = hotlists.get_segment()
+        self.assertEqual(current.generation, 2)
+        self.assertEqual(current.cards('new')[1].title, 'Переименовано')
+    
+    def test_fallbacks(self):
+        """Без сегмента, с устаревшим сегментом или занятой блокировкой - None"""
+        from fanfiction.single_flight import KeyLock
+        from users import hotlists
+        
+        self.assertIsNone(hotlists.hot_cards('new'))
+        hotlists.refresh_hotlists()
+        with override_settings(HOTLISTS_MAX_AGE=-1):
+            self.assertIsNone(hotlists.board())
+        
+        path = hotlists.segment_path()
+        lock = KeyLock(path.with_name(f'{path.name}.lock'))
+        self.assertTrue(lock.acquire())
+        try:
+            self.assertIsNone(hotlists.refresh_hotlists())
+        finally:
+            lock.release()
+    
+    def test_command(self):
+        """Команда пишет сегмент"""
+        from io import StringIO
+        
+        from django.core.management import call_command
+        from users.hotlists import get_segment
+        
+        out = StringIO()
+        call_command('refresh_hotlists', stdout=out)
+        self.assertIn('поколение 1', out.getvalue())
+        self.assertIsNotNone(get_segment())
@@ -0,0 +1,199 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+
+
+class TestInvalidationBus(TestCase):
+    """Тесты шины сброса кэшей между процессами"""
+    
+    def setUp(self):
+        from fanfiction import invalidation
+        
+        self.received = []
+        invalidation.subscribe('test', self.received.append)
+        self.addCleanup(invalidation._handlers['test'].remove, self.received.append)
+    
+    def make_bus(self):
+        """Шина отдельного процесса: свой origin, общий файл"""
+        from django.conf import settings
+        from fanfiction.invalidation import InvalidationBus
+        
+        # Поток чтения не успеет сработать - читаем шину вручную
+        bus = InvalidationBus(settings.INVALIDATION_BUS_PATH, interval=60)
+        self.addCleanup(bus.stop)
+        bus.poll()
+        return bus
+    
+    def test_foreign_events_applied(self):
+        """Чужие события применяются, свои пропускаются, задержка в метриках"""
+        local, remote = self.make_bus(), self.make_bus()
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            remote.publish('test', 'ключ')
+            local.publish('test', 'свой')
+        remote.flush()
+        local.poll()
+        
+        self.assertEqual(self.received, ['ключ'])
+        stats = local.stats()
+        self.assertEqual((stats['published'], stats['received'], stats['applied']), (1, 1, 1))
+        self.assertGreaterEqual(stats['max_lag_ms'], stats['last_lag_ms'])
+        self.assertEqual(stats['pending'], 0)
+    
+    def test_duplicates_coalesced(self):
+        """Повторы до отправки уходят одним событием"""
+        local, remote = self.make_bus(), self.make_bus()
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(5):
+                remote.publish('test', 12)
+            remote.publish('test', 13)
+        self.assertEqual(remote.stats()['pending'], 2)
+        remote.flush()
+        local.poll()
+        
+        self.assertEqual(self.received, ['12', '13'])
+    
+    def test_published_after_commit(self):
+        """Событие транзакции уходит только после коммита"""
+        local, remote = self.make_bus(), self.make_bus()
+        
+        with self.captureOnCommitCallbacks() as callbacks:
+            remote.publish('test', 'ключ')
+        remote.flush()
+        local.poll()
+        self.assertEqual(self.received, [])
+        
+        for callback in callbacks:
+            callback()
+        remote.flush()
+        local.poll()
+        self.assertEqual(self.received, ['ключ'])
+    
+    def test_new_process_starts_at_end(self):
+        """Новый процесс не применяет события, отправленные до его старта"""
+        remote = self.make_bus()
+        with self.captureOnCommitCallbacks(execute=True):
+            remote.publish('test', 'старое')
+        remote.flush()
+        
+        local = self.make_bus()
+        local.poll()
+        self.assertEqual(self.received, [])
+    
+    def test_failed_handler_counted(self):
+        """Ошибка подписчика не останавливает чтение"""
+        from fanfiction import invalidation
+        
+        def broken(key):
+            raise RuntimeError('сломано')
+        
+        invalidation.subscribe('test', broken)
+        self.addCleanup(invalidation._handlers['test'].remove, broken)
+        local, remote = self.make_bus(), self.make_bus()
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            remote.publish('test', 'ключ')
+        remote.flush()
+        with self.assertLogs('fanfiction.invalidation', 'ERROR'):
+            local.poll()
+        self.assertEqual(self.received, ['ключ'])
+        self.assertEqual(local.stats()['errors'], 1)
+
+
+class TestRemoteInvalidation(TestCase):
+    """Тесты сброса кэшей событиями других процессов"""
+    
+    def setUp(self):
+        from users.models import Fanfic
+        
+        author = get_user_model().objects.create_user(username='author', password='authorpass')
+        self.fanfic = Fanfic.objects.create(title='Фанфик', content='Текст', author=author, status='published')
+    
+    def make_bus(self):
+        from django.conf import settings
+        from fanfiction.invalidation import InvalidationBus
+        
+        bus = InvalidationBus(settings.INVALIDATION_BUS_PATH, interval=60)
+        self.addCleanup(bus.stop)
+        bus.poll()
+        return bus
+    
+    @override_settings(INVALIDATION_BUS_ENABLED=True)
+    def test_object_cache_invalidated(self):
+        """invalidate() в одном процессе сбрасывает объект в другом"""
+        from fanfiction import invalidation
+        from users.object_cache import fanfic_cache
+        
+        local, remote = self.make_bus(), self.make_bus()
+        fanfic_cache.get_cached(self.fanfic.pk)
+        with self.assertNumQueries(0):
+            fanfic_cache.get_cached(self.fanfic.pk)
+        
+        with mock.patch.object(invalidation, '_bus', remote):
+            with self.captureOnCommitCallbacks(execute=True):
+                fanfic_cache.invalidate(self.fanfic.pk)
+        remote.flush()
+        # Локальный кэш этого процесса invalidate() уже не сбросит
+        fanfic_cache.get_cached(self.fanfic.pk)
+        local.poll()
+        
+        with self.assertNumQueries(1):
+            fanfic_cache.get_cached(self.fanfic.pk)
+        self.assertEqual(local.stats()['applied'], 1)
+    
+    @override_settings(INVALIDATION_BUS_ENABLED=True)
+    def test_page_version_bumped(self):
+        """Сброс кэша страниц в одном процессе поднимает версию в другом"""
+        from fanfiction import invalidation, page_cache
+        
+        local, remote = self.make_bus(), self.make_bus()
+        before = page_cache._version()
+        
+        with mock.patch.object(invalidation, '_bus', remote):
+            with self.captureOnCommitCallbacks(execute=True):
+                page_cache.bump_version()
+        after_local_bump = page_cache._version()
+        remote.flush()
+        local.poll()
+        
+        self.assertGreater(page_cache._version(), after_local_bump)
+        self.assertGreater(after_local_bump, before)
+    
+    @override_settings(INVALIDATION_BUS_ENABLED=True)
+    def test_table_version_bumped(self):
+        """Запись в таблицу в другом процессе меняет ее версию здесь"""
+        from fanfiction import invalidation, query_cache
+        from users.models import Fanfic
+        
+        local, remote = self.make_bus(), self.make_bus()
+        with mock.patch.object(invalidation, '_bus', remote):
+            with self.captureOnCommitCallbacks(execute=True):
+                Fanfic.objects.filter(pk=self.fanfic.pk).update(views_count=5)
+        version = query_cache._versions.get(Fanfic._meta.db_table)
+        remote.flush()
+        local.poll()
+        
+        self.assertNotEqual(query_cache._versions.get(Fanfic._meta.db_table), version)
+    
+    @override_settings(INVALIDATION_BUS_ENABLED=True)
+    def test_only_cached_tables_published(self):
+        """В шину попадают записи в таблицы кэшируемых выборок, сессии и аналитика - нет"""
+        from django.contrib.sessions.backends.db import SessionStore
+        from django.utils import timezone
+        from fanfiction import invalidation
+        from users.models import Fanfic, ViewBucket
+        
+        bus = self.make_bus()
+        with mock.patch.object(invalidation, '_bus', bus):
+            with self.captureOnCommitCallbacks(execute=True):
+                SessionStore().create()
+                ViewBucket.objects.create(fanfic=self.fanfic, hour=timezone.now(), views=1, updated_at=timezone.now())
+            self.assertEqual(bus.stats()['pending'], 0)
+            
+            with self.captureOnCommitCallbacks(execute=True):
+                Fanfic.objects.filter(pk=self.fanfic.pk).update(views_count=5)
+        self.assertEqual(bus.stats()['pending'], 1)
+        # Отправка не запускает чтение шины - его запускает только процесс сервера
+        self.assertFalse(bus._task.is_running)
@@ -0,0 +1,152 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+
+class TestLeaderboards(TestCase):
+    """Тесты снимков рейтингов популярного"""
+    
+    def setUp(self):
+        from users.models import Fanfic
+        
+        User = get_user_model()
+        self.author = User.objects.create_user(username='author', password='authorpass')
+        self.drama = Fanfic.objects.create(
+            title='Драма', content='Текст', author=self.author, status='published', tags='драма', views_count=30,
+        )
+        self.fantasy = Fanfic.objects.create(
+            title='Фэнтези', content='Текст', author=self.author, status='published', tags='фэнтези, драма',
+            views_count=10,
+        )
+        self.other = Fanfic.objects.create(
+            title='Другое', content='Текст', author=self.author, status='published', tags='юмор', views_count=20,
+        )
+        Fanfic.objects.create(title='Черновик', content='Текст', author=self.author, status='draft', views_count=99)
+    
+    def board(self, tag='', window='all'):
+        from users.models import LeaderboardEntry
+        
+        return list(LeaderboardEntry.objects.filter(tag=tag, window=window).order_by('rank').values_list(
+            'fanfic_id', 'views'
+        ))
+    
+    def test_full_refresh_ranks(self):
+        """Общий рейтинг и рейтинги тегов по просмотрам, с итогами"""
+        from users.leaderboards import refresh_leaderboards
+        from users.models import LeaderboardStats
+        
+        result = refresh_leaderboards()
+        
+        self.assertTrue(result['full'])
+        self.assertEqual(self.board(), [(self.drama.pk, 30), (self.other.pk, 20), (self.fantasy.pk, 10)])
+        self.assertEqual(self.board('драма'), [(self.drama.pk, 30), (self.fantasy.pk, 10)])
+        self.assertEqual(self.board('юмор'), [(self.other.pk, 20)])
+        
+        stats = LeaderboardStats.objects.get(tag='', window='all')
+        self.assertEqual((stats.fanfics_count, stats.total_views, stats.avg_views), (3, 60, 20))
+    
+    def test_window_boards_from_buckets(self):
+        """Рейтинги за сутки и неделю считаются по почасовым корзинам"""
+        from users.leaderboards import current_hour, refresh_leaderboards
+        from users.models import ViewBucket
+        from users.view_tracking import ViewIngestor
+        
+        ingestor = ViewIngestor()
+        for _ in range(3):
+            ingestor.record(self.fantasy.pk)
+        ingestor.record(self.other.pk)
+        ingestor.flush()
+        
+        # Корзина трехдневной давности попадает только в недельный рейтинг,
+        # восьмидневной - ни в один и удаляется
+        hour = current_hour()
+        ViewBucket.objects.create(fanfic=self.other, hour=hour - timedelta(days=3), views=5, updated_at=hour)
+        ViewBucket.objects.create(fanfic=self.drama, hour=hour - timedelta(days=8), views=50, updated_at=hour)
+        
+        refresh_leaderboards()
+        
+        self.assertEqual(self.board(window='24h'), [(self.fantasy.pk, 3), (self.other.pk, 1)])
+        self.assertEqual(self.board(window='7d'), [(self.other.pk, 6), (self.fantasy.pk, 3)])
+        self.assertEqual(self.board('драма', window='24h'), [(self.fantasy.pk, 3)])
+        self.assertFalse(ViewBucket.objects.filter(fanfic=self.drama).exists())
+    
+    def test_incremental_refresh(self):
+        """В пределах часа пересчитываются только рейтинги тегов с новыми просмотрами"""
+        from users.leaderboards import current_hour, refresh_leaderboards
+        from users.models import ViewBucket
+        
+        now = current_hour() + timedelta(minutes=10)
+        later = now + timedelta(minutes=1)
+        refresh_leaderboards(now=now)
+        
+        self.assertEqual(refresh_leaderboards(now=later)['boards'], 0)
+        
+        ViewBucket.objects.create(fanfic=self.other, hour=current_hour(now), views=4, updated_at=later)
+        result = refresh_leaderboards(now=later)
+        
+        self.assertFalse(result['full'])
+        # Общий и "юмор" - по три периода
+        self.assertEqual(result['boards'], 6)
+        self.assertEqual(self.board('юмор', window='24h'), [(self.other.pk, 4)])
+    
+    def test_popular_page_reads_snapshot(self):
+        """Страница популярного показывает снимок и переключает периоды"""
+        from users.leaderboards import refresh_leaderboards
+        from users.models import Fanfic
+        
+        refresh_leaderboards()
+        # Без нового снимка порядок на странице не меняется
+        Fanfic.objects.filter(pk=self.fantasy.pk).update(views_count=100)
+        
+        response = self.client.get(reverse('popular_fanfics'))
+        self.assertEqual(
+            [fanfic.pk for fanfic in response.context['fanfics']],
+            [self.drama.pk, self.other.pk, self.fantasy.pk],
+        )
+        self.assertEqual(response.context['total_views'], 60)
+        
+        response = self.client.get(reverse('popular_fanfics'), {'period': '24h'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['fanfics']), [])
+    
+    def test_popular_page_without_snapshot(self):
+        """Пока снимка нет, рейтинг за период считается по корзинам просмотров"""
+        from users.leaderboards import current_hour
+        from users.models import ViewBucket
+        
+        hour = current_hour()
+        ViewBucket.objects.create(fanfic=self.fantasy, hour=hour, views=7, updated_at=hour)
+        ViewBucket.objects.create(fanfic=self.other, hour=hour - timedelta(hours=30), views=9, updated_at=hour)
+        
+        response = self.client.get(reverse('popular_fanfics'), {'period': '24h'})
+        self.assertEqual([fanfic.pk for fanfic in response.context['fanfics']], [self.fantasy.pk])
+        self.assertEqual(response.context['total_views'], 7)
+        
+        response = self.client.get(reverse('popular_fanfics'), {'period': '7d'})
+        self.assertEqual([fanfic.pk for fanfic in response.context['fanfics']], [self.other.pk, self.fantasy.pk])
+        
+        response = self.client.get(reverse('popular_fanfics'))
+        self.assertEqual(
+            [fanfic.pk for fanfic in response.context['fanfics']],
+            [self.drama.pk, self.other.pk, self.fantasy.pk],
+        )
+    
+    def test_refreshed_by_lock_holder(self):
+        """Из процессов сервера рейтинги обновляет только держатель блокировки"""
+        from unittest import mock
+        from django.conf import settings
+        from fanfiction.single_flight import KeyLock
+        from users import leaderboards
+        
+        other_process = KeyLock(settings.LEADERBOARD_LOCK_PATH)
+        self.assertTrue(other_process.acquire())
+        with mock.patch.object(leaderboards, '_leader_lock', None):
+            self.assertIsNone(leaderboards._refresh_as_leader())
+            self.assertEqual(self.board(), [])
+            
+            other_process.release()
+            self.assertTrue(leaderboards._refresh_as_leader()['full'])
+            self.addCleanup(leaderboards._leader_lock.release)
+        self.assertEqual(self.board()[0], (self.drama.pk, 30))
@@ -0,0 +1,139 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+
+
+class TestByteLRU(TestCase):
+    """Тесты LRU с бюджетом в байтах"""
+    
+    def test_evicts_least_recent_by_bytes(self):
+        """Вытесняются давно не читанные записи, пока сумма не влезет в бюджет"""
+        from fanfiction.object_cache import ByteLRU
+        
+        lru = ByteLRU(max_bytes=1600)
+        lru.set('a', b'x' * 100, 60)
+        lru.set('b', b'x' * 100, 60)
+        lru.get('a')
+        for i in range(15):
+            lru.set(f'c{i}', b'x' * 100, 60)
+        
+        stats = lru.stats()
+        self.assertLessEqual(stats['bytes'], 1600)
+        self.assertEqual(stats['evictions'], 1)
+        self.assertIsNotNone(lru.get('a'))
+        self.assertIsNone(lru.get('b'))
+    
+    def test_large_and_expired_entries(self):
+        """Слишком большие значения не хранятся, просроченные не отдаются"""
+        from fanfiction.object_cache import ByteLRU
+        
+        lru = ByteLRU(max_bytes=1600)
+        self.assertFalse(lru.set('big', b'x' * 101, 60))
+        lru.set('old', b'x', 10)
+        self.assertIsNone(lru.get('old', now=float('inf')))
+        self.assertEqual(lru.stats()['bytes'], 0)
+
+
+class TestObjectCache(TestCase):
+    """Тесты кэша фанфиков и пользователей"""
+    
+    def setUp(self):
+        from users.models import Fanfic
+        
+        User = get_user_model()
+        self.author = User.objects.create_user(username='author', password='authorpass', nickname='Автор')
+        self.reader = User.objects.create_user(username='reader', password='readerpass')
+        self.fanfic = Fanfic.objects.create(title='Фанфик', content='Текст', author=self.author, status='published')
+    
+    def test_read_through(self):
+        """Второе чтение без запросов, каждый вызов получает свою копию"""
+        from users.object_cache import fanfic_cache, get_fanfic
+        
+        before = fanfic_cache.stats()
+        self.assertEqual(get_fanfic(self.fanfic.pk).title, 'Фанфик')
+        
+        with self.assertNumQueries(0):
+            fanfic = get_fanfic(self.fanfic.pk)
+            self.assertEqual(fanfic.author.nickname, 'Автор')
+            fanfic.title = 'Испорчено во view'
+            self.assertEqual(get_fanfic(self.fanfic.pk).title, 'Фанфик')
+        
+        after = fanfic_cache.stats()
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 2)
+        self.assertIsNone(get_fanfic(999999))
+    
+    def test_signals_invalidate(self):
+        """save() и delete() сбрасывают запись"""
+        from users.object_cache import fanfic_cache, get_fanfic
+        
+        get_fanfic(self.fanfic.pk)
+        self.fanfic.title = 'Новое название'
+        self.fanfic.save()
+        self.assertEqual(get_fanfic(self.fanfic.pk).title, 'Новое название')
+        
+        self.author.nickname = 'Новый ник'
+        self.author.save()
+        self.assertEqual(get_fanfic(self.fanfic.pk).author.nickname, 'Новый ник')
+        
+        pk = self.fanfic.pk
+        self.fanfic.delete()
+        self.assertIsNone(fanfic_cache.get_cached(pk))
+    
+    def test_update_paths_invalidate(self):
+        """Смена статуса, закладки и сброс просмотров видны сразу"""
+        from users.object_cache import fanfic_cache, user_cache
+        from users.reactions import set_bookmark
+        from users.status import transition
+        from users.view_tracking import ViewIngestor
+        
+        fanfic_cache.get_cached(self.fanfic.pk)
+        user_cache.get_cached(self.reader.pk)
+        
+        set_bookmark(self.reader.pk, self.fanfic.pk)
+        self.assertEqual(fanfic_cache.get_cached(self.fanfic.pk).bookmarks_count, 1)
+        self.assertEqual(user_cache.get_cached(self.reader.pk).bookmarks_count, 1)
+        
+        ingestor = ViewIngestor(flush_interval=60, max_pending=1000)
+        ingestor.record(self.fanfic.pk)
+        ingestor.flush()
+        self.assertEqual(fanfic_cache.get_cached(self.fanfic.pk).views_count, 1)
+        
+        transition(self.fanfic.pk, 'to_draft')
+        self.assertEqual(fanfic_cache.get_cached(self.fanfic.pk).status, 'draft')
+    
+    def test_lookup_by_username(self):
+        """Поиск по username кэшируется и переживает переименование"""
+        from users.object_cache import user_cache
+        
+        self.assertEqual(user_cache.get_cached_by('username', 'author').pk, self.author.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(user_cache.get_cached_by('username', 'author').pk, self.author.pk)
+        
+        self.author.username = 'renamed'
+        self.author.save()
+        self.assertIsNone(user_cache.get_cached_by('username', 'author'))
+        self.assertEqual(user_cache.get_cached_by('username', 'renamed').pk, self.author.pk)
+    
+    def test_views_use_cache(self):
+        """Комментарии фанфика не перечитывают строку фанфика"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from django.urls import reverse
+        
+        self.client.force_login(self.reader)
+        url = reverse('get_comments_json', args=[self.fanfic.pk])
+        self.assertEqual(self.client.get(url).status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertFalse([q for q in queries if q['sql'].startswith('SELECT') and 'FROM "users_fanfic"' in q['sql']])
+        
+        self.assertEqual(self.client.get(reverse('get_comments_json', args=[999999])).status_code, 404)
+    
+    @override_settings(OBJECT_CACHE_TIMEOUT=0)
+    def test_disabled(self):
+        """При нулевом сроке каждый вызов читает базу"""
+        from users.object_cache import fanfic_cache
+        
+        fanfic_cache.get_cached(self.fanfic.pk)
+        with self.assertNumQueries(1):
+            fanfic_cache.get_cached(self.fanfic.pk)
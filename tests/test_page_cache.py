@@ -0,0 +1,106 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+
+class TestAnonymousPageCache(TestCase):
+    """Тесты кэша страниц для анонимных посетителей"""
+    
+    def setUp(self):
+        from django.core.cache import cache
+        from users.models import Fanfic
+        
+        cache.clear()
+        User = get_user_model()
+        self.author = User.objects.create_user(username='author', password='authorpass')
+        self.fanfic = Fanfic.objects.create(
+            title='Первый фанфик', content='Текст', author=self.author, status='published', tags='драма'
+        )
+    
+    def assertServedFromCache(self, url, **extra):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, **extra)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 0, [query['sql'] for query in queries])
+        return response
+    
+    def test_public_pages_cached(self):
+        """Повторный анонимный запрос не обращается к базе"""
+        urls = [
+            reverse('index'),
+            reverse('new_fanfics'),
+            reverse('popular_fanfics'),
+            reverse('all_tags'),
+            reverse('tag_detail', args=['драма']),
+            reverse('fanfic_detail', args=[self.fanfic.pk]),
+        ]
+        for url in urls:
+            first = self.client.get(url)
+            self.assertEqual(first.status_code, 200, url)
+            second = self.assertServedFromCache(url)
+            self.assertEqual(first.content, second.content, url)
+    
+    def test_query_string_normalized(self):
+        """Порядок параметров и метки кампаний не создают новых записей"""
+        url = reverse('popular_fanfics')
+        self.client.get(url + '?period=7d&page=1')
+        self.assertServedFromCache(url + '?page=1&period=7d&utm_source=mail')
+        
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url + '?period=24h')
+        self.assertGreater(len(queries), 0)
+    
+    def test_fanfic_change_invalidates(self):
+        """Изменение фанфика и смена статуса сбрасывают кэш"""
+        from users.status import transition
+        
+        url = reverse('new_fanfics')
+        self.client.get(url)
+        
+        self.fanfic.title = 'Новое название'
+        self.fanfic.save()
+        self.assertContains(self.client.get(url), 'Новое название')
+        
+        transition(self.fanfic, 'to_draft')
+        self.assertNotContains(self.client.get(url), 'Новое название')
+    
+    def test_authenticated_and_messages_bypass_cache(self):
+        """Вошедшие пользователи и страницы с сообщениями не кэшируются"""
+        from fanfiction.page_cache import page_cache_metrics
+        from users.models import Fanfic
+        
+        url = reverse('index')
+        stored = page_cache_metrics()['stored']
+        self.client.force_login(self.author)
+        self.client.get(url)
+        self.client.get(url)
+        self.assertEqual(page_cache_metrics()['stored'], stored)
+        
+        self.client.logout()
+        # Черновик недоступен анониму - редирект с сообщением на главную
+        draft = Fanfic.objects.create(title='Черновик', content='Текст', author=self.author, status='draft')
+        response = self.client.get(reverse('fanfic_detail', args=[draft.pk]), follow=True)
+        self.assertContains(response, 'Этот фанфик не доступен для просмотра.')
+        # Сообщение показано один раз и не попало в кэш
+        self.assertNotContains(self.client.get(url), 'Этот фанфик не доступен для просмотра.')
+    
+    def test_conditional_get_from_cache(self):
+        """Закэшированная страница фанфика отвечает 304 на свой ETag"""
+        url = reverse('fanfic_detail', args=[self.fanfic.pk])
+        etag = self.client.get(url)['ETag']
+        
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(queries), 0)
+    
+    @override_settings(PAGE_CACHE_TIMEOUT=0, QUERY_CACHE_TIMEOUT=0)
+    def test_disabled(self):
+        """При нулевом сроке страницы не кэшируются"""
+        url = reverse('index')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertGreater(len(queries), 0)
@@ -0,0 +1,136 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+
+class TestQueryCache(TestCase):
+    """Тесты кэша результатов запросов по версиям таблиц"""
+    
+    def setUp(self):
+        from django.core.cache import cache
+        from users.models import Fanfic
+        
+        cache.clear()
+        User = get_user_model()
+        self.author = User.objects.create_user(username='author', password='authorpass')
+        self.fanfic = Fanfic.objects.create(title='Первый', content='Текст', author=self.author, status='published')
+    
+    def published(self):
+        from users.models import Fanfic
+        
+        return Fanfic.objects.filter(status='published').order_by('-created_at').cached()
+    
+    def test_repeat_without_queries(self):
+        """Повторная выборка, count() и exists() не ходят в базу"""
+        from users.cards import fanfic_cards
+        
+        self.assertEqual([card.title for card in fanfic_cards(self.published()[:10])], ['Первый'])
+        self.assertEqual(self.published().count(), 1)
+        self.assertTrue(self.published().exists())
+        
+        with self.assertNumQueries(0):
+            self.assertEqual([card.title for card in fanfic_cards(self.published()[:10])], ['Первый'])
+            self.assertEqual(self.published().count(), 1)
+            self.assertTrue(self.published().exists())
+    
+    def test_opt_in_and_out(self):
+        """Без .cached() и после .uncached() выборка идет в базу"""
+        from users.models import Fanfic
+        
+        list(Fanfic.objects.filter(status='published'))
+        with self.assertNumQueries(1):
+            list(Fanfic.objects.filter(status='published'))
+        
+        list(self.published())
+        with self.assertNumQueries(1):
+            list(self.published().uncached())
+    
+    def test_writes_bump_versions(self):
+        """save(), update(), запись в таблицу подзапроса и сырой SQL сбрасывают результат"""
+        from django.db import connection
+        from users.cards import fanfic_cards
+        from users.models import Comment, Fanfic
+        
+        def cards():
+            return fanfic_cards(self.published()[:10])
+        
+        cards()
+        Fanfic.objects.create(title='Второй', content='Текст', author=self.author, status='published')
+        self.assertEqual([card.title for card in cards()], ['Второй', 'Первый'])
+        
+        Fanfic.objects.filter(pk=self.fanfic.pk).update(status='draft')
+        self.assertEqual([card.title for card in cards()], ['Второй'])
+        
+        # Число комментариев приходит подзапросом к таблице комментариев
+        second = Fanfic.objects.get(title='Второй')
+        Comment.objects.create(fanfic=second, author=self.author, content='Комментарий')
+        self.assertEqual(cards()[0].comments_count, 1)
+        
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE users_fanfic SET title = %s WHERE id = %s', ['Сырой', second.pk])
+        self.assertEqual(cards()[0].title, 'Сырой')
+    
+    def test_other_tables_keep_results(self):
+        """Запись в несвязанную таблицу не сбрасывает результат"""
+        from users.models import Bookmark
+        
+        list(self.published())
+        Bookmark.objects.create(user=self.author, fanfic=self.fanfic)
+        with self.assertNumQueries(0):
+            list(self.published())
+    
+    def test_replica_key_follows_writes(self):
+        """Результат реплики переживает новые снимки, пока в таблицы не пишут"""
+        import time
+        from unittest import mock
+        from fanfiction import query_cache
+        from users.models import Fanfic
+        
+        def key():
+            return Fanfic.objects.using('replica').filter(status='published').cached()._cache_key('rows')
+        
+        written_at = time.time()
+        query_cache.bump_table(Fanfic._meta.db_table)
+        # Снимок старше записи: результат живет до следующего снимка
+        with mock.patch.object(query_cache, 'replica_stamp', return_value=written_at - 5):
+            lagging = key()
+        with mock.patch.object(query_cache, 'replica_stamp', return_value=written_at - 1):
+            self.assertNotEqual(key(), lagging)
+        
+        # Реплика догнала запись: новые снимки ключ не меняют
+        with mock.patch.object(query_cache, 'replica_stamp', return_value=written_at + 5):
+            caught_up = key()
+        with mock.patch.object(query_cache, 'replica_stamp', return_value=written_at + 10):
+            self.assertEqual(key(), caught_up)
+        self.assertNotEqual(caught_up, lagging)
+    
+    def test_metrics(self):
+        """Метрики считают попадания, промахи и версии таблиц"""
+        from fanfiction.metrics import collect
+        
+        before = collect()['query_cache']
+        list(self.published())
+        list(self.published())
+        after = collect()['query_cache']
+        
+        self.assertEqual(after['hits'] - before['hits'], 1)
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertIn('users_fanfic', after['tables'])
+    
+    def test_new_fanfics_page(self):
+        """Страница новинок второй раз не выбирает фанфики"""
+        self.client.force_login(self.author)
+        url = reverse('new_fanfics')
+        self.assertContains(self.client.get(url), 'Первый')
+        with self.assertNumQueries(2):
+            # пользователь и его закладки на странице (сессия из кэша)
+            self.assertContains(self.client.get(url), 'Первый')
+    
+    @override_settings(QUERY_CACHE_TIMEOUT=0)
+    def test_disabled(self):
+        """При нулевом сроке .cached() ничего не кэширует"""
+        from users.models import Fanfic
+        
+        list(Fanfic.objects.filter(status='published').cached())
+        with self.assertNumQueries(1):
+            list(Fanfic.objects.filter(status='published').cached())
@@ -0,0 +1,148 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+
+class TestBookmarkToggles(TestCase):
+    """Тесты идемпотентных закладок"""
+    
+    def setUp(self):
+        from users.models import Fanfic
+        
+        User = get_user_model()
+        self.author = User.objects.create_user(username='author', password='authorpass')
+        self.reader = User.objects.create_user(username='reader', password='readerpass')
+        self.fanfic = Fanfic.objects.create(title='Фанфик', content='Текст', author=self.author, status='published')
+        self.draft = Fanfic.objects.create(title='Черновик', content='Текст', author=self.author, status='draft')
+        self.client.force_login(self.reader)
+    
+    def test_set_is_idempotent(self):
+        """Повторная установка не создает дубль и не меняет счетчики"""
+        from users.models import Bookmark
+        
+        url = reverse('set_bookmark', args=[self.fanfic.pk])
+        first = self.client.post(url).json()
+        second = self.client.post(url).json()
+        
+        self.assertTrue(first['is_bookmarked'] and first['changed'])
+        self.assertTrue(second['is_bookmarked'])
+        self.assertFalse(second['changed'])
+        self.assertEqual(second['bookmarks_count'], 1)
+        self.assertEqual(second['fanfic_bookmarks_count'], 1)
+        self.assertEqual(Bookmark.objects.count(), 1)
+    
+    def test_unset_is_idempotent(self):
+        """Повторное снятие ничего не ломает, счетчики не уходят в минус"""
+        self.client.post(reverse('set_bookmark', args=[self.fanfic.pk]))
+        url = reverse('unset_bookmark', args=[self.fanfic.pk])
+        first = self.client.post(url).json()
+        second = self.client.post(url).json()
+        
+        self.assertFalse(first['is_bookmarked'])
+        self.assertTrue(first['changed'])
+        self.assertFalse(second['changed'])
+        self.assertEqual(second['bookmarks_count'], 0)
+        
+        self.reader.refresh_from_db()
+        self.fanfic.refresh_from_db()
+        self.assertEqual(self.reader.bookmarks_count, 0)
+        self.assertEqual(self.fanfic.bookmarks_count, 0)
+    
+    def test_set_single_insert(self):
+        """Новое состояние решает один INSERT, без предварительного SELECT и COUNT"""
+        from users.reactions import set_bookmark
+        
+        with CaptureQueriesContext(connection) as queries:
+            state = set_bookmark(self.reader.pk, self.fanfic.pk)
+        
+        statements = [query['sql'].split()[0].upper() for query in queries]
+        self.assertEqual(statements.count('INSERT'), 1)
+        self.assertNotIn('SELECT', statements)
+        self.assertEqual(state['user_count'], 1)
+    
+    def test_unpublished_is_not_found(self):
+        """Черновик нельзя добавить в закладки"""
+        response = self.client.post(reverse('set_bookmark', args=[self.draft.pk]))
+        self.assertEqual(response.status_code, 404)
+    
+    def test_toggle_single_write(self):
+        """Переключение закладки - одна операция писателя в обе стороны"""
+        from unittest import mock
+        from fanfiction import writer
+        from users.reactions import switch_bookmark
+        
+        with mock.patch.object(writer, 'submit', wraps=writer.submit) as submit:
+            self.assertTrue(switch_bookmark(self.reader.pk, self.fanfic.pk)['active'])
+            self.assertEqual(submit.call_count, 1)
+            state = switch_bookmark(self.reader.pk, self.fanfic.pk)
+            self.assertEqual(submit.call_count, 2)
+        self.assertEqual((state['active'], state['changed'], state['user_count']), (False, True, 0))
+    
+    def test_toggle_and_clear_keep_counters(self):
+        """Переключение и очистка закладок поддерживают счетчики"""
+        response = self.client.get(
+            reverse('toggle_bookmark', args=[self.fanfic.pk]), HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+        self.assertEqual(response.json(), {'is_bookmarked': True, 'fanfic_id': self.fanfic.pk, 'bookmarks_count': 1})
+        
+        self.client.post(reverse('clear_bookmarks'))
+        self.reader.refresh_from_db()
+        self.fanfic.refresh_from_db()
+        self.assertEqual(self.reader.bookmarks_count, 0)
+        self.assertEqual(self.fanfic.bookmarks_count, 0)
+
+
+class TestCommentLikes(TestCase):
+    """Тесты лайков комментариев"""
+    
+    def setUp(self):
+        from users.models import Comment, Fanfic
+        
+        User = get_user_model()
+        self.author = User.objects.create_user(username='author', password='authorpass')
+        self.reader = User.objects.create_user(username='reader', password='readerpass')
+        fanfic = Fanfic.objects.create(title='Фанфик', content='Текст', author=self.author, status='published')
+        self.comment = Comment.objects.create(fanfic=fanfic, author=self.author, content='Комментарий')
+        self.client.force_login(self.reader)
+    
+    def test_like_unlike(self):
+        """Лайк ставится один раз и снимается"""
+        from users.models import CommentLike
+        
+        like_url = reverse('set_comment_like', args=[self.comment.pk])
+        self.client.post(like_url)
+        state = self.client.post(like_url).json()
+        self.assertEqual(state['likes_count'], 1)
+        self.assertEqual(CommentLike.objects.count(), 1)
+        
+        state = self.client.post(reverse('unset_comment_like', args=[self.comment.pk])).json()
+        self.assertFalse(state['is_liked'])
+        self.assertEqual(state['likes_count'], 0)
+    
+    def test_like_invalidates_cached_pages(self):
+        """Лайк сбрасывает кэш страниц и меняет ETag страницы фанфика"""
+        from fanfiction import page_cache
+        from users.reactions import set_comment_like
+        
+        detail_url = reverse('fanfic_detail', args=[self.comment.fanfic_id])
+        etag = self.client.get(detail_url)['ETag']
+        version = page_cache._version()
+        
+        set_comment_like(self.author.pk, self.comment.pk)
+        self.assertGreater(page_cache._version(), version)
+        response = self.client.get(detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        
+        # Повторный лайк ничего не меняет - кэш остается
+        version = page_cache._version()
+        set_comment_like(self.author.pk, self.comment.pk)
+        self.assertEqual(page_cache._version(), version)
+    
+    def test_deleted_comment_cannot_be_liked(self):
+        self.comment.is_deleted = True
+        self.comment.save()
+        
+        response = self.client.post(reverse('set_comment_like', args=[self.comment.pk]))
+        self.assertEqual(response.status_code, 404)
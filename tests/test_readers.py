@@ -0,0 +1,100 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+BROWSER_UA = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 Chrome/126.0 Safari/537.36'
+
+
+class TestHyperLogLog(TestCase):
+    """Тесты скетча HyperLogLog"""
+    
+    def test_estimate_and_merge(self):
+        """Оценка в пределах нескольких процентов, объединение - как у множеств"""
+        from fanfiction.hll import HyperLogLog
+        
+        first, second = HyperLogLog(), HyperLogLog()
+        for i in range(20000):
+            first.add(f'reader:{i}')
+        for i in range(10000, 30000):
+            second.add(f'reader:{i}')
+        
+        self.assertAlmostEqual(first.count(), 20000, delta=20000 * 0.06)
+        self.assertAlmostEqual(HyperLogLog.union([first, second]).count(), 30000, delta=30000 * 0.06)
+        # Повторы не меняют скетч
+        self.assertFalse(first.add('reader:1'))
+    
+    def test_small_counts_and_storage(self):
+        """Малые числа считаются почти точно, скетч хранится в нескольких КБ"""
+        from fanfiction.hll import HyperLogLog
+        
+        sketch = HyperLogLog()
+        for i in range(50):
+            sketch.add(f'reader:{i}')
+        
+        restored = HyperLogLog.loads(sketch.dumps())
+        self.assertEqual(restored.count(), sketch.count())
+        self.assertAlmostEqual(restored.count(), 50, delta=2)
+        self.assertLess(len(sketch.dumps()), 4096)
+
+
+class TestUniqueReaders(TestCase):
+    """Тесты дневных скетчей уникальных читателей"""
+    
+    def setUp(self):
+        from django.core.cache import cache
+        from users.models import Fanfic
+        
+        cache.clear()
+        User = get_user_model()
+        self.author = User.objects.create_user(username='author', password='authorpass')
+        self.reader = User.objects.create_user(username='reader', password='readerpass')
+        self.fanfic = Fanfic.objects.create(title='Фанфик', content='Текст', author=self.author, status='published')
+    
+    def test_beacons_count_unique_readers(self):
+        """Каждый читатель попадает в оценку один раз"""
+        from django.test import Client
+        from users.readers import unique_readers
+        from users.view_tracking import ingestor
+        
+        url = reverse('fanfic_view_beacon', args=[self.fanfic.pk])
+        for _ in range(3):
+            self.client.post(url, HTTP_USER_AGENT=BROWSER_UA, REMOTE_ADDR='10.0.0.1')
+        Client().post(url, HTTP_USER_AGENT=BROWSER_UA, REMOTE_ADDR='10.0.0.2')
+        reader_client = Client()
+        reader_client.force_login(self.reader)
+        reader_client.post(url, HTTP_USER_AGENT=BROWSER_UA)
+        ingestor.flush()
+        
+        # Повторы первого читателя отсеяны еще в beacon
+        self.fanfic.refresh_from_db()
+        self.assertEqual(self.fanfic.views_count, 3)
+        self.assertEqual(unique_readers(self.fanfic.pk), {'day': 3, 'week': 3, 'month': 3})
+    
+    def test_periods_merge_daily_sketches(self):
+        """Неделя и месяц объединяют дневные скетчи"""
+        from fanfiction.hll import HyperLogLog
+        from users.models import ReaderSketch
+        from users.readers import unique_readers
+        
+        today = timezone.now().date()
+        for offset, readers in [(0, range(0, 10)), (3, range(5, 20)), (20, range(100, 130)), (40, range(500, 600))]:
+            sketch = HyperLogLog()
+            for i in readers:
+                sketch.add(f'user:{i}')
+            ReaderSketch.objects.create(fanfic=self.fanfic, day=today - timedelta(days=offset), registers=sketch.dumps())
+        
+        self.assertEqual(unique_readers(self.fanfic.pk, today), {'day': 10, 'week': 20, 'month': 50})
+    
+    def test_readers_endpoint_for_author_only(self):
+        """Оценку видит только автор"""
+        url = reverse('fanfic_readers', args=[self.fanfic.pk])
+        
+        self.client.force_login(self.reader)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        
+        self.client.force_login(self.author)
+        data = self.client.get(url).json()
+        self.assertEqual(data['unique_readers'], {'day': 0, 'week': 0, 'month': 0})
@@ -0,0 +1,150 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+
+class TestSessionStore(TestCase):
+    """Тесты сессий в кэше процесса с отложенной записью"""
+    
+    def make_session(self, **data):
+        from fanfiction.session_store import SessionStore
+        
+        session = SessionStore()
+        session.update(data)
+        session.create()
+        return SessionStore(session.session_key)
+    
+    def stored_data(self, session_key):
+        from django.contrib.sessions.models import Session
+        
+        return Session.objects.get(session_key=session_key).get_decoded()
+    
+    def test_loaded_from_cache(self):
+        """Созданная сессия читается без запроса к базе"""
+        session = self.make_session(user='author')
+        with self.assertNumQueries(0):
+            self.assertEqual(session['user'], 'author')
+    
+    def test_unchanged_not_written(self):
+        """Сохранение без изменений в базу не пишется"""
+        session = self.make_session(user='author')
+        session['user'] = 'author'
+        with self.assertNumQueries(0):
+            session.save()
+    
+    def test_changes_written_behind(self):
+        """Изменение попадает в кэш и в базу"""
+        from fanfiction.session_store import SessionStore
+        
+        session = self.make_session(user='author')
+        session['theme'] = 'dark'
+        with self.captureOnCommitCallbacks(execute=True):
+            session.save()
+        
+        self.assertEqual(self.stored_data(session.session_key), {'user': 'author', 'theme': 'dark'})
+        with self.assertNumQueries(0):
+            self.assertEqual(SessionStore(session.session_key)['theme'], 'dark')
+    
+    def test_failed_write_retried(self):
+        """Неудачная отложенная запись повторяется, после последней попытки кэш сбрасывается"""
+        from unittest import mock
+        from fanfiction import session_store
+        
+        session = self.make_session(user='author')
+        session['theme'] = 'dark'
+        real_write = session_store._write_session
+        attempts = []
+        
+        def flaky_write(*args):
+            attempts.append(args)
+            if len(attempts) == 1:
+                raise RuntimeError('база занята')
+            return real_write(*args)
+        
+        with mock.patch.object(session_store, '_write_session', side_effect=flaky_write):
+            with self.assertLogs('fanfiction.session_store', 'WARNING'):
+                session.save()
+        self.assertEqual(self.stored_data(session.session_key)['theme'], 'dark')
+        
+        session['theme'] = 'light'
+        with mock.patch.object(session_store, '_write_session', side_effect=RuntimeError('база занята')):
+            with self.assertLogs('fanfiction.session_store', 'ERROR'), self.settings(SESSION_WRITE_RETRIES=1):
+                session.save()
+        # В кэше не осталось несохраненного изменения
+        self.assertEqual(session_store.SessionStore(session.session_key)['theme'], 'dark')
+    
+    def test_failed_write_not_retried_over_newer(self):
+        """Неудача старой записи не затирает более новую и не сбрасывает кэш"""
+        from concurrent.futures import Future
+        from unittest import mock
+        from fanfiction import session_store
+        
+        session = self.make_session(user='author')
+        queued = []
+        
+        def submit(func, *args, using=None):
+            queued.append((Future(), func, args))
+            return queued[-1][0]
+        
+        with mock.patch.object(session_store.writer, 'submit', side_effect=submit):
+            session['theme'] = 'dark'
+            session.save()
+            session['theme'] = 'light'
+            session.save()
+            with self.assertLogs('fanfiction.session_store', 'WARNING'):
+                queued[0][0].set_exception(RuntimeError('база занята'))
+            self.assertEqual(len(queued), 2)
+            
+            future, func, args = queued[1]
+            func(*args)
+            future.set_result(None)
+        
+        self.assertEqual(self.stored_data(session.session_key)['theme'], 'light')
+        self.assertEqual(session_store.SessionStore(session.session_key)['theme'], 'light')
+        self.assertNotIn(session.cache_key, session_store._latest)
+    
+    def test_messages_survive_other_process(self):
+        """Флеш-сообщение после редиректа не зависит от кэша сессий процесса"""
+        from django.core.cache import caches
+        from django.urls import reverse
+        
+        get_user_model().objects.create_user(username='reader', password='readerpass')
+        response = self.client.post(reverse('login'), {'username': 'reader', 'password': 'readerpass'})
+        self.assertRedirects(response, reverse('profile'), fetch_redirect_response=False)
+        
+        # Следующий запрос выполняет процесс, у которого сессии в кэше нет
+        caches['sessions'].clear()
+        self.assertContains(self.client.get(reverse('profile')), 'Добро пожаловать, reader!')
+    
+    def test_deleted_session_not_resurrected(self):
+        """Отложенная запись после выхода не возвращает сессию"""
+        from django.contrib.sessions.models import Session
+        from fanfiction.session_store import SessionStore, _write_session
+        
+        session = self.make_session(user='author')
+        encoded = session.encode({'user': 'author'})
+        SessionStore(session.session_key).delete()
+        
+        _write_session(Session, session.session_key, encoded, session.get_expiry_date(), 'default')
+        self.assertFalse(Session.objects.filter(session_key=session.session_key).exists())
+        self.assertEqual(SessionStore(session.session_key).load(), {})
+    
+    def test_remote_change_drops_cache(self):
+        """Событие шины от другого процесса заставляет перечитать сессию"""
+        from fanfiction.session_store import SessionStore, _forget_session
+        
+        session = self.make_session(user='author')
+        _forget_session(session.session_key)
+        with self.assertNumQueries(1):
+            self.assertEqual(SessionStore(session.session_key)['user'], 'author')
+    
+    def test_authenticated_request_skips_session_table(self):
+        """Запрос вошедшего пользователя не читает django_session"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from django.urls import reverse
+        
+        user = get_user_model().objects.create_user(username='reader', password='readerpass')
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('metrics'))
+        self.assertFalse([query for query in queries if 'django_session' in query['sql']])
@@ -0,0 +1,213 @@
+import threading
+import time
+
+from django.test import TestCase, override_settings
+
+
+class TestSingleFlight(TestCase):
+    """Тесты защиты пересчетов от лавины запросов"""
+    
+    def setUp(self):
+        self.calls = 0
+    
+    def compute(self, value='новое'):
+        def compute():
+            self.calls += 1
+            return value
+        return compute
+    
+    def hold_lock(self, key):
+        from fanfiction.single_flight import KeyLock, _paths
+        
+        lock = KeyLock(_paths(key)[1])
+        self.assertTrue(lock.acquire())
+        self.addCleanup(lock.release)
+        return lock
+    
+    def test_fresh_value_reused(self):
+        """Свежее значение отдается без пересчета, каждый раз копией"""
+        from fanfiction.single_flight import single_flight
+        
+        first = single_flight('key', lambda: ['значение'])
+        first.append('испорчено')
+        self.assertEqual(single_flight('key', self.compute()), ['значение'])
+        self.assertEqual(self.calls, 0)
+    
+    def test_stale_served_while_recomputing(self):
+        """Пока другой пересчитывает, устаревшее значение отдается сразу"""
+        from fanfiction.single_flight import single_flight
+        
+        single_flight('key', lambda: 'старое', version=1)
+        self.hold_lock('key')
+        
+        self.assertEqual(single_flight('key', self.compute(), version=2), 'старое')
+        self.assertEqual(single_flight('key', self.compute(), soft_ttl=0, version=1), 'старое')
+        self.assertEqual(self.calls, 0)
+    
+    def test_stale_recomputed_by_lock_holder(self):
+        """Взявший блокировку пересчитывает, дальше значение снова свежее"""
+        from fanfiction.single_flight import single_flight
+        
+        single_flight('key', lambda: 'старое', version=1)
+        self.assertEqual(single_flight('key', self.compute(), version=2), 'новое')
+        self.assertEqual(single_flight('key', self.compute('другое'), version=2), 'новое')
+        self.assertEqual(self.calls, 1)
+    
+    def test_failed_recompute_keeps_stale(self):
+        """Ошибка пересчета не ломает страницу, пока есть старое значение"""
+        from fanfiction.single_flight import single_flight
+        
+        def broken():
+            raise RuntimeError('база недоступна')
+        
+        single_flight('key', lambda: 'старое', version=1)
+        with self.assertLogs('fanfiction.single_flight', 'ERROR'):
+            self.assertEqual(single_flight('key', broken, version=2), 'старое')
+        with self.assertRaises(RuntimeError):
+            single_flight('other', broken)
+    
+    def test_missing_waits_for_computation(self):
+        """Без значения запросы ждут одного пересчета"""
+        from fanfiction.single_flight import single_flight
+        
+        start = threading.Barrier(8)
+        results = []
+        
+        def slow():
+            self.calls += 1
+            time.sleep(0.2)
+            return 'посчитано'
+        
+        def request():
+            start.wait()
+            results.append(single_flight('key', slow))
+        
+        threads = [threading.Thread(target=request) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(results, ['посчитано'] * 8)
+        self.assertEqual(self.calls, 1)
+    
+    @override_settings(SINGLE_FLIGHT_LOCK_TIMEOUT=0.05)
+    def test_lock_timeout(self):
+        """Не дождавшись блокировки, запрос считает сам"""
+        from fanfiction.metrics import collect
+        from fanfiction.single_flight import single_flight
+        
+        self.hold_lock('key')
+        before = collect()['single_flight']
+        self.assertEqual(single_flight('key', self.compute()), 'новое')
+        after = collect()['single_flight']
+        self.assertEqual(after['lock_timeouts'] - before['lock_timeouts'], 1)
+    
+    def test_tag_cloud_served_while_recomputing(self):
+        """Облако тегов: во время пересчета отдается прошлое вместе со своей версией"""
+        from django.contrib.auth import get_user_model
+        from django.core.cache import cache
+        from django.urls import reverse
+        from users.models import Fanfic
+        
+        cache.clear()
+        author = get_user_model().objects.create_user(username='author', password='authorpass')
+        Fanfic.objects.create(title='Первый', content='Текст', author=author, status='published', tags='драма')
+        self.assertContains(self.client.get(reverse('all_tags')), '1 тегов в 1 фанфиках')
+        
+        Fanfic.objects.create(title='Второй', content='Текст', author=author, status='published', tags='юмор')
+        self.hold_lock('all_tags')
+        response = self.client.get(reverse('all_tags'))
+        self.assertContains(response, '1 тегов в 1 фанфиках')
+        self.assertNotContains(response, 'юмор')
+    
+    def test_generation_makes_value_stale(self):
+        """Поднятый счетчик делает значение его версии устаревшим"""
+        from fanfiction.single_flight import bump_generation, generation, single_flight
+        
+        self.assertEqual(generation('fanfics'), 0)
+        single_flight('key', lambda: 'старое', version=generation('fanfics'))
+        bump_generation('fanfics')
+        self.assertEqual(generation('fanfics'), 1)
+        self.assertEqual(single_flight('key', self.compute(), version=generation('fanfics')), 'новое')
+    
+    @override_settings(SINGLE_FLIGHT_LOCK_TIMEOUT=0.05)
+    def test_generation_not_bumped_without_lock(self):
+        """Без блокировки счетчик не перезаписывается"""
+        from fanfiction.single_flight import KeyLock, _generation_paths, bump_generation, generation
+        
+        bump_generation('fanfics')
+        lock = KeyLock(_generation_paths('fanfics')[1])
+        self.assertTrue(lock.acquire())
+        self.addCleanup(lock.release)
+        with self.assertRaises(TimeoutError):
+            bump_generation('fanfics')
+        self.assertEqual(generation('fanfics'), 1)
+    
+    def test_generation_seen_within_one_tick(self):
+        """Подъем счетчика виден, даже если время изменения файла не сменилось"""
+        import os
+        from fanfiction.single_flight import _generation_paths, bump_generation, generation
+        
+        bump_generation('fanfics')
+        path = _generation_paths('fanfics')[0]
+        mtime_ns = os.stat(path).st_mtime_ns
+        self.assertEqual(generation('fanfics'), 1)
+        
+        bump_generation('fanfics')
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+        self.assertEqual(generation('fanfics'), 2)
+    
+    def test_clear_keeps_generations(self):
+        """Сброс значений не обнуляет счетчики"""
+        from fanfiction.single_flight import bump_generation, clear, generation, single_flight
+        
+        bump_generation('fanfics')
+        single_flight('key', lambda: 'старое', version=generation('fanfics'))
+        clear()
+        self.assertEqual(generation('fanfics'), 1)
+        self.assertEqual(single_flight('key', self.compute(), version=generation('fanfics')), 'новое')
+    
+    @override_settings(SINGLE_FLIGHT_MAX_BLOBS=2)
+    def test_read_files_capped(self):
+        """В памяти хранятся байты только последних прочитанных файлов"""
+        from fanfiction import single_flight as module
+        
+        for key in ('первый', 'второй', 'третий'):
+            module.single_flight(key, self.compute(key))
+            module.single_flight(key, self.compute())
+        self.assertEqual(list(module._blobs), [module._paths('второй')[0], module._paths('третий')[0]])
+    
+    def test_unpublished_leaves_popular_list(self):
+        """Снятый с публикации фанфик сразу пропадает из топа популярных"""
+        from django.contrib.auth import get_user_model
+        from users.models import Fanfic
+        from users.status import transition
+        from users.views import _popular_fanfics_list
+        
+        author = get_user_model().objects.create_user(username='author', password='authorpass')
+        fanfic = Fanfic.objects.create(title='Первый', content='Текст', author=author, status='published')
+        self.assertEqual([card.pk for card in _popular_fanfics_list()], [fanfic.pk])
+        
+        transition(fanfic, 'to_draft')
+        self.assertEqual(_popular_fanfics_list(), [])
+    
+    def test_unpublished_leaves_recommendations(self):
+        """Снятый с публикации фанфик сразу пропадает из общей подборки рекомендаций"""
+        from django.contrib.auth import get_user_model
+        from users.models import Fanfic, ViewHistory
+        from users.status import transition
+        from users.views import _recommended_fanfics_list
+        
+        User = get_user_model()
+        author = User.objects.create_user(username='author', password='authorpass')
+        reader = User.objects.create_user(username='reader', password='readerpass')
+        read, other = (
+            Fanfic.objects.create(title=title, content='Текст', author=author, status='published', tags='драма')
+            for title in ('Прочитанный', 'Похожий')
+        )
+        ViewHistory.objects.create(user=reader, fanfic=read)
+        self.assertEqual([card.pk for card in _recommended_fanfics_list(reader)], [other.pk])
+        
+        transition(other, 'to_draft')
+        self.assertEqual(_recommended_fanfics_list(reader), [])
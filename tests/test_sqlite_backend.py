@@ -0,0 +1,99 @@
+import os
+import sqlite3
+import tempfile
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+
+
+class TestConnectionProfile(TestCase):
+    """Тесты профиля соединения SQLite"""
+    
+    def test_pragmas_applied(self):
+        """PRAGMA из профиля применяются к соединению"""
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA temp_store')
+            self.assertEqual(cursor.fetchone()[0], 2)  # MEMORY
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 20000)
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], -65536)
+    
+    def test_metrics_view(self):
+        """Страница метрик доступна только персоналу"""
+        User = get_user_model()
+        staff = User.objects.create_user(username='staff', password='staffpass', is_staff=True)
+        
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 302)
+        
+        self.client.force_login(staff)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('sqlite', response.json())
+
+
+class TestLockStats(TransactionTestCase):
+    """Тесты статистики ожидания блокировки записи"""
+    
+    def test_transaction_records_wait(self):
+        """BEGIN IMMEDIATE учитывается в статистике"""
+        from django.db import transaction
+        from fanfiction.db_backends.sqlite3.base import get_lock_stats
+        
+        stats = get_lock_stats(connection.alias)
+        before = stats.snapshot()['transactions']
+        
+        with transaction.atomic():
+            get_user_model().objects.create_user(username='writer', password='writerpass')
+        
+        self.assertEqual(stats.snapshot()['transactions'], before + 1)
+    
+    def test_slow_wait_counted(self):
+        """Долгое ожидание попадает в slow_waits и max_wait_ms"""
+        from fanfiction.db_backends.sqlite3.base import LockStats
+        
+        stats = LockStats()
+        stats.record_wait(0.001)
+        stats.record_wait(0.02)
+        stats.record_locked()
+        
+        snapshot = stats.snapshot()
+        self.assertEqual(snapshot['transactions'], 2)
+        self.assertEqual(snapshot['slow_waits'], 1)
+        self.assertEqual(snapshot['locked_errors'], 1)
+        self.assertGreaterEqual(snapshot['max_wait_ms'], 20)
+
+
+class TestWalCheckpointer(TestCase):
+    """Тесты фонового WAL-checkpoint"""
+    
+    def test_checkpoint_truncates_large_wal(self):
+        """Большой журнал переносится и обрезается"""
+        from fanfiction.db_backends.sqlite3.checkpoint import WalCheckpointer
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'wal.sqlite3')
+            conn = sqlite3.connect(path)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA wal_autocheckpoint = 0')
+            conn.execute('CREATE TABLE t (x BLOB)')
+            for _ in range(50):
+                conn.execute('INSERT INTO t VALUES (?)', (b'x' * 4096,))
+                conn.commit()
+            
+            checkpointer = WalCheckpointer(path, interval=60, truncate_pages=10)
+            busy, wal_pages, checkpointed = checkpointer.run()
+            wal_size = os.path.getsize(path + '-wal')
+            conn.close()
+            
+            self.assertEqual(busy, 0)
+            self.assertEqual(wal_size, 0)
+            stats = checkpointer.stats()
+            self.assertEqual(stats['runs'], 1)
+            self.assertEqual(stats['truncates'], 1)
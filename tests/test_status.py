@@ -0,0 +1,66 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+
+class TestStatusTransitions(TestCase):
+    """Тесты переходов статуса условным UPDATE"""
+    
+    def setUp(self):
+        from users.models import Fanfic
+        
+        User = get_user_model()
+        self.author = User.objects.create_user(username='author', password='authorpass')
+        self.other = User.objects.create_user(username='other', password='otherpass')
+        self.fanfic = Fanfic.objects.create(
+            title='Фанфик', content='Исходный текст', author=self.author, status='published', tags='драма'
+        )
+    
+    def test_single_update_without_select(self):
+        """Переход - один UPDATE, без SELECT"""
+        from users.status import transition
+        
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(transition(self.fanfic.pk, 'move_to_trash'))
+        
+        statements = [query['sql'].split()[0].upper() for query in queries]
+        self.assertEqual(statements.count('UPDATE'), 1)
+        self.assertNotIn('SELECT', statements)
+    
+    def test_transition_keeps_concurrent_edit(self):
+        """Переход не перезаписывает текст, измененный параллельно"""
+        from users.models import Fanfic
+        
+        Fanfic.objects.filter(pk=self.fanfic.pk).update(content='Новый текст')
+        self.fanfic.move_to_archive()
+        
+        self.assertEqual(self.fanfic.status, 'archived')
+        self.fanfic.refresh_from_db()
+        self.assertEqual(self.fanfic.status, 'archived')
+        self.assertEqual(self.fanfic.content, 'Новый текст')
+        self.assertIsNotNone(self.fanfic.archived_at)
+    
+    def test_transition_from_wrong_status(self):
+        """Переход из неподходящего статуса не применяется"""
+        from users.status import transition
+        
+        self.assertFalse(transition(self.fanfic.pk, 'restore_from_trash'))
+        self.assertFalse(transition(self.fanfic.pk, 'move_to_trash', author_id=self.other.pk))
+        self.fanfic.refresh_from_db()
+        self.assertEqual(self.fanfic.status, 'published')
+    
+    def test_views(self):
+        """Повторный переход дает предупреждение, чужой фанфик - 404"""
+        from users.models import Fanfic
+        
+        self.client.force_login(self.author)
+        self.client.get(reverse('move_to_trash', args=[self.fanfic.pk]))
+        self.client.get(reverse('move_to_trash', args=[self.fanfic.pk]))
+        self.assertEqual(Fanfic.objects.get(pk=self.fanfic.pk).status, 'deleted')
+        
+        self.client.force_login(self.other)
+        response = self.client.get(reverse('restore_from_trash', args=[self.fanfic.pk]))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(Fanfic.objects.get(pk=self.fanfic.pk).status, 'deleted')
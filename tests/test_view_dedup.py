@@ -0,0 +1,128 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+BROWSER_UA = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 Chrome/126.0 Safari/537.36'
+
+
+class TestBloomFilter(TestCase):
+    """Тесты фильтра Блума"""
+    
+    def test_membership_and_false_positives(self):
+        """Добавленные ключи всегда находятся, ложных срабатываний мало"""
+        from fanfiction.bloom import BloomFilter
+        
+        bloom = BloomFilter()
+        for i in range(100):
+            self.assertTrue(bloom.add(str(i)))
+        self.assertFalse(bloom.add('42'))
+        self.assertTrue(all(str(i) in bloom for i in range(100)))
+        
+        false_positives = sum(str(i) in bloom for i in range(1000, 11000))
+        self.assertLess(false_positives, 50)
+    
+    def test_rotation_forgets_after_two_windows(self):
+        """Ключ помнится не меньше окна и забывается после двух"""
+        from fanfiction.bloom import RotatingBloomFilter
+        
+        seen = RotatingBloomFilter(window=100, started_at=1000)
+        self.assertTrue(seen.add('7', now=1050))
+        self.assertFalse(seen.add('7', now=1120))
+        self.assertIn('7', seen)
+        
+        seen.rotate(now=1300)
+        self.assertNotIn('7', seen)
+        self.assertTrue(seen.add('7', now=1300))
+    
+    def test_dumps_loads(self):
+        """Сериализация компактна, испорченное значение не загружается"""
+        from fanfiction.bloom import RotatingBloomFilter
+        
+        seen = RotatingBloomFilter(window=100)
+        for i in range(10):
+            seen.add(str(i))
+        value = seen.dumps()
+        
+        restored = RotatingBloomFilter.loads(value, window=100)
+        self.assertEqual(restored.started_at, seen.started_at)
+        self.assertTrue(all(str(i) in restored for i in range(10)))
+        self.assertLess(len(value), 300)
+        self.assertIsNone(RotatingBloomFilter.loads('не фильтр', window=100))
+        self.assertIsNone(RotatingBloomFilter.loads(value, window=100, size=1024))
+
+
+class TestViewDedup(TestCase):
+    """Тесты отсева повторных просмотров в beacon"""
+    
+    def setUp(self):
+        from django.core.cache import cache
+        from users.models import Fanfic
+        from users.view_tracking import ingestor
+        
+        cache.clear()
+        ingestor.flush()
+        User = get_user_model()
+        self.author = User.objects.create_user(username='author', password='authorpass')
+        self.fanfic = Fanfic.objects.create(title='Первый', content='Текст', author=self.author, status='published')
+        self.other = Fanfic.objects.create(title='Второй', content='Текст', author=self.author, status='published')
+    
+    def test_repeat_views_do_not_reach_buffer(self):
+        """Обновления страницы не попадают в буфер, другой фанфик засчитывается"""
+        from users.view_dedup import COOKIE_NAME
+        from users.view_tracking import ingestor
+        
+        url = reverse('fanfic_view_beacon', args=[self.fanfic.pk])
+        response = self.client.post(url, HTTP_USER_AGENT=BROWSER_UA)
+        self.assertIn(COOKIE_NAME, response.cookies)
+        self.assertTrue(response.cookies[COOKIE_NAME]['httponly'])
+        
+        for _ in range(5):
+            response = self.client.post(url, HTTP_USER_AGENT=BROWSER_UA)
+            self.assertEqual(response.status_code, 204)
+        self.assertEqual(ingestor.pending(), 1)
+        
+        self.client.post(reverse('fanfic_view_beacon', args=[self.other.pk]), HTTP_USER_AGENT=BROWSER_UA)
+        self.assertEqual(ingestor.pending(), 2)
+        
+        ingestor.flush()
+        self.fanfic.refresh_from_db()
+        self.assertEqual(self.fanfic.views_count, 1)
+    
+    def test_clients_without_cookies_use_cache(self):
+        """Клиент, не хранящий cookie, отсеивается по отпечатку"""
+        from django.test import Client
+        from users.view_tracking import ingestor
+        
+        url = reverse('fanfic_view_beacon', args=[self.fanfic.pk])
+        for _ in range(3):
+            Client().post(url, HTTP_USER_AGENT=BROWSER_UA, REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(ingestor.pending(), 1)
+        
+        # Другой посетитель засчитывается
+        Client().post(url, HTTP_USER_AGENT=BROWSER_UA, REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(ingestor.pending(), 2)
+    
+    def test_forged_cookie_is_ignored(self):
+        """Неподписанная cookie не принимается"""
+        from fanfiction.bloom import RotatingBloomFilter
+        from users.view_dedup import COOKIE_NAME
+        from users.view_tracking import ingestor
+        
+        seen = RotatingBloomFilter(window=1800)
+        seen.add(str(self.fanfic.pk))
+        self.client.cookies[COOKIE_NAME] = seen.dumps()
+        
+        self.client.post(reverse('fanfic_view_beacon', args=[self.fanfic.pk]), HTTP_USER_AGENT=BROWSER_UA)
+        self.assertEqual(ingestor.pending(), 1)
+    
+    @override_settings(VIEW_DEDUP_WINDOW=0)
+    def test_disabled(self):
+        """При нулевом окне засчитывается каждый просмотр"""
+        from users.view_dedup import COOKIE_NAME
+        from users.view_tracking import ingestor
+        
+        url = reverse('fanfic_view_beacon', args=[self.fanfic.pk])
+        for _ in range(3):
+            response = self.client.post(url, HTTP_USER_AGENT=BROWSER_UA)
+        self.assertEqual(ingestor.pending(), 3)
+        self.assertNotIn(COOKIE_NAME, response.cookies)
@@ -0,0 +1,200 @@
+import pytest
+from django.test import TestCase, RequestFactory
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+
+BROWSER_UA = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 Chrome/126.0 Safari/537.36'
+
+
+class TestCountableRequest(TestCase):
+    """Тесты фильтрации роботов и prefetch-запросов"""
+    
+    def setUp(self):
+        self.factory = RequestFactory()
+    
+    def test_browser_is_countable(self):
+        """Обычный браузер засчитывается"""
+        from users.view_tracking import is_countable_request
+        
+        request = self.factory.post('/', HTTP_USER_AGENT=BROWSER_UA)
+        self.assertTrue(is_countable_request(request))
+    
+    def test_bots_are_not_countable(self):
+        """Роботы и пустой User-Agent не засчитываются"""
+        from users.view_tracking import is_countable_request
+        
+        for user_agent in ['Googlebot/2.1', 'curl/8.0', 'python-requests/2.31', '']:
+            request = self.factory.post('/', HTTP_USER_AGENT=user_agent)
+            self.assertFalse(is_countable_request(request), user_agent)
+    
+    def test_prefetch_is_not_countable(self):
+        """Prefetch-запросы не засчитываются"""
+        from users.view_tracking import is_countable_request
+        
+        request = self.factory.post('/', HTTP_USER_AGENT=BROWSER_UA, HTTP_SEC_PURPOSE='prefetch;prerender')
+        self.assertFalse(is_countable_request(request))
+
+
+class TestViewIngestor(TestCase):
+    """Тесты пакетного учета просмотров"""
+    
+    def setUp(self):
+        from django.core.cache import cache
+        from users.models import Fanfic
+        
+        # Фильтры повторных просмотров посетителей без cookie живут в кэше
+        cache.clear()
+        User = get_user_model()
+        self.author = User.objects.create_user(username='author', password='authorpass')
+        self.reader = User.objects.create_user(username='reader', password='readerpass')
+        self.fanfic = Fanfic.objects.create(
+            title='Опубликованный', content='Текст', author=self.author, status='published'
+        )
+        self.draft = Fanfic.objects.create(
+            title='Черновик', content='Текст', author=self.author, status='draft'
+        )
+    
+    def test_flush_applies_batched_counts(self):
+        """Несколько просмотров записываются одним сбросом"""
+        from users.models import ViewHistory
+        from users.view_tracking import ViewIngestor
+        
+        ingestor = ViewIngestor(flush_interval=60, max_pending=1000)
+        ingestor.record(self.fanfic.pk)
+        ingestor.record(self.fanfic.pk)
+        ingestor.record(self.fanfic.pk, self.reader.pk)
+        
+        self.fanfic.refresh_from_db()
+        self.assertEqual(self.fanfic.views_count, 0)
+        
+        self.assertEqual(ingestor.flush(), 3)
+        self.fanfic.refresh_from_db()
+        self.assertEqual(self.fanfic.views_count, 3)
+        self.assertIsNotNone(self.fanfic.last_viewed_at)
+        self.assertTrue(ViewHistory.objects.filter(user=self.reader, fanfic=self.fanfic).exists())
+    
+    def test_history_touches_coalesce(self):
+        """Повторные просмотры в пределах окна дают одну отметку, сброс - upsert"""
+        from users.models import ViewHistory
+        from users.view_tracking import ViewIngestor
+        
+        ViewHistory.objects.create(user=self.reader, fanfic=self.fanfic)
+        old_viewed_at = ViewHistory.objects.get().viewed_at
+        
+        ingestor = ViewIngestor(flush_interval=60, max_pending=1000, touch_window=60)
+        for _ in range(5):
+            ingestor.record(self.fanfic.pk, self.reader.pk)
+        ingestor.touch(self.reader.pk, self.fanfic.pk)
+        self.assertEqual(len(ingestor._history), 1)
+        
+        self.assertEqual(ingestor.flush(), 5)
+        self.assertEqual(ViewHistory.objects.count(), 1)
+        self.assertGreaterEqual(ViewHistory.objects.get().viewed_at, old_viewed_at)
+        
+        # Окно еще не прошло - новая отметка не нужна
+        ingestor.touch(self.reader.pk, self.fanfic.pk)
+        self.assertEqual(len(ingestor._history), 0)
+    
+    def test_touch_skips_unpublished(self):
+        """История не пишется для неопубликованных фанфиков"""
+        from users.models import ViewHistory
+        from users.view_tracking import ViewIngestor
+        
+        ingestor = ViewIngestor(flush_interval=60, max_pending=1000)
+        ingestor.touch(self.reader.pk, self.draft.pk)
+        ingestor.touch(self.reader.pk, 999999)
+        ingestor.flush()
+        
+        self.assertFalse(ViewHistory.objects.exists())
+    
+    def test_flush_skips_unpublished(self):
+        """Просмотры неопубликованных и несуществующих фанфиков отбрасываются"""
+        from users.view_tracking import ViewIngestor
+        
+        ingestor = ViewIngestor(flush_interval=60, max_pending=1000)
+        ingestor.record(self.draft.pk, self.reader.pk)
+        ingestor.record(999999)
+        
+        self.assertEqual(ingestor.flush(), 0)
+        self.draft.refresh_from_db()
+        self.assertEqual(self.draft.views_count, 0)
+    
+    def test_failed_flush_keeps_views(self):
+        """Если запись не удалась, просмотры остаются в буфере до следующего сброса"""
+        from unittest import mock
+        from users.models import ViewBucket, ViewHistory
+        from users.view_tracking import ViewIngestor
+        
+        ingestor = ViewIngestor(flush_interval=60, max_pending=1000)
+        ingestor.record(self.fanfic.pk, self.reader.pk)
+        ingestor.record(self.fanfic.pk)
+        
+        with mock.patch('users.view_tracking._write_counts', side_effect=RuntimeError('база занята')):
+            with self.assertLogs('users.view_tracking', 'ERROR'):
+                self.assertEqual(ingestor.flush(), 0)
+        self.assertEqual(ingestor.pending(), 2)
+        
+        with mock.patch('users.view_tracking._write_buckets', side_effect=RuntimeError('база занята')):
+            with self.assertLogs('users.view_tracking', 'ERROR'):
+                self.assertEqual(ingestor.flush(), 2)
+        self.assertFalse(ViewBucket.objects.exists())
+        
+        # Повтор дописывает только корзины - счетчик не удваивается
+        ingestor.flush()
+        self.fanfic.refresh_from_db()
+        self.assertEqual(self.fanfic.views_count, 2)
+        self.assertEqual(ViewBucket.objects.get().views, 2)
+        self.assertTrue(ViewHistory.objects.filter(user=self.reader, fanfic=self.fanfic).exists())
+    
+    def test_beacon_records_view(self):
+        """Beacon кладет просмотр в буфер и отвечает 204"""
+        from users.view_tracking import ingestor
+        
+        ingestor.flush()
+        url = reverse('fanfic_view_beacon', args=[self.fanfic.pk])
+        
+        response = self.client.post(url, HTTP_USER_AGENT=BROWSER_UA)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(ingestor.pending(), 1)
+        
+        response = self.client.post(url, HTTP_USER_AGENT='Googlebot/2.1')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(ingestor.pending(), 1)
+        
+        ingestor.flush()
+        self.fanfic.refresh_from_db()
+        self.assertEqual(self.fanfic.views_count, 1)
+    
+    def test_beacon_rejects_other_sites(self):
+        """Beacon со страницы чужого сайта не засчитывается"""
+        from users.view_tracking import ingestor
+        
+        ingestor.flush()
+        url = reverse('fanfic_view_beacon', args=[self.fanfic.pk])
+        
+        response = self.client.post(url, HTTP_USER_AGENT=BROWSER_UA, HTTP_SEC_FETCH_SITE='cross-site')
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post(url, HTTP_USER_AGENT=BROWSER_UA, HTTP_ORIGIN='https://evil.example')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(ingestor.pending(), 0)
+        
+        response = self.client.post(
+            url, HTTP_USER_AGENT=BROWSER_UA, HTTP_SEC_FETCH_SITE='same-origin', HTTP_ORIGIN='http://testserver',
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(ingestor.pending(), 1)
+        ingestor.flush()
+    
+    def test_detail_page_does_not_write(self):
+        """Детальная страница не увеличивает счетчик и поддерживает условный GET"""
+        url = reverse('fanfic_detail', args=[self.fanfic.pk])
+        
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('ETag', response)
+        
+        self.fanfic.refresh_from_db()
+        self.assertEqual(self.fanfic.views_count, 0)
+        
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
@@ -0,0 +1,91 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+
+class TestViewerState(TestCase):
+    """Тесты пакетной загрузки закладок и лайков для списков"""
+    
+    def setUp(self):
+        from users.models import Fanfic
+        from users.reactions import set_bookmark
+        
+        cache.clear()
+        User = get_user_model()
+        self.author = User.objects.create_user(username='author', password='authorpass')
+        self.reader = User.objects.create_user(username='reader', password='readerpass')
+        self.fanfics = [
+            Fanfic.objects.create(title=f'Фанфик {i}', content='Текст', author=self.author, status='published')
+            for i in range(6)
+        ]
+        for fanfic in self.fanfics[:2]:
+            set_bookmark(self.reader.pk, fanfic.pk)
+    
+    def test_annotate_single_query(self):
+        """Отметки для всей страницы загружаются одним запросом"""
+        from users.viewer_state import ViewerState
+        
+        state = ViewerState(self.reader)
+        with self.assertNumQueries(1):
+            fanfics = state.annotate_fanfics(self.fanfics)
+        
+        self.assertEqual([fanfic.is_bookmarked for fanfic in fanfics], [True, True, False, False, False, False])
+        
+        # Повторные id берутся из памяти запроса
+        with self.assertNumQueries(0):
+            state.annotate_fanfics(self.fanfics[:3])
+    
+    def test_anonymous_no_queries(self):
+        """Анонимному пользователю запросы не нужны"""
+        from django.contrib.auth.models import AnonymousUser
+        from users.viewer_state import ViewerState
+        
+        with self.assertNumQueries(0):
+            fanfics = ViewerState(AnonymousUser()).annotate_fanfics(self.fanfics)
+        self.assertFalse(any(fanfic.is_bookmarked for fanfic in fanfics))
+    
+    def test_listing_page_marks_bookmarks(self):
+        """Страница новинок отмечает фанфики из закладок"""
+        self.client.force_login(self.reader)
+        response = self.client.get(reverse('new_fanfics'))
+        
+        marked = {fanfic.pk for fanfic in response.context['new_fanfics'] if fanfic.is_bookmarked}
+        self.assertEqual(marked, {fanfic.pk for fanfic in self.fanfics[:2]})
+        self.assertContains(response, 'в закладках', count=2)
+    
+    @override_settings(VIEWER_BOOKMARKS_CACHE_MIN=2)
+    def test_heavy_user_cache_invalidated(self):
+        """Набор закладок берется из кэша и сбрасывается при изменении"""
+        from users.reactions import set_bookmark
+        from users.viewer_state import ViewerState
+        
+        self.reader.refresh_from_db()
+        ViewerState(self.reader).annotate_fanfics(self.fanfics)
+        
+        with self.assertNumQueries(0):
+            fanfics = ViewerState(self.reader).annotate_fanfics(self.fanfics)
+        self.assertEqual(sum(fanfic.is_bookmarked for fanfic in fanfics), 2)
+        
+        set_bookmark(self.reader.pk, self.fanfics[2].pk)
+        self.reader.refresh_from_db()
+        fanfics = ViewerState(self.reader).annotate_fanfics(self.fanfics)
+        self.assertEqual(sum(fanfic.is_bookmarked for fanfic in fanfics), 3)
+    
+    def test_comments_json_is_liked(self):
+        """JSON комментариев отмечает лайки пользователя во всей ветке"""
+        from users.models import Comment
+        from users.reactions import set_comment_like
+        
+        fanfic = self.fanfics[0]
+        root = Comment.objects.create(fanfic=fanfic, author=self.author, content='Корень')
+        reply = Comment.objects.create(fanfic=fanfic, author=self.author, content='Ответ', parent=root)
+        set_comment_like(self.reader.pk, reply.pk)
+        
+        self.client.force_login(self.reader)
+        data = self.client.get(reverse('get_comments_json', args=[fanfic.pk])).json()
+        
+        root_data = data['comments'][0]
+        self.assertFalse(root_data['is_liked'])
+        self.assertTrue(root_data['replies'][0]['is_liked'])
+        self.assertEqual(root_data['replies'][0]['likes_count'], 1)
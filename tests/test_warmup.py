@@ -0,0 +1,94 @@
+import threading
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+
+
+@override_settings(WARMUP_TAGS=1)
+class TestWarmup(TestCase):
+    """Тесты прогрева кэшей при старте процесса"""
+    
+    def setUp(self):
+        from users import warmup
+        from users.leaderboards import current_hour
+        from users.models import Fanfic, ViewBucket
+        
+        # Готовность процесса - общее состояние модуля, у теста своя
+        for name, value in (('_ready', threading.Event()), ('_state', dict(warmup._state))):
+            patcher = mock.patch.object(warmup, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        
+        User = get_user_model()
+        self.author = User.objects.create_user(username='author', password='authorpass')
+        self.drama = Fanfic.objects.create(
+            title='Драма', content='Текст', author=self.author, status='published', tags='Драма', views_count=1,
+        )
+        self.humor = Fanfic.objects.create(
+            title='Юмор', content='Текст', author=self.author, status='published', tags='юмор', views_count=100,
+        )
+        hour = current_hour()
+        ViewBucket.objects.create(fanfic=self.drama, hour=hour, views=30, updated_at=hour)
+        ViewBucket.objects.create(fanfic=self.humor, hour=hour - timedelta(hours=2), views=10, updated_at=hour)
+        ViewBucket.objects.create(fanfic=self.humor, hour=hour - timedelta(days=3), views=500, updated_at=hour)
+    
+    def test_most_read_from_recent_views(self):
+        """Читаемые берутся из просмотров за окно, без них - по общему счетчику"""
+        from users.models import ViewBucket
+        from users.warmup import most_read_fanfics
+        
+        self.assertEqual(most_read_fanfics(hours=24, limit=10), [self.drama.pk, self.humor.pk])
+        self.assertEqual(most_read_fanfics(hours=1, limit=10), [self.drama.pk])
+        ViewBucket.objects.all().delete()
+        self.assertEqual(most_read_fanfics(hours=24, limit=1), [self.humor.pk])
+    
+    def test_caches_warmed(self):
+        """После прогрева фанфики, авторы и страница тега читаются без запросов"""
+        from users.cards import card_page
+        from users.object_cache import fanfic_cache, user_cache
+        from users.views import _paginate, _tag_fanfics
+        from users.warmup import warm_up
+        
+        status = warm_up()
+        self.assertTrue(status['ready'])
+        self.assertEqual(status['state'], 'ready')
+        self.assertEqual((status['fanfics'], status['users'], status['tags']), (2, 1, ['драма']))
+        
+        with self.assertNumQueries(0):
+            fanfic_cache.get_cached(self.humor.pk)
+            user_cache.get_cached(self.author.pk)
+            page = card_page(_paginate(_tag_fanfics('драма'), 1, 12))
+        self.assertEqual([card.pk for card in page], [self.drama.pk])
+    
+    def test_readiness_endpoint(self):
+        """Пока прогрев не закончился, процесс не готов"""
+        from django.urls import reverse
+        from users.warmup import warm_up
+        
+        response = self.client.get(reverse('readiness'))
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(response.json()['ready'])
+        
+        warm_up()
+        response = self.client.get(reverse('readiness'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['state'], 'ready')
+    
+    def test_failure_still_ready(self):
+        """Ошибка прогрева не держит процесс закрытым"""
+        from users import warmup
+        
+        with mock.patch.object(warmup, 'most_read_fanfics', side_effect=RuntimeError('база недоступна')):
+            with self.assertLogs('users.warmup', 'ERROR'):
+                status = warmup.warm_up()
+        self.assertTrue(status['ready'])
+        self.assertEqual(status['state'], 'failed')
+    
+    def test_start_skipped_for_memory_database(self):
+        """Без прогрева (тестовая база в памяти) процесс сразу готов"""
+        from users.warmup import is_ready, start_in_process_warmup
+        
+        self.assertFalse(start_in_process_warmup())
+        self.assertTrue(is_ready())
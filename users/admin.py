@@ -1,5 +1,6 @@
 from django.contrib import admin
 from .models import CustomUser, Fanfic
+from .deletion import delete_fanfics, delete_user
 from django.utils import timezone
 
 @admin.register(Fanfic)
@@ -59,20 +60,35 @@ class FanficAdmin(admin.ModelAdmin):
     
     def purge_selected(self, request, queryset):
         """Действие для удаления выбранных фанфиков"""
-        deleted_count = 0
-        for fanfic in queryset:
-            if fanfic.status == 'deleted' and fanfic.should_be_purged:
-                fanfic.delete()
-                deleted_count += 1
+        purge_ids = [
+            fanfic.pk for fanfic in queryset
+            if fanfic.status == 'deleted' and fanfic.should_be_purged
+        ]
+        deleted_count = delete_fanfics(purge_ids).get('fanfics', 0)
         
         if deleted_count:
             self.message_user(request, f"Удалено {deleted_count} фанфиков")
         else:
             self.message_user(request, "Нет фанфиков для удаления")
     purge_selected.short_description = "Удалить выбранные (если срок истек)"
+    
+    # Удаление из админки - пачками, без загрузки всех зависимых строк
+    def delete_model(self, request, obj):
+        delete_fanfics([obj.pk])
+    
+    def delete_queryset(self, request, queryset):
+        delete_fanfics(list(queryset.values_list('pk', flat=True)))
 
 @admin.register(CustomUser)
 class CustomUserAdmin(admin.ModelAdmin):
     list_display = ('username', 'email', 'nickname', 'country', 'date_joined')
     list_filter = ('country', 'date_joined')
-    search_fields = ('username', 'email', 'nickname')
\ No newline at end of file
+    search_fields = ('username', 'email', 'nickname')
+    
+    # Удаление аккаунта - пачками, снизу вверх (см. users/deletion.py)
+    def delete_model(self, request, obj):
+        delete_user(obj.pk)
+    
+    def delete_queryset(self, request, queryset):
+        for user_id in list(queryset.values_list('pk', flat=True)):
+            delete_user(user_id)
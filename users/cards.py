@@ -0,0 +1,121 @@
+"""
+Легкие карточки фанфиков для списков.
+
+Списки (главная, популярное, новинки, теги, поиск) раньше строили полные
+объекты Fanfic: с текстом главы, ленивой загрузкой автора и разбором
+тегов в каждом шаблоне. Здесь queryset превращается в values() только с
+нужными карточке колонками, а строки - в объекты FanficCard со __slots__:
+
+    fanfics = fanfic_cards(Fanfic.objects.filter(status='published')[:10])
+    page = card_page(paginator.page(number))
+
+Описание обрезается еще в SQL (DESCRIPTION_LENGTH символов), теги
+разбираются один раз, уровень популярности вычисляется при создании
+карточки, число комментариев приходит тем же запросом.
+"""
+
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Substr
+
+from .models import (
+    POPULARITY_BADGE_CLASSES, POPULARITY_TEXTS, Comment, parse_tags, popularity_level,
+)
+
+# Сколько символов описания нужно карточке (шаблоны обрезают еще короче)
+DESCRIPTION_LENGTH = 300
+
+CARD_FIELDS = (
+    'id', 'title', 'tags', 'views_count', 'bookmarks_count', 'created_at', 'updated_at',
+    'author__username', 'author__nickname',
+)
+
+
+class CardAuthor:
+    """Автор карточки: только имя"""
+
+    __slots__ = ('username', 'nickname')
+
+    def __init__(self, username, nickname):
+        self.username = username
+        self.nickname = nickname
+
+    @property
+    def display_name(self):
+        return self.nickname or self.username
+
+    def __str__(self):
+        return self.username
+
+
+class FanficCard:
+    """Фанфик в списке: только то, что показывает карточка"""
+
+    __slots__ = (
+        'pk', 'title', 'description', 'author', 'tags_list', 'views_count',
+        'bookmarks_count', 'comments_count', 'created_at', 'updated_at', 'popularity',
+        'is_bookmarked', 'period_views',
+    )
+
+    def __init__(self, row):
+        self.pk = row['id']
+        self.title = row['title']
+        description = row['short_description'] or ''
+        if len(description) > DESCRIPTION_LENGTH:
+            description = description[:DESCRIPTION_LENGTH].rstrip() + '…'
+        self.description = description
+        self.author = CardAuthor(row['author__username'], row['author__nickname'])
+        self.tags_list = parse_tags(row['tags'])
+        self.views_count = row['views_count']
+        self.bookmarks_count = row['bookmarks_count']
+        self.comments_count = row['comments_count']
+        self.created_at = row['created_at']
+        # Ключ кэша фрагментов карточки (users/templatetags/fragments.py)
+        self.updated_at = row['updated_at']
+        self.popularity = popularity_level(self.views_count)
+        self.is_bookmarked = False
+        # Просмотры за период рейтинга (заполняет users/leaderboards.py)
+        self.period_views = None
+
+    @property
+    def id(self):
+        return self.pk
+
+    @property
+    def popularity_badge_class(self):
+        return POPULARITY_BADGE_CLASSES.get(self.popularity, '')
+
+    @property
+    def popularity_text(self):
+        return POPULARITY_TEXTS.get(self.popularity, '')
+
+    def __repr__(self):
+        return f'<FanficCard {self.pk}: {self.title}>'
+
+
+def _comments_count():
+    return Coalesce(Subquery(
+        Comment.objects.filter(fanfic_id=OuterRef('pk'), is_deleted=False).order_by().values(
+            'fanfic_id'
+        ).annotate(total=Count('id')).values('total')
+    ), Value(0))
+
+
+def card_values(queryset):
+    """queryset фанфиков -> values() с колонками карточки (порядок и срез сохраняются)"""
+    return queryset.values(
+        *CARD_FIELDS,
+        # Один лишний символ - чтобы знать, что описание обрезано
+        short_description=Substr('description', 1, DESCRIPTION_LENGTH + 1),
+        comments_count=_comments_count(),
+    )
+
+
+def fanfic_cards(queryset):
+    """Список карточек для queryset фанфиков"""
+    return [FanficCard(row) for row in card_values(queryset)]
+
+
+def card_page(page):
+    """Заменяет фанфики страницы пагинатора карточками"""
+    page.object_list = fanfic_cards(page.object_list)
+    return page
@@ -0,0 +1,204 @@
+"""
+Удаление большого числа строк короткими пачками.
+
+Обычный QuerySet.delete() удаляет все одной транзакцией и держит
+блокировку записи SQLite, пока не закончит. Здесь строки удаляются
+пачками по id: каждая пачка - отдельный DELETE по первичному ключу в
+своей короткой транзакции через поток-писатель, так что между пачками
+успевают пройти записи других запросов.
+
+Фанфики и пользователи удаляются снизу вверх: сначала лайки
+комментариев, потом комментарии (ответы раньше родителей), закладки,
+история, корзины просмотров и скетчи читателей, и только потом сами строки.
+Каждый шаг - DELETE по списку id, без загрузки объектов в сборщик Django.
+Счетчики закладок и лайков оставшихся строк после этого пересчитываются.
+"""
+
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import router
+from django.db.models import Count
+from django.utils import timezone
+
+from fanfiction import writer
+from fanfiction.page_cache import bump_version
+from fanfiction.single_flight import bump_generation
+
+from .reactions import recount_bookmarks, recount_comment_likes
+from .status import FANFICS_GENERATION
+from .viewer_state import forget_bookmarks
+
+BATCH_SIZE = 500
+
+
+def _delete_ids(model, ids, using):
+    # Зависимые строки к этому моменту уже удалены - сборщик не нужен
+    return model._base_manager.using(using).filter(pk__in=ids)._raw_delete(using)
+
+
+def delete_in_batches(queryset, batch_size=BATCH_SIZE, progress=None):
+    """Удаляет строки queryset пачками; возвращает число удаленных строк
+
+    Каскады и сигналы удаления не выполняются: зависимые строки нужно
+    удалить раньше. Пачки берутся в порядке сортировки queryset.
+    progress(total) вызывается после каждой пачки.
+    """
+    model = queryset.model
+    using = router.db_for_write(model)
+    total = 0
+    while True:
+        ids = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            break
+        total += writer.submit(_delete_ids, model, ids, using, using=using).result(timeout=writer.WRITE_TIMEOUT)
+        if progress is not None:
+            progress(total)
+        if len(ids) < batch_size:
+            break
+    return total
+
+
+def _chunks(ids, size):
+    ids = list(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def _run_steps(steps, result, batch_size, progress):
+    for label, queryset in steps:
+        before = result[label]
+        report = None
+        if progress is not None:
+            report = lambda total, label=label, before=before: progress(label, before + total)
+        result[label] += delete_in_batches(queryset, batch_size, report)
+
+
+def _comment_subtree_ids(root_ids):
+    """id комментариев вместе со всеми ответами на них"""
+    from .models import Comment
+
+    found = set(root_ids)
+    frontier = list(found)
+    while frontier:
+        children = set()
+        for chunk in _chunks(frontier, BATCH_SIZE):
+            children.update(Comment.objects.filter(parent_id__in=chunk).values_list('pk', flat=True))
+        frontier = list(children - found)
+        found.update(frontier)
+    return found
+
+
+def _delete_comments(comment_ids, result, batch_size, progress):
+    from .models import Comment, CommentLike
+
+    # Ответ создается позже родителя: по убыванию id ответы уходят первыми
+    for chunk in _chunks(sorted(comment_ids, reverse=True), batch_size):
+        _run_steps([
+            ('comment_likes', CommentLike.objects.filter(comment_id__in=chunk).order_by()),
+            ('comments', Comment.objects.filter(pk__in=chunk).order_by('-pk')),
+        ], result, batch_size, progress)
+
+
+def delete_fanfics(fanfic_ids, batch_size=BATCH_SIZE, progress=None):
+    """Удаляет фанфики со всеми зависимыми строками
+
+    Возвращает словарь: сколько строк удалено в каждой таблице.
+    progress(label, total) вызывается после каждой пачки.
+    """
+    from .models import Bookmark, Comment, Fanfic, ReaderSketch, ViewBucket, ViewHistory
+    from .object_cache import fanfic_cache
+
+    result = Counter()
+    for chunk in _chunks(fanfic_ids, batch_size):
+        comment_ids = Comment.objects.filter(fanfic_id__in=chunk).values_list('pk', flat=True)
+        _delete_comments(comment_ids, result, batch_size, progress)
+        bookmarked_by = set(Bookmark.objects.filter(fanfic_id__in=chunk).values_list('user_id', flat=True))
+        _run_steps([
+            ('bookmarks', Bookmark.objects.filter(fanfic_id__in=chunk).order_by()),
+            ('view_history', ViewHistory.objects.filter(fanfic_id__in=chunk).order_by()),
+            ('view_buckets', ViewBucket.objects.filter(fanfic_id__in=chunk).order_by()),
+            ('reader_sketches', ReaderSketch.objects.filter(fanfic_id__in=chunk).order_by()),
+            ('fanfics', Fanfic.objects.filter(pk__in=chunk).order_by()),
+        ], result, batch_size, progress)
+        fanfic_cache.invalidate(*chunk)
+        recount_bookmarks(user_ids=bookmarked_by)
+    if result['fanfics']:
+        # Удаление по id идет без сигналов - сбрасываем кэш страниц сами
+        bump_version()
+        bump_generation(FANFICS_GENERATION)
+    return dict(result)
+
+
+def delete_user(user_id, batch_size=BATCH_SIZE, progress=None):
+    """Удаляет аккаунт: фанфики, комментарии, лайки, закладки, историю и пользователя"""
+    from .models import Bookmark, Comment, CommentLike, CustomUser, Fanfic, ViewHistory
+
+    fanfic_ids = list(Fanfic.objects.filter(author_id=user_id).values_list('pk', flat=True))
+    result = Counter(delete_fanfics(fanfic_ids, batch_size, progress))
+
+    # Комментарии пользователя к чужим фанфикам вместе с ответами на них
+    own_comments = Comment.objects.filter(author_id=user_id).values_list('pk', flat=True)
+    _delete_comments(_comment_subtree_ids(own_comments), result, batch_size, progress)
+
+    liked_comments = set(CommentLike.objects.filter(user_id=user_id).values_list('comment_id', flat=True))
+    bookmarked_fanfics = set(Bookmark.objects.filter(user_id=user_id).values_list('fanfic_id', flat=True))
+    _run_steps([
+        ('comment_likes', CommentLike.objects.filter(user_id=user_id).order_by()),
+        ('bookmarks', Bookmark.objects.filter(user_id=user_id).order_by()),
+        ('view_history', ViewHistory.objects.filter(user_id=user_id).order_by()),
+    ], result, batch_size, progress)
+
+    recount_comment_likes(liked_comments)
+    recount_bookmarks(fanfic_ids=bookmarked_fanfics)
+    forget_bookmarks(user_id)
+
+    # Остались только мелкие связи (группы, права, журнал админки) -
+    # их удалит обычный каскад Django
+    deleted, _ = writer.submit(
+        CustomUser.objects.filter(pk=user_id).delete
+    ).result(timeout=writer.WRITE_TIMEOUT)
+    result['users'] += int(deleted > 0)
+    if progress is not None:
+        progress('users', result['users'])
+    return dict(result)
+
+
+def prune_view_history(max_per_user=None, max_age_days=None, batch_size=BATCH_SIZE):
+    """Применяет политику хранения истории просмотров
+
+    Удаляет записи старше max_age_days дней и все, кроме max_per_user
+    последних записей, у каждого пользователя. Возвращает число удаленных
+    записей по каждому правилу.
+    """
+    from .models import ViewHistory
+
+    if max_per_user is None:
+        max_per_user = getattr(settings, 'VIEW_HISTORY_MAX_PER_USER', 200)
+    if max_age_days is None:
+        max_age_days = getattr(settings, 'VIEW_HISTORY_MAX_AGE_DAYS', 365)
+
+    result = {'expired': 0, 'over_limit': 0}
+
+    if max_age_days:
+        cutoff = timezone.now() - timedelta(days=max_age_days)
+        result['expired'] = delete_in_batches(
+            ViewHistory.objects.filter(viewed_at__lt=cutoff).order_by(), batch_size
+        )
+
+    if max_per_user:
+        over_limit_users = ViewHistory.objects.order_by().values('user_id').annotate(
+            total=Count('id')
+        ).filter(total__gt=max_per_user).values_list('user_id', flat=True)
+
+        for user_id in list(over_limit_users):
+            # По индексу (user, -viewed_at): время последней из хранимых записей
+            cutoff = ViewHistory.objects.filter(user_id=user_id).order_by(
+                '-viewed_at'
+            ).values_list('viewed_at', flat=True)[max_per_user - 1]
+            result['over_limit'] += delete_in_batches(
+                ViewHistory.objects.filter(user_id=user_id, viewed_at__lt=cutoff).order_by(), batch_size
+            )
+
+    return result
@@ -0,0 +1,352 @@
+"""
+Горячие списки в общей для процессов памяти.
+
+Каждый воркер держал свои копии рейтингов популярного (общего и по
+тегам) и новинок и сам их пересчитывал: N воркеров - N пересчетов и N
+копий. Теперь один процесс (команда refresh_hotlists) пишет их в файл
+HOTLISTS_PATH, а воркеры отображают его в память (mmap) и читают без
+копирования - страницы файла общие для всех процессов через кэш ОС:
+
+    cards, stats = board(tag='драма', window='7d', limit=5)
+    cards = hot_cards('new', limit=10)
+
+Оба вызова возвращают None, если сегмента нет, он поврежден или старше
+HOTLISTS_MAX_AGE секунд (обновляющий процесс остановился), - тогда
+вызывающий код считает список сам. Снятые с публикации и удаленные
+после записи сегмента фанфики пропускаются: id списка проверяются одним
+запросом по статусу (через кэш запросов - до следующей записи в таблицу
+фанфиков он не повторяется).
+
+Формат сегмента (числа little-endian):
+  заголовок    - сигнатура, версия формата, поколение, время записи,
+                 число карточек, смещения строк и каталога;
+  карточки     - записи фиксированного размера: id, просмотры, закладки,
+                 комментарии, даты и ссылки (смещение, длина) на строки;
+  списки       - массив индексов карточек (int32) и массив просмотров за
+                 период (int64, -1 - нет) для каждого списка;
+  строки       - UTF-8 названия, описания, теги и имена авторов;
+  каталог      - JSON: имя списка -> смещение, длина, итоги рейтинга.
+
+Карточка, попавшая в несколько списков, хранится один раз. Сегмент
+только читается: новый пишется во временный файл и атомарно подменяет
+старый (os.replace). Воркер раз в секунду проверяет файл и
+переотображает его, если он сменился; уже открытое отображение остается
+целым до конца запросов, которые его читают.
+"""
+
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+
+from fanfiction import metrics
+from fanfiction.single_flight import KeyLock
+
+from .cards import FanficCard
+
+MAGIC = b'HOTL'
+FORMAT_VERSION = 1
+
+HEADER = struct.Struct('<4sHHQdIQQI')
+CARD = struct.Struct('<qQIIdd10I')
+# Поля карточки, которые лежат в строках, по порядку
+CARD_STRINGS = ('title', 'short_description', 'tags', 'author__username', 'author__nickname')
+
+# Как часто воркер проверяет, не сменился ли файл сегмента
+CHECK_INTERVAL = 1.0
+
+BoardStats = namedtuple('BoardStats', ['fanfics_count', 'total_views', 'avg_views'])
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'remaps': 0, 'writes': 0}
+
+# Отображенный сегмент этого процесса и когда файл проверялся последним
+_current = {'path': None, 'stamp': None, 'checked_at': 0.0, 'segment': None}
+_current_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def segment_path():
+    return Path(getattr(settings, 'HOTLISTS_PATH', Path(settings.BASE_DIR) / 'cache' / 'hotlists.bin'))
+
+
+def board_name(tag, window):
+    return f'board:{window}:{tag}'
+
+
+def _pad(buffer):
+    buffer.extend(b'\0' * (-len(buffer) % 8))
+
+
+def write_segment(path, lists, generation=None):
+    """Пишет сегмент и атомарно подменяет им старый
+
+    lists - {имя: (карточки, просмотры за период или None, итоги или
+    None)}; итоги - словарь fanfics_count/total_views/avg_views.
+    """
+    path = Path(path)
+    if generation is None:
+        current = Segment.open(path)
+        generation = current.generation + 1 if current is not None else 1
+
+    card_index = {}
+    cards = []
+    for list_cards, _, _ in lists.values():
+        for card in list_cards:
+            if card.pk not in card_index:
+                card_index[card.pk] = len(cards)
+                cards.append(card)
+
+    strings = bytearray()
+    records = bytearray()
+    for card in cards:
+        refs = []
+        values = (card.title, card.description, ', '.join(card.tags_list), card.author.username, card.author.nickname)
+        for value in values:
+            encoded = (value or '').encode()
+            refs.extend((len(strings), len(encoded)))
+            strings.extend(encoded)
+        records.extend(CARD.pack(
+            card.pk, card.views_count, card.bookmarks_count, card.comments_count,
+            card.created_at.timestamp(), card.updated_at.timestamp(), *refs,
+        ))
+
+    body = bytearray(records)
+    _pad(body)
+    directory = {}
+    for name, (list_cards, period_views, stats) in lists.items():
+        offset = HEADER.size + len(body)
+        body.extend(struct.pack(f'<{len(list_cards)}i', *(card_index[card.pk] for card in list_cards)))
+        _pad(body)
+        body.extend(struct.pack(f'<{len(list_cards)}q', *(period_views or [-1] * len(list_cards))))
+        directory[name] = {'offset': offset, 'count': len(list_cards), 'stats': stats}
+
+    strings_offset = HEADER.size + len(body)
+    body.extend(strings)
+    directory_offset = HEADER.size + len(body)
+    directory_bytes = json.dumps(directory, ensure_ascii=False).encode()
+    body.extend(directory_bytes)
+
+    header = HEADER.pack(
+        MAGIC, FORMAT_VERSION, 0, generation, time.time(), len(cards),
+        strings_offset, directory_offset, len(directory_bytes),
+    )
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f'{path.name}.tmp-{os.getpid()}')
+    with open(tmp_path, 'wb') as tmp:
+        tmp.write(header)
+        tmp.write(body)
+    os.replace(tmp_path, path)
+    _count('writes')
+    # Процесс, который сам записал сегмент, видит его сразу
+    with _current_lock:
+        _current['checked_at'] = 0.0
+    return generation
+
+
+class Segment:
+    """Отображенный в память сегмент горячих списков (только чтение)"""
+
+    def __init__(self, buffer):
+        self._buffer = memoryview(buffer)
+        (magic, version, _, self.generation, self.written_at, self.cards_count,
+         self._strings_offset, directory_offset, directory_length) = HEADER.unpack_from(self._buffer)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError('Неизвестный формат сегмента')
+        self.directory = json.loads(bytes(self._buffer[directory_offset:directory_offset + directory_length]))
+        self.size = len(self._buffer)
+
+    @classmethod
+    def open(cls, path):
+        """Сегмент из файла или None, если файла нет или он поврежден"""
+        try:
+            with open(path, 'rb') as file:
+                buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            return cls(buffer)
+        except (OSError, ValueError, struct.error):
+            return None
+
+    def _card(self, index, period_views):
+        fields = CARD.unpack_from(self._buffer, HEADER.size + index * CARD.size)
+        row = {
+            'id': fields[0], 'views_count': fields[1], 'bookmarks_count': fields[2],
+            'comments_count': fields[3],
+            'created_at': datetime.fromtimestamp(fields[4], tz=dt_timezone.utc),
+            'updated_at': datetime.fromtimestamp(fields[5], tz=dt_timezone.utc),
+        }
+        for position, name in enumerate(CARD_STRINGS):
+            offset, length = fields[6 + position * 2], fields[7 + position * 2]
+            start = self._strings_offset + offset
+            row[name] = str(self._buffer[start:start + length], 'utf-8')
+        card = FanficCard(row)
+        card.period_views = period_views if period_views >= 0 else None
+        return card
+
+    def _arrays(self, entry):
+        offset, count = entry['offset'], entry['count']
+        indexes = self._buffer[offset:offset + count * 4].cast('i')
+        views_offset = offset + count * 4 + (-(count * 4) % 8)
+        return indexes, self._buffer[views_offset:views_offset + count * 8].cast('q')
+
+    def ids(self, name):
+        """id фанфиков списка по местам или None, если списка нет"""
+        entry = self.directory.get(name)
+        if entry is None:
+            return None
+        indexes, _ = self._arrays(entry)
+        return [CARD.unpack_from(self._buffer, HEADER.size + index * CARD.size)[0] for index in indexes]
+
+    def cards(self, name, limit=None, only=None):
+        """Карточки списка по местам или None, если списка нет
+
+        only - множество id, которые можно отдавать (остальные пропускаются).
+        """
+        entry = self.directory.get(name)
+        if entry is None:
+            return None
+        indexes, views = self._arrays(entry)
+        cards = []
+        for position, index in enumerate(indexes):
+            if limit is not None and len(cards) >= limit:
+                break
+            if only is not None and CARD.unpack_from(self._buffer, HEADER.size + index * CARD.size)[0] not in only:
+                continue
+            cards.append(self._card(index, views[position]))
+        return cards
+
+    def stats(self, name):
+        entry = self.directory.get(name)
+        return entry and entry['stats']
+
+
+def get_segment():
+    """Текущий сегмент этого процесса или None, если его нет или он устарел"""
+    path = segment_path()
+    now = time.monotonic()
+    with _current_lock:
+        if _current['path'] != path or now - _current['checked_at'] >= CHECK_INTERVAL:
+            try:
+                stat = os.stat(path)
+                stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                stamp = None
+            if _current['path'] != path or stamp != _current['stamp']:
+                _current['segment'] = Segment.open(path) if stamp is not None else None
+                if _current['segment'] is not None:
+                    _count('remaps')
+            _current.update(path=path, stamp=stamp, checked_at=now)
+        segment = _current['segment']
+
+    if segment is None or time.time() - segment.written_at > getattr(settings, 'HOTLISTS_MAX_AGE', 300):
+        return None
+    return segment
+
+
+def _published_cards(segment, name, limit):
+    """Карточки списка без фанфиков, снятых с публикации после записи сегмента"""
+    from .models import Fanfic
+
+    ids = segment.ids(name)
+    if ids is None:
+        return None
+    published = set(Fanfic.objects.filter(
+        pk__in=sorted(ids), status='published'
+    ).order_by().cached().values_list('pk', flat=True))
+    return segment.cards(name, limit, only=published)
+
+
+def hot_cards(name, limit=None):
+    """Карточки горячего списка или None - тогда список считают сами"""
+    segment = get_segment()
+    cards = _published_cards(segment, name, limit) if segment is not None else None
+    _count('hits' if cards is not None else 'misses')
+    return cards
+
+
+def board(tag='', window='all', limit=None):
+    """Рейтинг из сегмента: (карточки по местам, BoardStats) или None"""
+    segment = get_segment()
+    name = board_name(tag, window)
+    cards = _published_cards(segment, name, limit) if segment is not None else None
+    _count('hits' if cards is not None else 'misses')
+    if cards is None:
+        return None
+    return cards, BoardStats(**segment.stats(name))
+
+
+def build_hotlists():
+    """Списки для сегмента: все снимки рейтингов и новинки"""
+    from .cards import fanfic_cards
+    from .models import Fanfic, LeaderboardEntry, LeaderboardStats
+
+    size = getattr(settings, 'LEADERBOARD_SIZE', 50)
+    entries = {}
+    for tag, window, fanfic_id, views in LeaderboardEntry.objects.filter(rank__lte=size).order_by(
+        'tag', 'window', 'rank'
+    ).values_list('tag', 'window', 'fanfic_id', 'views'):
+        entries.setdefault((tag, window), []).append((fanfic_id, views))
+
+    fanfic_ids = sorted({fanfic_id for rows in entries.values() for fanfic_id, _ in rows})
+    cards = {}
+    for start in range(0, len(fanfic_ids), 500):
+        for card in fanfic_cards(Fanfic.objects.filter(pk__in=fanfic_ids[start:start + 500], status='published')):
+            cards[card.pk] = card
+
+    lists = {}
+    for stats in LeaderboardStats.objects.all():
+        # Снятые с публикации после снимка фанфики пропускаются, как в leaderboard()
+        rows = [(cards[fanfic_id], views) for fanfic_id, views in entries.get((stats.tag, stats.window), []) if fanfic_id in cards]
+        lists[board_name(stats.tag, stats.window)] = (
+            [card for card, _ in rows],
+            [views for _, views in rows],
+            {'fanfics_count': stats.fanfics_count, 'total_views': stats.total_views, 'avg_views': stats.avg_views},
+        )
+
+    lists['new'] = (fanfic_cards(Fanfic.objects.filter(status='published').order_by('-created_at')[
+        :getattr(settings, 'HOTLISTS_NEW_SIZE', 50)
+    ]), None, None)
+    return lists
+
+
+def refresh_hotlists():
+    """Пересобирает сегмент; None, если его уже пишет другой процесс"""
+    path = segment_path()
+    lock = KeyLock(path.with_name(f'{path.name}.lock'))
+    if not lock.acquire():
+        return None
+    try:
+        lists = build_hotlists()
+        generation = write_segment(path, lists)
+    finally:
+        lock.release()
+    return {'generation': generation, 'lists': len(lists)}
+
+
+def hotlists_metrics():
+    segment = get_segment()
+    with _stats_lock:
+        snapshot = dict(_stats)
+    if segment is not None:
+        snapshot.update(
+            generation=segment.generation,
+            age_seconds=round(time.time() - segment.written_at, 3),
+            lists=len(segment.directory),
+            cards=segment.cards_count,
+            bytes=segment.size,
+        )
+    return snapshot
+
+
+metrics.register('hotlists', hotlists_metrics)
@@ -0,0 +1,324 @@
+"""
+Рейтинги популярных фанфиков: общий и по каждому тегу, за все время,
+за неделю и за сутки.
+
+Страница популярного раньше сортировала все опубликованные фанфики по
+views_count на каждый запрос и суммировала просмотры в Python, а
+Tag.get_popular_fanfics делал то же самое через LIKE. Теперь рейтинги -
+снимки в таблицах LeaderboardEntry (место, фанфик, просмотры за период) и
+LeaderboardStats (итоги), страницы читают готовый срез по месту:
+
+    fanfics, stats = leaderboard(window='7d', limit=50)
+
+Просмотры за окна берутся из почасовых корзин ViewBucket (база
+аналитики), их пишет сброс буфера просмотров. Снимки обновляет фоновая
+задача (или команда refresh_leaderboards) инкрементально: в пределах
+одного часа границы окон не меняются, поэтому пересчитываются только
+общий рейтинг и рейтинги тегов фанфиков, набравших просмотры с прошлого
+обновления. Фоновая задача запускается в каждом процессе сервера, но
+рейтинги пересчитывает только тот, кто держит файловую блокировку
+LEADERBOARD_LOCK_PATH; остальные ждут, пока она освободится. В начале нового часа рейтинги пересчитываются полностью,
+а корзины старше самого длинного окна удаляются. Записываются только
+изменившиеся места.
+"""
+
+import heapq
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Sum
+from django.utils import timezone
+
+from fanfiction import metrics, writer
+from fanfiction.background import PeriodicTask
+from fanfiction.replica import PRIMARY_ALIAS
+from fanfiction.single_flight import KeyLock
+
+from .models import Fanfic, LeaderboardEntry, LeaderboardStats, ViewBucket, parse_tags
+
+# Общий рейтинг хранится с пустым тегом
+GLOBAL = ''
+
+# Период -> длина окна (None - за все время)
+WINDOWS = {
+    'all': None,
+    '7d': timedelta(days=7),
+    '24h': timedelta(hours=24),
+}
+
+_stats_lock = threading.Lock()
+_stats = {'refreshes': 0, 'full_refreshes': 0, 'last_boards': 0, 'last_changed': 0, 'last_duration_ms': 0.0}
+
+
+def current_hour(now=None):
+    """Начало часа - ключ почасовой корзины"""
+    now = now or timezone.now()
+    return now.replace(minute=0, second=0, microsecond=0)
+
+
+def _published_fanfics():
+    """Опубликованные фанфики: id, теги, просмотры, дата - без текста"""
+    return [
+        (fanfic_id, parse_tags(tags), views_count, created_at)
+        for fanfic_id, tags, views_count, created_at in Fanfic.objects.filter(
+            status='published'
+        ).order_by().values_list('id', 'tags', 'views_count', 'created_at')
+    ]
+
+
+def _window_views(window, hour):
+    """Просмотры каждого фанфика за окно, заканчивающееся текущим часом"""
+    return dict(ViewBucket.objects.filter(
+        hour__gt=hour - window
+    ).order_by().values('fanfic_id').annotate(total=Sum('views')).values_list('fanfic_id', 'total'))
+
+
+def compute_boards(fanfics, window_views, size, tags=None):
+    """Рейтинги {(тег, период): [(id фанфика, просмотры), ...]}
+
+    fanfics - результат _published_fanfics(), window_views - просмотры за
+    окна по периодам. tags ограничивает набор рейтингов (None - все теги
+    и общий рейтинг).
+    """
+    candidates = {}
+    for fanfic in fanfics:
+        for tag in [GLOBAL, *fanfic[1]]:
+            if tags is None or tag in tags:
+                candidates.setdefault(tag, []).append(fanfic)
+
+    boards = {}
+    for tag, tag_fanfics in candidates.items():
+        for window in WINDOWS:
+            if window == 'all':
+                scored = [(views_count, created_at, fanfic_id) for fanfic_id, _, views_count, created_at in tag_fanfics]
+            else:
+                views = window_views[window]
+                scored = [
+                    (views[fanfic_id], created_at, fanfic_id)
+                    for fanfic_id, _, _, created_at in tag_fanfics if views.get(fanfic_id)
+                ]
+            # Как на странице популярного: по просмотрам, при равенстве - новее выше
+            top = heapq.nlargest(size, scored)
+            boards[(tag, window)] = [(fanfic_id, score) for score, _, fanfic_id in top]
+    return boards
+
+
+def _write_board(tag, window, rows, now):
+    """Обновляет снимок одного рейтинга; возвращает число измененных мест"""
+    existing = {
+        rank: (pk, fanfic_id, views)
+        for pk, rank, fanfic_id, views in LeaderboardEntry.objects.filter(
+            tag=tag, window=window
+        ).values_list('pk', 'rank', 'fanfic_id', 'views')
+    }
+
+    to_update, to_create = [], []
+    for rank, (fanfic_id, views) in enumerate(rows, start=1):
+        current = existing.pop(rank, None)
+        if current is None:
+            to_create.append(LeaderboardEntry(tag=tag, window=window, rank=rank, fanfic_id=fanfic_id, views=views))
+        elif current[1:] != (fanfic_id, views):
+            to_update.append(LeaderboardEntry(pk=current[0], fanfic_id=fanfic_id, views=views))
+
+    if existing:
+        LeaderboardEntry.objects.filter(pk__in=[pk for pk, _, _ in existing.values()]).delete()
+    if to_update:
+        LeaderboardEntry.objects.bulk_update(to_update, ['fanfic', 'views'])
+    if to_create:
+        LeaderboardEntry.objects.bulk_create(to_create)
+
+    total_views = sum(views for _, views in rows)
+    LeaderboardStats.objects.update_or_create(tag=tag, window=window, defaults={
+        'fanfics_count': len(rows),
+        'total_views': total_views,
+        'avg_views': total_views // len(rows) if rows else 0,
+        'refreshed_at': now,
+    })
+    return len(existing) + len(to_update) + len(to_create)
+
+
+def _drop_boards(keep):
+    """Удаляет рейтинги тегов, которых больше нет ни у одного фанфика"""
+    stale = [
+        key for key in LeaderboardStats.objects.values_list('tag', 'window') if key not in keep
+    ]
+    for tag, window in stale:
+        LeaderboardEntry.objects.filter(tag=tag, window=window).delete()
+        LeaderboardStats.objects.filter(tag=tag, window=window).delete()
+    return len(stale)
+
+
+def refresh_leaderboards(size=None, full=False, now=None):
+    """Обновляет снимки рейтингов
+
+    Возвращает словарь: сколько рейтингов пересчитано, сколько мест
+    изменилось и был ли пересчет полным.
+    """
+    from .deletion import delete_in_batches
+
+    started = time.perf_counter()
+    size = size or getattr(settings, 'LEADERBOARD_SIZE', 50)
+    now = now or timezone.now()
+    hour = current_hour(now)
+
+    last = LeaderboardStats.objects.filter(tag=GLOBAL, window='all').values_list('refreshed_at', flat=True).first()
+    full = full or last is None or current_hour(last) != hour
+
+    fanfics = _published_fanfics()
+    tags = None
+    if not full:
+        # Корзины пишутся без ожидания - берем запас на запись, закоммиченную позже
+        since = last - timedelta(seconds=writer.WRITE_TIMEOUT)
+        dirty = set(ViewBucket.objects.filter(updated_at__gte=since).values_list('fanfic_id', flat=True))
+        if not dirty:
+            return {'boards': 0, 'changed': 0, 'full': False}
+        tags = {GLOBAL}
+        for fanfic_id, fanfic_tags, _, _ in fanfics:
+            if fanfic_id in dirty:
+                tags.update(fanfic_tags)
+
+    window_views = {window: _window_views(length, hour) for window, length in WINDOWS.items() if length}
+    boards = compute_boards(fanfics, window_views, size, tags)
+
+    changed = 0
+    for (tag, window), rows in boards.items():
+        # Каждый рейтинг - своя короткая транзакция
+        changed += writer.submit(_write_board, tag, window, rows, now).result(timeout=writer.WRITE_TIMEOUT)
+
+    if full:
+        if not boards:
+            # Нет опубликованных фанфиков - общий рейтинг все равно нужен пустым
+            for window in WINDOWS:
+                writer.submit(_write_board, GLOBAL, window, [], now).result(timeout=writer.WRITE_TIMEOUT)
+                boards[(GLOBAL, window)] = []
+        writer.submit(_drop_boards, set(boards)).result(timeout=writer.WRITE_TIMEOUT)
+        delete_in_batches(ViewBucket.objects.filter(hour__lte=hour - max(filter(None, WINDOWS.values()))).order_by())
+
+    with _stats_lock:
+        _stats['refreshes'] += 1
+        _stats['full_refreshes'] += int(full)
+        _stats['last_boards'] = len(boards)
+        _stats['last_changed'] = changed
+        _stats['last_duration_ms'] = round((time.perf_counter() - started) * 1000, 3)
+    return {'boards': len(boards), 'changed': changed, 'full': full}
+
+
+def leaderboard(tag=GLOBAL, window='all', limit=None):
+    """Готовый срез рейтинга: (карточки по местам, итоги)
+
+    Возвращает None, если снимка еще нет. Снятые с публикации и удаленные
+    после снимка фанфики пропускаются. Пока обновляется общий сегмент
+    горячих списков (users/hotlists.py), рейтинг берется из него.
+    """
+    from .cards import fanfic_cards
+    from .hotlists import board
+
+    hot = board(tag=tag, window=window, limit=limit)
+    if hot is not None:
+        return hot
+
+    stats = LeaderboardStats.objects.filter(tag=tag, window=window).first()
+    if stats is None:
+        return None
+
+    entries = LeaderboardEntry.objects.filter(tag=tag, window=window).order_by('rank').values_list('fanfic_id', 'views')
+    if limit is not None:
+        entries = entries[:limit]
+    entries = list(entries)
+
+    cards = {
+        card.pk: card
+        for card in fanfic_cards(Fanfic.objects.filter(pk__in=[fanfic_id for fanfic_id, _ in entries], status='published'))
+    }
+    fanfics = []
+    for fanfic_id, views in entries:
+        card = cards.get(fanfic_id)
+        if card is not None:
+            card.period_views = views
+            fanfics.append(card)
+    return fanfics, stats
+
+
+def live_board(window='all', limit=None):
+    """Общий рейтинг, посчитанный на лету, пока снимка еще нет
+
+    Карточки по местам, просмотры за период - в period_views. Окна
+    считаются по почасовым корзинам, как при обновлении снимка.
+    """
+    from .cards import fanfic_cards
+
+    published = Fanfic.objects.filter(status='published')
+    length = WINDOWS[window]
+    if length is None:
+        cards = fanfic_cards(published.order_by('-views_count', '-created_at').cached()[:limit])
+        for card in cards:
+            card.period_views = card.views_count
+        return cards
+
+    views = _window_views(length, current_hour())
+    scored = [
+        (views[fanfic_id], created_at, fanfic_id)
+        for fanfic_id, created_at in published.filter(pk__in=list(views)).order_by().values_list('id', 'created_at')
+    ]
+    top = heapq.nlargest(limit, scored) if limit is not None else sorted(scored, reverse=True)
+    cards = {card.pk: card for card in fanfic_cards(Fanfic.objects.filter(pk__in=[pk for _, _, pk in top]))}
+    fanfics = []
+    for period_views, _, fanfic_id in top:
+        card = cards.get(fanfic_id)
+        if card is not None:
+            card.period_views = period_views
+            fanfics.append(card)
+    return fanfics
+
+
+_refresher = None
+_refresher_lock = threading.Lock()
+_leader_lock = None
+
+
+def _refresh_as_leader():
+    """Шаг фоновой задачи: рейтинги обновляет один процесс на сервер
+
+    Блокировка берется без ожидания и держится, пока процесс жив; после
+    его остановки ее возьмет следующий.
+    """
+    global _leader_lock
+    if _leader_lock is None:
+        lock = KeyLock(settings.LEADERBOARD_LOCK_PATH)
+        if not lock.acquire():
+            return None
+        _leader_lock = lock
+    return refresh_leaderboards()
+
+
+def start_in_process_refresh():
+    """Запускает обновление рейтингов в этом процессе, если оно включено
+
+    Вызывается один раз при старте сервера (fanfiction/wsgi.py,
+    fanfiction/asgi.py).
+    """
+    global _refresher
+    if not getattr(settings, 'LEADERBOARD_REFRESH_IN_PROCESS', False):
+        return False
+    # Тестовой базе в памяти фоновый поток не нужен
+    if connections[PRIMARY_ALIAS].is_in_memory_db():
+        return False
+    with _refresher_lock:
+        if _refresher is None:
+            _refresher = PeriodicTask(
+                'leaderboard-refresh', _refresh_as_leader,
+                getattr(settings, 'LEADERBOARD_REFRESH_INTERVAL', 60.0),
+            )
+    _refresher.start()
+    return True
+
+
+def leaderboard_metrics():
+    with _stats_lock:
+        return dict(_stats)
+
+
+metrics.register('leaderboards', leaderboard_metrics)
@@ -0,0 +1,68 @@
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from fanfiction.replica import PRIMARY_ALIAS
+from fanfiction.routers import analytics_db
+from users.deletion import BATCH_SIZE
+from users.models import ViewHistory
+
+
+def copy_table(source, target, table, batch_size=BATCH_SIZE):
+    """Копирует строки table из соединения sqlite3 source в target пачками
+
+    Каждая пачка - отдельная транзакция; строки, которые в target уже
+    есть, пропускаются, поэтому копирование можно повторять. Возвращает
+    число новых строк.
+    """
+    columns = [row[1] for row in source.execute(f'PRAGMA table_info("{table}")')]
+    names = ', '.join(f'"{column}"' for column in columns)
+    placeholders = ', '.join('?' * len(columns))
+
+    copied, last_rowid = 0, 0
+    while True:
+        rows = source.execute(
+            f'SELECT rowid, {names} FROM "{table}" WHERE rowid > ? ORDER BY rowid LIMIT ?',
+            [last_rowid, batch_size],
+        ).fetchall()
+        if not rows:
+            return copied
+        target.execute('BEGIN IMMEDIATE')
+        try:
+            cursor = target.executemany(
+                f'INSERT OR IGNORE INTO "{table}" ({names}) VALUES ({placeholders})',
+                [row[1:] for row in rows],
+            )
+        except Exception:
+            target.rollback()
+            raise
+        target.commit()
+        copied += cursor.rowcount
+        last_rowid = rows[-1][0]
+
+
+class Command(BaseCommand):
+    help = (
+        'Копирует сессии и историю просмотров из основной базы в базу аналитики '
+        '(однократно, после migrate --database=analytics)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='строк в одной транзакции')
+
+    def handle(self, *args, **options):
+        target_alias = analytics_db()
+        if target_alias == PRIMARY_ALIAS:
+            raise CommandError('База analytics не настроена в DATABASES')
+
+        for alias in (PRIMARY_ALIAS, target_alias):
+            connections[alias].ensure_connection()
+        source, target = connections[PRIMARY_ALIAS].connection, connections[target_alias].connection
+        existing = set(connections[PRIMARY_ALIAS].introspection.table_names())
+        for model in (Session, ViewHistory):
+            table = model._meta.db_table
+            if table not in existing:
+                self.stdout.write(f'{table}: в основной базе таблицы нет')
+                continue
+            copied = copy_table(source, target, table, options['batch_size'])
+            self.stdout.write(f'{table}: скопировано строк - {copied}')
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.deletion import BATCH_SIZE, prune_view_history
+from users.readers import prune_reader_sketches
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет историю просмотров сверх лимита на пользователя и старше срока хранения, '
+        'а также устаревшие скетчи уникальных читателей'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='строк в одной транзакции')
+        parser.add_argument('--loop', action='store_true', help='выполнять постоянно')
+        parser.add_argument('--interval', type=float, default=3600, help='период в секундах')
+
+    def handle(self, *args, **options):
+        while True:
+            result = prune_view_history(batch_size=options['batch_size'])
+            self.stdout.write(
+                f"Удалено записей: старых - {result['expired']}, сверх лимита - {result['over_limit']}"
+            )
+            sketches = prune_reader_sketches(batch_size=options['batch_size'])
+            self.stdout.write(f'Удалено скетчей читателей: {sketches}')
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
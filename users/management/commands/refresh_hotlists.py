@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.hotlists import refresh_hotlists, segment_path
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает общий сегмент горячих списков (рейтинги и новинки) для воркеров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='обновлять постоянно')
+        parser.add_argument('--interval', type=float, default=30, help='период обновления в секундах')
+
+    def handle(self, *args, **options):
+        while True:
+            result = refresh_hotlists()
+            if result is None:
+                self.stdout.write(f'Сегмент {segment_path()} уже обновляет другой процесс')
+            else:
+                self.stdout.write(f"Сегмент записан: поколение {result['generation']}, списков {result['lists']}")
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from fanfiction import invalidation
+from users.leaderboards import refresh_leaderboards
+
+
+class Command(BaseCommand):
+    help = 'Обновляет снимки рейтингов популярных фанфиков (общий и по тегам)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='пересчитать все рейтинги')
+        parser.add_argument('--size', type=int, default=None, help='мест в каждом рейтинге')
+        parser.add_argument('--loop', action='store_true', help='выполнять постоянно')
+        parser.add_argument('--interval', type=float, default=60, help='период в секундах')
+
+    def handle(self, *args, **options):
+        while True:
+            result = refresh_leaderboards(size=options['size'], full=options['full'])
+            self.stdout.write(
+                f"Рейтингов пересчитано: {result['boards']}, мест изменилось: {result['changed']}"
+                f"{' (полный пересчет)' if result['full'] else ''}"
+            )
+            if not options['loop']:
+                break
+            # Шину этот процесс не читает - события записей отправляем сами
+            invalidation.flush()
+            time.sleep(options['interval'])
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from fanfiction.replica import get_snapshotter
+
+
+class Command(BaseCommand):
+    help = 'Обновляет снимок read-реплики (однократно или в цикле)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='обновлять постоянно')
+        parser.add_argument('--interval', type=float, default=None, help='период обновления в секундах')
+
+    def handle(self, *args, **options):
+        snapshotter = get_snapshotter()
+        if snapshotter is None:
+            raise CommandError('База replica не настроена в DATABASES')
+
+        interval = options['interval'] or snapshotter.interval
+        while True:
+            snapshotter.refresh()
+            stats = snapshotter.stats()
+            self.stdout.write(f"Реплика обновлена за {stats['last_duration_ms']} мс")
+            if not options['loop']:
+                break
+            time.sleep(interval)
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:14
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='viewhistory',
+            name='fanfic',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='users.fanfic', verbose_name='Фанфик'),
+        ),
+        migrations.AlterField(
+            model_name='viewhistory',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_viewhistory_analytics_db'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='viewhistory',
+            index=models.Index(fields=['viewed_at'], name='users_viewh_viewed__336e61_idx'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:38
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def _count(model, column):
+    return Coalesce(Subquery(
+        model.objects.filter(**{column: OuterRef('pk')}).order_by().values(column).annotate(
+            total=Count('id')
+        ).values('total')
+    ), Value(0))
+
+
+def fill_counters(apps, schema_editor):
+    """Заполняет счетчики по существующим закладкам и лайкам"""
+    Bookmark = apps.get_model('users', 'Bookmark')
+    CommentLike = apps.get_model('users', 'CommentLike')
+    using = schema_editor.connection.alias
+
+    apps.get_model('users', 'CustomUser').objects.using(using).update(bookmarks_count=_count(Bookmark, 'user_id'))
+    apps.get_model('users', 'Fanfic').objects.using(using).update(bookmarks_count=_count(Bookmark, 'fanfic_id'))
+    apps.get_model('users', 'Comment').objects.using(using).update(likes_count=_count(CommentLike, 'comment_id'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_viewhistory_viewed_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество лайков'),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='bookmarks_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество закладок'),
+        ),
+        migrations.AddField(
+            model_name='fanfic',
+            name='bookmarks_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество закладок'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_reaction_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tag', models.CharField(blank=True, max_length=100, verbose_name='Тег')),
+                ('window', models.CharField(choices=[('all', 'За все время'), ('7d', 'За неделю'), ('24h', 'За сутки')], max_length=10, verbose_name='Период')),
+                ('fanfics_count', models.PositiveIntegerField(default=0, verbose_name='Фанфиков в рейтинге')),
+                ('total_views', models.PositiveBigIntegerField(default=0, verbose_name='Всего просмотров')),
+                ('avg_views', models.PositiveIntegerField(default=0, verbose_name='В среднем просмотров')),
+                ('refreshed_at', models.DateTimeField(verbose_name='Дата обновления')),
+            ],
+            options={
+                'verbose_name': 'Итоги рейтинга',
+                'verbose_name_plural': 'Итоги рейтингов',
+                'unique_together': {('tag', 'window')},
+            },
+        ),
+        migrations.CreateModel(
+            name='LeaderboardEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tag', models.CharField(blank=True, max_length=100, verbose_name='Тег')),
+                ('window', models.CharField(choices=[('all', 'За все время'), ('7d', 'За неделю'), ('24h', 'За сутки')], max_length=10, verbose_name='Период')),
+                ('rank', models.PositiveIntegerField(verbose_name='Место')),
+                ('views', models.PositiveIntegerField(default=0, verbose_name='Просмотры за период')),
+                ('fanfic', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='users.fanfic', verbose_name='Фанфик')),
+            ],
+            options={
+                'verbose_name': 'Место в рейтинге',
+                'verbose_name_plural': 'Места в рейтингах',
+                'ordering': ['tag', 'window', 'rank'],
+                'unique_together': {('tag', 'window', 'rank')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ViewBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(verbose_name='Час')),
+                ('views', models.PositiveIntegerField(default=0, verbose_name='Просмотры')),
+                ('updated_at', models.DateTimeField(verbose_name='Дата обновления')),
+                ('fanfic', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='users.fanfic', verbose_name='Фанфик')),
+            ],
+            options={
+                'verbose_name': 'Просмотры за час',
+                'verbose_name_plural': 'Просмотры по часам',
+                'indexes': [models.Index(fields=['hour'], name='users_viewb_hour_9c0a3c_idx'), models.Index(fields=['updated_at'], name='users_viewb_updated_4587b4_idx')],
+                'unique_together': {('fanfic', 'hour')},
+            },
+        ),
+    ]
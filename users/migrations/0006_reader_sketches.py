@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_leaderboards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReaderSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('registers', models.BinaryField(verbose_name='Регистры скетча')),
+                ('fanfic', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='users.fanfic', verbose_name='Фанфик')),
+            ],
+            options={
+                'verbose_name': 'Читатели за день',
+                'verbose_name_plural': 'Читатели по дням',
+                'indexes': [models.Index(fields=['day'], name='users_reade_day_a3acad_idx')],
+                'unique_together': {('fanfic', 'day')},
+            },
+        ),
+    ]
@@ -4,6 +4,8 @@ from django.urls import reverse
 from django.utils import timezone
 from datetime import timedelta
 from django.core.validators import RegexValidator
+from fanfiction import writer
+from fanfiction.query_cache import CachingQuerySet
 from .countries import COUNTRIES
 
 class CustomUser(AbstractUser):
@@ -30,6 +32,9 @@ class CustomUser(AbstractUser):
         help_text='Формат: +79991234567'
     )
     
+    # Счетчик закладок поддерживается в users/reactions.py
+    bookmarks_count = models.PositiveIntegerField(default=0, verbose_name='Количество закладок')
+    
     def __str__(self):
         return self.username
     
@@ -41,6 +46,42 @@ class CustomUser(AbstractUser):
         """Возвращает количество комментариев пользователя"""
         return self.comment_set.count()
 
+POPULARITY_BADGE_CLASSES = {
+    'viral': 'badge-popularity-viral',
+    'hot': 'badge-popularity-hot',
+    'trending': 'badge-popularity-trending',
+    'new': 'badge-popularity-new',
+    'fresh': 'badge-popularity-fresh'
+}
+
+POPULARITY_TEXTS = {
+    'viral': '🔥 Вирусный',
+    'hot': '🔥 Горячий',
+    'trending': '📈 Набирает популярность',
+    'new': '✨ Новый',
+    'fresh': '🌱 Свежий'
+}
+
+def parse_tags(tags):
+    """Разбирает строку тегов через запятую в очищенный список"""
+    if tags:
+        tags = [tag.strip().lower() for tag in tags.split(',')]
+        return [tag for tag in tags if tag]
+    return []
+
+def popularity_level(views_count):
+    """Уровень популярности по числу просмотров"""
+    if views_count >= 1000:
+        return 'viral'
+    elif views_count >= 500:
+        return 'hot'
+    elif views_count >= 100:
+        return 'trending'
+    elif views_count >= 10:
+        return 'new'
+    else:
+        return 'fresh'
+
 class Fanfic(models.Model):
     STATUS_CHOICES = [
         ('draft', 'Черновик'),
@@ -62,6 +103,9 @@ class Fanfic(models.Model):
     views_count = models.PositiveIntegerField(default=0, verbose_name='Количество просмотров')
     last_viewed_at = models.DateTimeField(null=True, blank=True, verbose_name='Последний просмотр')
     
+    # Счетчик закладок поддерживается в users/reactions.py
+    bookmarks_count = models.PositiveIntegerField(default=0, verbose_name='Количество закладок')
+    
     # Поля для корзины
     deleted_at = models.DateTimeField(null=True, blank=True, verbose_name="Дата удаления в корзину")
     purge_at = models.DateTimeField(null=True, blank=True, verbose_name="Дата окончательного удаления")
@@ -69,6 +113,9 @@ class Fanfic(models.Model):
     # Поле для архива
     archived_at = models.DateTimeField(null=True, blank=True, verbose_name="Дата архивации")
     
+    # Списки помечаются .cached() (fanfiction/query_cache.py)
+    objects = CachingQuerySet.as_manager()
+    
     class Meta:
         verbose_name = 'Фанфик'
         verbose_name_plural = 'Фанфики'
@@ -87,10 +134,7 @@ class Fanfic(models.Model):
     
     def get_tags_list(self):
         """Возвращает теги в виде очищенного списка"""
-        if self.tags:
-            tags = [tag.strip().lower() for tag in self.tags.split(',')]
-            return [tag for tag in tags if tag]
-        return []
+        return parse_tags(self.tags)
     
     def add_tag(self, tag):
         """Добавляет тег к фанфику"""
@@ -118,99 +162,68 @@ class Fanfic(models.Model):
     def increment_views(self, user=None):
         """Увеличивает счетчик просмотров"""
         from django.db.models import F
+        from .object_cache import fanfic_cache
         
-        # Атомарное увеличение счетчика
-        Fanfic.objects.filter(pk=self.pk).update(
+        # Атомарное увеличение счетчика через поток-писатель
+        writer.submit(
+            Fanfic.objects.filter(pk=self.pk).update,
             views_count=F('views_count') + 1,
             last_viewed_at=timezone.now()
-        )
+        ).result(timeout=writer.WRITE_TIMEOUT)
+        fanfic_cache.invalidate(self.pk)
         
         # Обновляем объект в памяти
         self.refresh_from_db()
         
-        # Если пользователь авторизован, обновляем историю просмотров
+        # Если пользователь авторизован, отмечаем просмотр в истории
+        # (запишется пакетом при сбросе буфера просмотров)
         if user and user.is_authenticated:
-            ViewHistory.objects.update_or_create(
-                user=user,
-                fanfic=self,
-                defaults={'viewed_at': timezone.now()}
-            )
+            from .view_tracking import ingestor
+            ingestor.touch(user.pk, self.pk)
     
     def get_popularity_level(self):
         """Возвращает уровень популярности фанфика"""
-        if self.views_count >= 1000:
-            return 'viral'
-        elif self.views_count >= 500:
-            return 'hot'
-        elif self.views_count >= 100:
-            return 'trending'
-        elif self.views_count >= 10:
-            return 'new'
-        else:
-            return 'fresh'
+        return popularity_level(self.views_count)
     
     def get_popularity_badge_class(self):
         """Возвращает CSS класс для бейджа популярности"""
-        levels = {
-            'viral': 'badge-popularity-viral',
-            'hot': 'badge-popularity-hot',
-            'trending': 'badge-popularity-trending',
-            'new': 'badge-popularity-new',
-            'fresh': 'badge-popularity-fresh'
-        }
-        return levels.get(self.get_popularity_level(), '')
+        return POPULARITY_BADGE_CLASSES.get(self.get_popularity_level(), '')
     
     def get_popularity_text(self):
         """Возвращает текстовое описание популярности"""
-        texts = {
-            'viral': '🔥 Вирусный',
-            'hot': '🔥 Горячий',
-            'trending': '📈 Набирает популярность',
-            'new': '✨ Новый',
-            'fresh': '🌱 Свежий'
-        }
-        return texts.get(self.get_popularity_level(), '')
+        return POPULARITY_TEXTS.get(self.get_popularity_level(), '')
     
     # === Методы для корзины ===
+    # Переходы статуса - условные UPDATE без перезаписи текста (users/status.py)
     def move_to_trash(self):
         """Перемещает фанфик в корзину (удаление через 30 дней)"""
-        self.status = 'deleted'
-        self.deleted_at = timezone.now()
-        self.purge_at = timezone.now() + timedelta(days=30)
-        self.archived_at = None
-        self.save()
+        from .status import transition
+        transition(self, 'move_to_trash')
         return self
     
     def restore_from_trash(self):
         """Восстанавливает фанфик из корзины"""
-        self.status = 'draft'
-        self.deleted_at = None
-        self.purge_at = None
-        self.save()
+        from .status import transition
+        transition(self, 'restore_from_trash')
         return self
     
     # === Методы для архива ===
     def move_to_archive(self):
         """Перемещает фанфик в архив (просто хранение)"""
-        self.status = 'archived'
-        self.archived_at = timezone.now()
-        self.deleted_at = None
-        self.purge_at = None
-        self.save()
+        from .status import transition
+        transition(self, 'move_to_archive')
         return self
     
     def restore_from_archive(self):
         """Восстанавливает фанфик из архива (в черновики)"""
-        self.status = 'draft'
-        self.archived_at = None
-        self.save()
+        from .status import transition
+        transition(self, 'restore_from_archive')
         return self
     
     def publish_from_archive(self):
         """Публикует фанфик из архива"""
-        self.status = 'published'
-        self.archived_at = None
-        self.save()
+        from .status import transition
+        transition(self, 'publish_from_archive')
         return self
     
     # === Методы для закладок ===
@@ -294,9 +307,16 @@ class Fanfic(models.Model):
 
 # === МОДЕЛЬ: История просмотров ===
 class ViewHistory(models.Model):
-    """Модель для отслеживания истории просмотров пользователей"""
-    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, verbose_name='Пользователь')
-    fanfic = models.ForeignKey(Fanfic, on_delete=models.CASCADE, verbose_name='Фанфик')
+    """Модель для отслеживания истории просмотров пользователей
+    
+    Таблица живет в отдельной базе аналитики (см. AnalyticsRouter), поэтому
+    связи - только по id, без ограничений внешнего ключа. Записи удаляются
+    вместе с пользователем или фанфиком сигналами из users/signals.py.
+    """
+    user = models.ForeignKey(CustomUser, on_delete=models.DO_NOTHING, db_constraint=False,
+                             verbose_name='Пользователь')
+    fanfic = models.ForeignKey(Fanfic, on_delete=models.DO_NOTHING, db_constraint=False,
+                               verbose_name='Фанфик')
     viewed_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата просмотра')
     ip_address = models.GenericIPAddressField(null=True, blank=True, verbose_name='IP адрес')
     
@@ -307,12 +327,114 @@ class ViewHistory(models.Model):
         unique_together = ['user', 'fanfic']  # Один пользователь - одна запись на фанфик
         indexes = [
             models.Index(fields=['user', '-viewed_at']),
+            # Для удаления устаревших записей (users/deletion.py)
+            models.Index(fields=['viewed_at']),
         ]
     
     def __str__(self):
         return f"{self.user} просмотрел {self.fanfic}"
 
 
+class ViewBucket(models.Model):
+    """Просмотры фанфика за один час
+    
+    Живет в базе аналитики рядом с историей. По корзинам считаются
+    просмотры за скользящие окна (сутки, неделя) для рейтингов
+    (users/leaderboards.py); старые корзины удаляются при обновлении рейтингов.
+    """
+    fanfic = models.ForeignKey(Fanfic, on_delete=models.DO_NOTHING, db_constraint=False,
+                               verbose_name='Фанфик')
+    hour = models.DateTimeField(verbose_name='Час')
+    views = models.PositiveIntegerField(default=0, verbose_name='Просмотры')
+    updated_at = models.DateTimeField(verbose_name='Дата обновления')
+    
+    class Meta:
+        verbose_name = 'Просмотры за час'
+        verbose_name_plural = 'Просмотры по часам'
+        unique_together = ['fanfic', 'hour']
+        indexes = [
+            models.Index(fields=['hour']),
+            # Какие фанфики набрали просмотры с прошлого обновления рейтингов
+            models.Index(fields=['updated_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.fanfic_id} за {self.hour:%d.%m.%Y %H:00}: {self.views}"
+
+
+class ReaderSketch(models.Model):
+    """Скетч HyperLogLog уникальных читателей фанфика за один день
+    
+    Живет в базе аналитики. Дневные скетчи объединяются в недельные и
+    месячные оценки (users/readers.py).
+    """
+    fanfic = models.ForeignKey(Fanfic, on_delete=models.DO_NOTHING, db_constraint=False,
+                               verbose_name='Фанфик')
+    day = models.DateField(verbose_name='День')
+    registers = models.BinaryField(verbose_name='Регистры скетча')
+    
+    class Meta:
+        verbose_name = 'Читатели за день'
+        verbose_name_plural = 'Читатели по дням'
+        unique_together = ['fanfic', 'day']
+        indexes = [
+            # Для удаления устаревших скетчей
+            models.Index(fields=['day']),
+        ]
+    
+    def __str__(self):
+        return f"{self.fanfic_id} за {self.day:%d.%m.%Y}"
+
+
+# === МОДЕЛЬ: Рейтинги ===
+LEADERBOARD_WINDOWS = [
+    ('all', 'За все время'),
+    ('7d', 'За неделю'),
+    ('24h', 'За сутки'),
+]
+
+class LeaderboardEntry(models.Model):
+    """Строка снимка рейтинга: место фанфика в общем рейтинге или рейтинге тега
+    
+    Снимок пересчитывается фоновой задачей (users/leaderboards.py), страницы
+    читают готовый срез по месту. Фанфик может быть уже удален или снят с
+    публикации - читатели это проверяют.
+    """
+    tag = models.CharField(max_length=100, blank=True, verbose_name='Тег')  # '' - общий рейтинг
+    window = models.CharField(max_length=10, choices=LEADERBOARD_WINDOWS, verbose_name='Период')
+    rank = models.PositiveIntegerField(verbose_name='Место')
+    fanfic = models.ForeignKey(Fanfic, on_delete=models.DO_NOTHING, db_constraint=False,
+                               related_name='+', verbose_name='Фанфик')
+    views = models.PositiveIntegerField(default=0, verbose_name='Просмотры за период')
+    
+    class Meta:
+        verbose_name = 'Место в рейтинге'
+        verbose_name_plural = 'Места в рейтингах'
+        ordering = ['tag', 'window', 'rank']
+        unique_together = ['tag', 'window', 'rank']
+    
+    def __str__(self):
+        return f"{self.tag or 'все'}/{self.window} #{self.rank}: {self.fanfic_id}"
+
+
+class LeaderboardStats(models.Model):
+    """Итоги снимка рейтинга"""
+    tag = models.CharField(max_length=100, blank=True, verbose_name='Тег')
+    window = models.CharField(max_length=10, choices=LEADERBOARD_WINDOWS, verbose_name='Период')
+    fanfics_count = models.PositiveIntegerField(default=0, verbose_name='Фанфиков в рейтинге')
+    total_views = models.PositiveBigIntegerField(default=0, verbose_name='Всего просмотров')
+    avg_views = models.PositiveIntegerField(default=0, verbose_name='В среднем просмотров')
+    refreshed_at = models.DateTimeField(verbose_name='Дата обновления')
+    
+    class Meta:
+        verbose_name = 'Итоги рейтинга'
+        verbose_name_plural = 'Итоги рейтингов'
+        unique_together = ['tag', 'window']
+    
+    def __str__(self):
+        return f"{self.tag or 'все'}/{self.window}"
+
+
 # === МОДЕЛЬ: Закладки ===
 class Bookmark(models.Model):
     """Модель для закладок пользователей"""
@@ -357,6 +479,7 @@ class Comment(models.Model):
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
     is_deleted = models.BooleanField(default=False, verbose_name='Удален')
     edited_count = models.PositiveIntegerField(default=0, verbose_name='Количество редактирований')
+    likes_count = models.PositiveIntegerField(default=0, verbose_name='Количество лайков')
     
     class Meta:
         verbose_name = 'Комментарий'
@@ -549,11 +672,18 @@ class Tag(models.Model):
         ).count()
     
     def get_popular_fanfics(self, limit=10):
-        """Возвращает популярные фанфики с этим тегом"""
-        return Fanfic.objects.filter(
+        """Возвращает популярные фанфики с этим тегом (карточки по местам)"""
+        from .cards import fanfic_cards
+        from .leaderboards import leaderboard
+        
+        # Готовый снимок рейтинга тега; пока его нет - считаем на лету
+        board = leaderboard(tag=self.name, limit=limit)
+        if board is not None:
+            return board[0]
+        return fanfic_cards(Fanfic.objects.filter(
             status='published',
             tags__icontains=self.name
-        ).order_by('-views_count', '-created_at')[:limit]
+        ).order_by('-views_count', '-created_at')[:limit])
     
     @classmethod
     def update_all_tags(cls):
@@ -0,0 +1,36 @@
+"""
+Кэши объектов фанфиков и пользователей (fanfiction/object_cache.py).
+
+Фанфик кэшируется без автора: автор подставляется из кэша
+пользователей, поэтому смена ника сбрасывает одну запись пользователя, а
+не все его фанфики.
+
+Счетчики и статус фанфиков меняются через update() (буфер просмотров,
+закладки, переходы статуса, пакетное удаление) - эти места вызывают
+fanfic_cache.invalidate() и user_cache.invalidate() сами.
+"""
+
+from fanfiction.object_cache import ObjectCache
+
+from .models import CustomUser, Fanfic
+
+fanfic_cache = ObjectCache(Fanfic)
+user_cache = ObjectCache(CustomUser)
+
+
+def _with_author(fanfic, author):
+    if fanfic is None or author is None:
+        return None
+    fanfic.author = author
+    return fanfic
+
+
+def get_fanfic(pk):
+    """Фанфик с автором из кэша; None, если его нет"""
+    fanfic = fanfic_cache.get_cached(pk)
+    return _with_author(fanfic, fanfic and user_cache.get_cached(fanfic.author_id))
+
+
+async def aget_fanfic(pk):
+    fanfic = await fanfic_cache.aget_cached(pk)
+    return _with_author(fanfic, fanfic and await user_cache.aget_cached(fanfic.author_id))
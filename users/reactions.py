@@ -0,0 +1,226 @@
+"""
+Закладки и лайки комментариев.
+
+Установка и снятие идемпотентны и решаются одним запросом:
+INSERT ... ON CONFLICT DO NOTHING RETURNING и DELETE ... RETURNING сразу
+говорят, изменилось ли состояние. Двойной клик больше не падает с
+IntegrityError на unique_together. Счетчики (Fanfic.bookmarks_count,
+CustomUser.bookmarks_count, Comment.likes_count) меняются в той же
+транзакции через UPDATE ... RETURNING, так что ответ не требует COUNT.
+После изменения закладок кэшированный набор закладок пользователя
+(viewer_state) сбрасывается. Счетчики меняются сырым SQL без сигналов,
+поэтому кэш страниц анонимных посетителей сбрасывается здесь же.
+
+Функции возвращают словарь
+    {'active': есть ли связь теперь, 'changed': изменилось ли состояние,
+     'count': счетчик объекта, 'user_count': счетчик пользователя}
+или None, если объекта нет (или на него нельзя поставить закладку/лайк).
+"""
+
+from django.db import connections, router
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from fanfiction import writer
+from fanfiction.page_cache import bump_version
+
+from .object_cache import fanfic_cache, user_cache
+from .viewer_state import forget_bookmarks
+
+
+def _specs():
+    from .models import Bookmark, Comment, CommentLike, CustomUser, Fanfic
+
+    return {
+        'bookmark': {
+            'link': Bookmark, 'target': Fanfic, 'target_column': 'fanfic_id',
+            'target_filter': "status = 'published'", 'counter': 'bookmarks_count', 'user_model': CustomUser,
+        },
+        'like': {
+            'link': CommentLike, 'target': Comment, 'target_column': 'comment_id',
+            'target_filter': 'NOT is_deleted', 'counter': 'likes_count', 'user_model': None,
+        },
+    }
+
+
+def _fetch_one(cursor, sql, params):
+    cursor.execute(sql, params)
+    return cursor.fetchone()
+
+
+def _change_counter(cursor, qn, model, pk, counter, delta):
+    row = _fetch_one(cursor, (
+        f'UPDATE {qn(model._meta.db_table)} SET {counter} = MAX({counter} + %s, 0) '
+        f'WHERE id = %s RETURNING {counter}'
+    ), [delta, pk])
+    return row[0] if row else 0
+
+
+def _current_state(cursor, qn, spec, user_id, target_id):
+    """Состояние без изменений: один SELECT со связью и счетчиками"""
+    link = qn(spec['link']._meta.db_table)
+    target = qn(spec['target']._meta.db_table)
+    column = spec['target_column']
+    counter = spec['counter']
+    user_count_sql = '0'
+    params = [user_id]
+    if spec['user_model'] is not None:
+        user_count_sql = f"(SELECT {counter} FROM {qn(spec['user_model']._meta.db_table)} WHERE id = %s)"
+        params.append(user_id)
+    params.append(target_id)
+
+    row = _fetch_one(cursor, (
+        f'SELECT EXISTS(SELECT 1 FROM {link} WHERE user_id = %s AND {column} = t.id), '
+        f"t.{counter}, ({spec['target_filter']}), {user_count_sql} "
+        f'FROM {target} t WHERE t.id = %s'
+    ), params)
+    if row is None:
+        return None
+    active, count, allowed, user_count = row
+    # Пока связи нет, недоступный объект (черновик, удаленный комментарий) не показываем
+    if not active and not allowed:
+        return None
+    return {'active': bool(active), 'changed': False, 'count': count, 'user_count': user_count or 0}
+
+
+def _set(kind, user_id, target_id):
+    spec = _specs()[kind]
+    link_model = spec['link']
+    connection = connections[router.db_for_write(link_model)]
+    qn = connection.ops.quote_name
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+
+    with connection.cursor() as cursor:
+        inserted = _fetch_one(cursor, (
+            f"INSERT INTO {qn(link_model._meta.db_table)} (user_id, {spec['target_column']}, created_at) "
+            f"SELECT %s, id, %s FROM {qn(spec['target']._meta.db_table)} "
+            f"WHERE id = %s AND {spec['target_filter']} "
+            f"ON CONFLICT (user_id, {spec['target_column']}) DO NOTHING RETURNING id"
+        ), [user_id, now, target_id])
+        if inserted is None:
+            return _current_state(cursor, qn, spec, user_id, target_id)
+
+        result = {'active': True, 'changed': True, 'user_count': 0}
+        result['count'] = _change_counter(cursor, qn, spec['target'], target_id, spec['counter'], 1)
+        if spec['user_model'] is not None:
+            result['user_count'] = _change_counter(cursor, qn, spec['user_model'], user_id, spec['counter'], 1)
+        return result
+
+
+def _unset(kind, user_id, target_id):
+    spec = _specs()[kind]
+    link_model = spec['link']
+    connection = connections[router.db_for_write(link_model)]
+    qn = connection.ops.quote_name
+
+    with connection.cursor() as cursor:
+        deleted = _fetch_one(cursor, (
+            f"DELETE FROM {qn(link_model._meta.db_table)} "
+            f"WHERE user_id = %s AND {spec['target_column']} = %s RETURNING id"
+        ), [user_id, target_id])
+        if deleted is None:
+            return _current_state(cursor, qn, spec, user_id, target_id)
+
+        result = {'active': False, 'changed': True, 'user_count': 0}
+        result['count'] = _change_counter(cursor, qn, spec['target'], target_id, spec['counter'], -1)
+        if spec['user_model'] is not None:
+            result['user_count'] = _change_counter(cursor, qn, spec['user_model'], user_id, spec['counter'], -1)
+        return result
+
+
+def _toggle(kind, user_id, target_id):
+    # Снимаем связь; если ее не было - ставим. Обе попытки - в одной транзакции писателя
+    result = _unset(kind, user_id, target_id)
+    if result is not None and not result['changed']:
+        result = _set(kind, user_id, target_id)
+    return result
+
+
+def _run(func, *args):
+    return writer.submit(func, *args).result(timeout=writer.WRITE_TIMEOUT)
+
+
+def _run_bookmark(func, user_id, fanfic_id):
+    result = _run(func, 'bookmark', user_id, fanfic_id)
+    # Сбрасываем только после коммита - иначе кэш успеет заполниться старым набором
+    if result is not None and result['changed']:
+        forget_bookmarks(user_id)
+        # Счетчики закладок изменились в обход сигналов
+        fanfic_cache.invalidate(fanfic_id)
+        user_cache.invalidate(user_id)
+    return result
+
+
+def set_bookmark(user_id, fanfic_id):
+    """Добавляет опубликованный фанфик в закладки"""
+    return _run_bookmark(_set, user_id, fanfic_id)
+
+
+def unset_bookmark(user_id, fanfic_id):
+    """Убирает фанфик из закладок"""
+    return _run_bookmark(_unset, user_id, fanfic_id)
+
+
+def switch_bookmark(user_id, fanfic_id):
+    """Убирает фанфик из закладок, а если его там не было - добавляет"""
+    return _run_bookmark(_toggle, user_id, fanfic_id)
+
+
+def _run_like(func, user_id, comment_id):
+    result = _run(func, 'like', user_id, comment_id)
+    if result is not None and result['changed']:
+        # Число лайков есть на закэшированных страницах фанфика
+        bump_version()
+    return result
+
+
+def set_comment_like(user_id, comment_id):
+    """Ставит лайк комментарию"""
+    return _run_like(_set, user_id, comment_id)
+
+
+def unset_comment_like(user_id, comment_id):
+    """Снимает лайк с комментария"""
+    return _run_like(_unset, user_id, comment_id)
+
+
+# === Пересчет счетчиков после пакетного удаления связей ===
+def _count_subquery(link_model, column):
+    return Coalesce(Subquery(
+        link_model.objects.filter(**{column: OuterRef('pk')}).order_by().values(column).annotate(
+            total=Count('id')
+        ).values('total')
+    ), Value(0))
+
+
+def recount_bookmarks(user_ids=(), fanfic_ids=()):
+    """Пересчитывает счетчики закладок пользователей и фанфиков"""
+    from .models import Bookmark, CustomUser, Fanfic
+
+    user_ids, fanfic_ids = list(user_ids), list(fanfic_ids)
+    if user_ids:
+        writer.submit(
+            CustomUser.objects.filter(pk__in=user_ids).update,
+            bookmarks_count=_count_subquery(Bookmark, 'user_id'),
+        ).result(timeout=writer.WRITE_TIMEOUT)
+        forget_bookmarks(*user_ids)
+        user_cache.invalidate(*user_ids)
+    if fanfic_ids:
+        writer.submit(
+            Fanfic.objects.filter(pk__in=fanfic_ids).update,
+            bookmarks_count=_count_subquery(Bookmark, 'fanfic_id'),
+        ).result(timeout=writer.WRITE_TIMEOUT)
+        fanfic_cache.invalidate(*fanfic_ids)
+
+
+def recount_comment_likes(comment_ids):
+    """Пересчитывает счетчики лайков комментариев"""
+    from .models import Comment, CommentLike
+
+    comment_ids = list(comment_ids)
+    if comment_ids:
+        writer.submit(
+            Comment.objects.filter(pk__in=comment_ids).update,
+            likes_count=_count_subquery(CommentLike, 'comment_id'),
+        ).result(timeout=writer.WRITE_TIMEOUT)
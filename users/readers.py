@@ -0,0 +1,112 @@
+"""
+Уникальные читатели фанфиков.
+
+views_count считает каждое обновление страницы, а история просмотров
+есть только у вошедших пользователей. Здесь каждый засчитанный просмотр
+добавляет идентификатор читателя (id пользователя или отпечаток
+анонимного посетителя) в дневной скетч HyperLogLog фанфика
+(fanfiction/hll.py). Точный подсчет различных читателей не нужен:
+скетч занимает несколько КБ при любом числе читателей, а дневные скетчи
+объединяются в оценки за неделю и месяц.
+
+Отпечатки копит буфер просмотров (users/view_tracking.py) и при сбросе
+передает в write_sketches одним пакетом на базу аналитики.
+"""
+
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from fanfiction.hll import HyperLogLog
+
+# Период -> число дней, которые объединяются в оценку
+PERIODS = {
+    'day': 1,
+    'week': 7,
+    'month': 30,
+}
+
+
+def visitor_key(request):
+    """Идентификатор читателя для скетча
+
+    Вошедший пользователь - его id. Анонимный посетитель - хэш IP,
+    User-Agent и языка браузера с SECRET_KEY: сам адрес не сохраняется.
+    """
+    if request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    fingerprint = '|'.join([
+        request.META.get('REMOTE_ADDR', ''),
+        request.META.get('HTTP_USER_AGENT', ''),
+        request.META.get('HTTP_ACCEPT_LANGUAGE', ''),
+    ])
+    digest = hashlib.blake2b(fingerprint.encode(), key=settings.SECRET_KEY.encode()[:64], digest_size=16)
+    return f'anon:{digest.hexdigest()}'
+
+
+def write_sketches(visitors, day):
+    """Добавляет хэши читателей в дневные скетчи {id фанфика: хэши}
+
+    Выполняется в потоке-писателе базы аналитики: чтение и запись скетча
+    не пересекаются с другими записями. Неизменившиеся скетчи не пишутся.
+    """
+    from .models import ReaderSketch
+
+    stored = dict(ReaderSketch.objects.filter(
+        fanfic_id__in=list(visitors), day=day
+    ).values_list('fanfic_id', 'registers'))
+
+    changed = []
+    for fanfic_id, hashes in visitors.items():
+        blob = stored.get(fanfic_id)
+        sketch = HyperLogLog.loads(bytes(blob)) if blob is not None else HyperLogLog()
+        updated = blob is None
+        for value in hashes:
+            updated = sketch.add_hash(value) or updated
+        if updated:
+            changed.append(ReaderSketch(fanfic_id=fanfic_id, day=day, registers=sketch.dumps()))
+
+    if changed:
+        ReaderSketch.objects.bulk_create(
+            changed, update_conflicts=True, unique_fields=['fanfic', 'day'], update_fields=['registers'],
+        )
+    return len(changed)
+
+
+def unique_readers(fanfic_id, today=None):
+    """Оценки уникальных читателей {'day': ..., 'week': ..., 'month': ...}"""
+    from .models import ReaderSketch
+
+    today = today or timezone.now().date()
+    longest = max(PERIODS.values())
+    sketches = dict(ReaderSketch.objects.filter(
+        fanfic_id=fanfic_id, day__gt=today - timedelta(days=longest)
+    ).values_list('day', 'registers'))
+
+    result = {}
+    merged = HyperLogLog()
+    merged_days = 0
+    # Периоды вложены друг в друга - объединяем скетчи по нарастающей
+    for name, days in sorted(PERIODS.items(), key=lambda item: item[1]):
+        for offset in range(merged_days, days):
+            blob = sketches.get(today - timedelta(days=offset))
+            if blob is not None:
+                merged.merge(HyperLogLog.loads(bytes(blob)))
+        merged_days = days
+        result[name] = merged.count()
+    return result
+
+
+def prune_reader_sketches(max_age_days=None, batch_size=None):
+    """Удаляет скетчи старше max_age_days дней; возвращает число удаленных"""
+    from .deletion import BATCH_SIZE, delete_in_batches
+    from .models import ReaderSketch
+
+    if max_age_days is None:
+        max_age_days = getattr(settings, 'READER_SKETCH_MAX_AGE_DAYS', 90)
+    if not max_age_days:
+        return 0
+    cutoff = timezone.now().date() - timedelta(days=max_age_days)
+    return delete_in_batches(ReaderSketch.objects.filter(day__lt=cutoff).order_by(), batch_size or BATCH_SIZE)
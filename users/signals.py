@@ -0,0 +1,60 @@
+"""
+Сигналы приложения users.
+
+История просмотров, почасовые корзины просмотров и скетчи читателей
+лежат в базе аналитики без внешних ключей, поэтому каскадное удаление за
+них делают обработчики post_delete.
+
+Изменения фанфиков, комментариев и имен авторов сбрасывают кэш страниц
+анонимных посетителей (fanfiction/page_cache.py). Смена статуса и
+массовое удаление идут через update() и удаление по id без сигналов -
+там версия кэша увеличивается явно. Так же поднимается общий счетчик
+изменений фанфиков - версия списков, пересчитываемых через single_flight.
+"""
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from fanfiction.page_cache import bump_version
+from fanfiction.single_flight import bump_generation
+
+from .models import Comment, CustomUser, Fanfic, ReaderSketch, ViewBucket, ViewHistory
+from .status import FANFICS_GENERATION
+
+
+@receiver(post_delete, sender=Fanfic)
+def delete_fanfic_history(sender, instance, **kwargs):
+    """Удаляет историю, корзины просмотров и скетчи читателей удаленного фанфика"""
+    ViewHistory.objects.filter(fanfic_id=instance.pk).delete()
+    ViewBucket.objects.filter(fanfic_id=instance.pk).delete()
+    ReaderSketch.objects.filter(fanfic_id=instance.pk).delete()
+
+
+@receiver(post_delete, sender=CustomUser)
+def delete_user_history(sender, instance, **kwargs):
+    """Удаляет историю просмотров удаленного пользователя"""
+    ViewHistory.objects.filter(user_id=instance.pk).delete()
+
+
+@receiver(post_save, sender=Fanfic)
+@receiver(post_delete, sender=Fanfic)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_pages(sender, **kwargs):
+    """Публичные страницы показывают фанфики и комментарии - сбрасываем кэш"""
+    bump_version()
+
+
+@receiver(post_save, sender=Fanfic)
+@receiver(post_delete, sender=Fanfic)
+def invalidate_fanfic_lists(sender, **kwargs):
+    """Списки фанфиков, которые считаются один раз на все процессы, устарели"""
+    bump_generation(FANFICS_GENERATION)
+
+
+@receiver(post_save, sender=CustomUser)
+def invalidate_pages_for_author(sender, instance, created=False, update_fields=None, **kwargs):
+    """Имя автора есть на карточках; регистрация и вход (last_login) кэш не трогают"""
+    if created or (update_fields is not None and set(update_fields) <= {'last_login'}):
+        return
+    bump_version()
@@ -0,0 +1,74 @@
+"""
+Переходы статуса фанфика.
+
+Каждый переход - один условный UPDATE: WHERE status IN (допустимые
+исходные статусы), SET статус и связанные с ним даты. Текст, теги и
+остальные поля не перезаписываются, предварительный SELECT не нужен, а
+два одновременных перехода не затирают друг друга - второй просто не
+найдет строку в исходном статусе.
+"""
+
+from datetime import timedelta
+
+from django.utils import timezone
+
+from fanfiction import writer
+from fanfiction.page_cache import bump_version
+from fanfiction.single_flight import bump_generation
+
+# Общий для процессов счетчик изменений фанфиков - версия списков, которые
+# пересчитываются через single_flight (fanfiction/single_flight.py)
+FANFICS_GENERATION = 'fanfics'
+
+# Сколько фанфик лежит в корзине до окончательного удаления
+TRASH_TTL = timedelta(days=30)
+
+# Название перехода -> (допустимые исходные статусы, новый статус)
+TRANSITIONS = {
+    'move_to_trash': (('draft', 'published', 'archived'), 'deleted'),
+    'restore_from_trash': (('deleted',), 'draft'),
+    'move_to_archive': (('draft', 'published', 'deleted'), 'archived'),
+    'restore_from_archive': (('archived',), 'draft'),
+    'publish_from_archive': (('archived',), 'published'),
+    'publish': (('draft', 'archived', 'deleted'), 'published'),
+    'to_draft': (('published', 'archived', 'deleted'), 'draft'),
+}
+
+
+def status_fields(status, now):
+    """Поля, которые меняются вместе со статусом"""
+    if status == 'deleted':
+        return {'deleted_at': now, 'purge_at': now + TRASH_TTL, 'archived_at': None}
+    if status == 'archived':
+        return {'archived_at': now, 'deleted_at': None, 'purge_at': None}
+    return {'archived_at': None, 'deleted_at': None, 'purge_at': None}
+
+
+def transition(fanfic, name, author_id=None):
+    """Выполняет переход name; возвращает True, если статус изменился
+
+    fanfic - объект Fanfic или его id. Объект при успехе обновляется в
+    памяти. author_id ограничивает переход фанфиками этого автора.
+    """
+    from .models import Fanfic
+    from .object_cache import fanfic_cache
+
+    sources, target = TRANSITIONS[name]
+    fanfic_id = fanfic.pk if isinstance(fanfic, Fanfic) else fanfic
+    now = timezone.now()
+    fields = {'status': target, 'updated_at': now, **status_fields(target, now)}
+
+    queryset = Fanfic.objects.filter(pk=fanfic_id, status__in=sources)
+    if author_id is not None:
+        queryset = queryset.filter(author_id=author_id)
+
+    applied = writer.submit(queryset.update, **fields).result(timeout=writer.WRITE_TIMEOUT) == 1
+    if applied:
+        # update() не отправляет сигналов - сбрасываем кэши сами
+        bump_version()
+        bump_generation(FANFICS_GENERATION)
+        fanfic_cache.invalidate(fanfic_id)
+    if applied and isinstance(fanfic, Fanfic):
+        for field, value in fields.items():
+            setattr(fanfic, field, value)
+    return applied
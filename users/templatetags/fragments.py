@@ -0,0 +1,97 @@
+"""
+Кэш фрагментов шаблонов.
+
+Одна и та же разметка карточки (описание, теги со ссылками) рендерится
+для фанфика на главной, в популярном, новинках и на страницах тегов, а
+облако тегов - на каждый заход на страницу тегов. Тег cachefragment
+сохраняет отрендеренный фрагмент в кэше Django:
+
+    {% load fragments %}
+    {% cachefragment fanfic %}
+        ... описание и теги карточки ...
+    {% endcachefragment %}
+
+Ключ собирается автоматически: шаблон и строка тега плюс по части на
+каждый аргумент. У фанфика (модели или карточки) это id, updated_at и
+уровень популярности, поэтому правка автора или смена статуса сразу
+дает новый ключ, а старый фрагмент просто истекает. Остальные значения
+входят в ключ как строки. Внутри фрагмента можно использовать только
+то, что определяется аргументами: просмотры, закладки и место в
+рейтинге остаются снаружи.
+"""
+
+import threading
+from hashlib import md5
+
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+
+from fanfiction import metrics
+
+from ..models import popularity_level
+
+register = template.Library()
+
+FRAGMENT_KEY = 'fragment:{}'
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+
+def key_part(value):
+    """Часть ключа для значения: у фанфика - id, время правки и уровень популярности"""
+    updated_at = getattr(value, 'updated_at', None)
+    if updated_at is not None and getattr(value, 'pk', None) is not None:
+        part = f'{value.pk}:{updated_at.timestamp()}'
+        views_count = getattr(value, 'views_count', None)
+        if views_count is not None:
+            part += f':{popularity_level(views_count)}'
+        return part
+    return str(value)
+
+
+def fragment_key(template_name, lineno, values):
+    raw = '|'.join([template_name or '', str(lineno), *(key_part(value) for value in values)])
+    return FRAGMENT_KEY.format(md5(raw.encode(), usedforsecurity=False).hexdigest())
+
+
+class FragmentCacheNode(template.Node):
+    def __init__(self, nodelist, values):
+        self.nodelist = nodelist
+        self.values = values
+
+    def render(self, context):
+        timeout = getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 600)
+        if not timeout:
+            return self.nodelist.render(context)
+
+        key = fragment_key(
+            self.origin.template_name, self.token.lineno, [value.resolve(context) for value in self.values]
+        )
+        content = cache.get(key)
+        with _stats_lock:
+            _stats['hits' if content is not None else 'misses'] += 1
+        if content is None:
+            content = self.nodelist.render(context)
+            cache.set(key, content, timeout)
+        return content
+
+
+@register.tag
+def cachefragment(parser, token):
+    """{% cachefragment значение ... %}...{% endcachefragment %}"""
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' требует хотя бы одно значение для ключа")
+    nodelist = parser.parse(('endcachefragment',))
+    parser.delete_first_token()
+    return FragmentCacheNode(nodelist, [parser.compile_filter(bit) for bit in bits[1:]])
+
+
+def fragment_cache_metrics():
+    with _stats_lock:
+        return dict(_stats)
+
+
+metrics.register('fragment_cache', fragment_cache_metrics)
@@ -24,12 +24,16 @@ urlpatterns = [
     path('fanfic/new/', views.fanfic_create_view, name='fanfic_create'),
     path('fanfic/<int:pk>/edit/', views.fanfic_edit_view, name='fanfic_edit'),
     path('fanfic/<int:pk>/', views.fanfic_detail_view, name='fanfic_detail'),
+    path('fanfic/<int:pk>/view/', views.fanfic_view_beacon, name='fanfic_view_beacon'),
+    path('fanfic/<int:pk>/readers/', views.fanfic_readers_view, name='fanfic_readers'),
     
     # ===== КОММЕНТАРИИ =====
     path('fanfic/<int:fanfic_id>/comment/', views.add_comment, name='add_comment'),
     path('comment/<int:comment_id>/delete/', views.delete_comment, name='delete_comment'),
     path('comment/<int:comment_id>/edit/', views.edit_comment, name='edit_comment'),
     path('comment/<int:comment_id>/restore/', views.restore_comment, name='restore_comment'),
+    path('comment/<int:comment_id>/like/', views.set_comment_like_view, name='set_comment_like'),
+    path('comment/<int:comment_id>/unlike/', views.unset_comment_like_view, name='unset_comment_like'),
     path('fanfic/<int:fanfic_id>/comments/json/', views.get_comments_json, name='get_comments_json'),
     path('my-comments/', views.my_comments_view, name='my_comments'),
     
@@ -69,9 +73,17 @@ urlpatterns = [
     # Закладки
     path('bookmarks/', views.my_bookmarks, name='my_bookmarks'),
     path('bookmarks/toggle/<int:fanfic_id>/', views.toggle_bookmark, name='toggle_bookmark'),
+    path('bookmarks/set/<int:fanfic_id>/', views.set_bookmark_view, name='set_bookmark'),
+    path('bookmarks/unset/<int:fanfic_id>/', views.unset_bookmark_view, name='unset_bookmark'),
     path('bookmarks/clear/', views.clear_bookmarks, name='clear_bookmarks'),
     path('bookmarks/remove/<int:bookmark_id>/', views.remove_bookmark, name='remove_bookmark'),
     
+    # Метрики для персонала
+    path('metrics/', views.metrics_view, name='metrics'),
+    
+    # Готовность процесса (прогрев кэшей) для балансировщика
+    path('ready/', views.readiness_view, name='readiness'),
+    
     # Обработчики ошибок
     path('404/', views.custom_404_view, name='custom_404'),
     path('500/', views.custom_500_view, name='custom_500'),
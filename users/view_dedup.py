@@ -0,0 +1,118 @@
+"""
+Отсев повторных просмотров.
+
+Обновление страницы фанфика или повторный заход в пределах нескольких
+минут раньше засчитывались как новый просмотр: beacon клал событие в
+буфер, а сброс буфера увеличивал views_count. Теперь у каждого
+посетителя есть вращающийся фильтр Блума (fanfiction/bloom.py) с id
+фанфиков, просмотры которых уже засчитаны за последние
+VIEW_DEDUP_WINDOW секунд, и повтор отбрасывается прямо в beacon - до
+буфера просмотров и записи в базу:
+
+    if count_view(request, pk):
+        ingestor.record(...)
+    remember_seen_views(request, response)
+
+Фильтр хранится в подписанной cookie (сотни байт, сервер ничего не
+хранит). Клиенты без cookie - скрипты, приватные режимы с запретом
+cookie - получают тот же фильтр из кэша по отпечатку посетителя
+(users.readers.visitor_key), так что и они не накручивают счетчик.
+"""
+
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.urls import reverse
+
+from fanfiction import metrics
+from fanfiction.bloom import DEFAULT_HASHES, DEFAULT_SIZE, RotatingBloomFilter
+
+from .readers import visitor_key
+
+COOKIE_NAME = 'seen_views'
+COOKIE_SALT = 'users.view_dedup'
+CACHE_KEY = 'seen_views:{}'
+
+_stats_lock = threading.Lock()
+_stats = {'checked': 0, 'suppressed': 0, 'from_cookie': 0, 'from_cache': 0}
+
+
+def _window():
+    return getattr(settings, 'VIEW_DEDUP_WINDOW', 1800)
+
+
+def _filter_size():
+    return getattr(settings, 'VIEW_DEDUP_FILTER_BITS', DEFAULT_SIZE)
+
+
+def _cookie_path():
+    # Cookie нужна только beacon-запросам: /users/fanfic/<pk>/view/
+    return reverse('fanfic_view_beacon', args=[0]).split('/0/')[0] + '/'
+
+
+def _load(value):
+    if not value:
+        return None
+    return RotatingBloomFilter.loads(value, _window(), _filter_size(), DEFAULT_HASHES)
+
+
+def get_seen_views(request):
+    """Фильтр просмотренных фанфиков посетителя (один на запрос)"""
+    seen = getattr(request, '_seen_views', None)
+    if seen is not None:
+        return seen
+
+    source = 'from_cookie'
+    seen = _load(request.get_signed_cookie(COOKIE_NAME, default=None, salt=COOKIE_SALT))
+    if seen is None:
+        source = 'from_cache'
+        seen = _load(cache.get(CACHE_KEY.format(visitor_key(request))))
+        # Фильтр из кэша сохраняется обратно и после следующих просмотров
+        request._seen_views_cached = True
+    if seen is None:
+        source = None
+        seen = RotatingBloomFilter(_window(), _filter_size(), DEFAULT_HASHES)
+
+    if source:
+        with _stats_lock:
+            _stats[source] += 1
+    request._seen_views = seen
+    return seen
+
+
+def count_view(request, fanfic_id):
+    """Засчитывать ли просмотр: False, если фанфик уже засчитан за окно"""
+    if not _window():
+        return True
+    counted = get_seen_views(request).add(str(fanfic_id))
+    if counted:
+        request._seen_views_changed = True
+    with _stats_lock:
+        _stats['checked'] += 1
+        _stats['suppressed'] += int(not counted)
+    return counted
+
+
+def remember_seen_views(request, response):
+    """Сохраняет изменившийся фильтр в cookie ответа и при необходимости в кэш"""
+    if not getattr(request, '_seen_views_changed', False):
+        return response
+    value = request._seen_views.dumps()
+    # Фильтр помнит просмотры не дольше двух окон
+    max_age = 2 * _window()
+    response.set_signed_cookie(
+        COOKIE_NAME, value, salt=COOKIE_SALT, max_age=max_age,
+        path=_cookie_path(), httponly=True, samesite='Lax', secure=request.is_secure(),
+    )
+    if getattr(request, '_seen_views_cached', False):
+        cache.set(CACHE_KEY.format(visitor_key(request)), value, max_age)
+    return response
+
+
+def view_dedup_metrics():
+    with _stats_lock:
+        return dict(_stats)
+
+
+metrics.register('view_dedup', view_dedup_metrics)
@@ -0,0 +1,290 @@
+"""
+Учет просмотров фанфиков.
+
+Просмотр фиксируется не при рендере страницы, а beacon-запросом со
+страницы после загрузки. Beacon только кладет событие в буфер процесса,
+а буфер периодически сбрасывается в базу одним коротким транзакционным
+пакетом: по одному UPDATE на фанфик вместо записи на каждый запрос.
+История просмотров пишется одним upsert на пакет, а повторные просмотры
+одного фанфика одним пользователем в пределах VIEW_HISTORY_TOUCH_WINDOW
+секунд схлопываются в одну отметку. Просмотры за час копятся в
+почасовых корзинах ViewBucket - по ним считаются рейтинги за сутки и
+неделю (users/leaderboards.py), а хэши читателей - в дневных скетчах
+уникальных читателей (users/readers.py).
+"""
+
+import atexit
+import logging
+import re
+import threading
+from collections import Counter
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import F
+from django.utils import timezone
+
+from fanfiction import writer
+from fanfiction.background import PeriodicTask
+from fanfiction.hll import hash64
+from fanfiction.routers import analytics_db
+
+from .readers import write_sketches
+
+logger = logging.getLogger(__name__)
+
+# Роботы и служебные клиенты (пустой User-Agent тоже считаем роботом)
+BOT_USER_AGENT_RE = re.compile(
+    r'bot|crawl|spider|slurp|archiver|facebookexternalhit|embedly|preview|'
+    r'headless|phantomjs|lighthouse|python-requests|python-urllib|curl|wget|httpclient',
+    re.IGNORECASE,
+)
+
+# Заголовки, которыми браузеры помечают prefetch/prerender-запросы
+PREFETCH_HEADERS = {
+    'HTTP_SEC_PURPOSE': 'prefetch',
+    'HTTP_PURPOSE': 'prefetch',
+    'HTTP_X_PURPOSE': 'preview',
+    'HTTP_X_MOZ': 'prefetch',
+}
+
+
+def is_countable_request(request):
+    """Можно ли засчитывать просмотр по этому запросу"""
+    user_agent = request.META.get('HTTP_USER_AGENT', '')
+    if not user_agent or BOT_USER_AGENT_RE.search(user_agent):
+        return False
+
+    for header, marker in PREFETCH_HEADERS.items():
+        if marker in request.META.get(header, '').lower():
+            return False
+
+    return True
+
+
+def is_same_origin_request(request):
+    """Пришел ли beacon со страницы этого сайта
+
+    Браузер сам ставит Sec-Fetch-Site и Origin, и страница другого сайта
+    подделать их не может. Клиент без браузера может, поэтому запрос без
+    этих заголовков не отбрасывается - от него защищает только отсев
+    повторов.
+    """
+    fetch_site = request.META.get('HTTP_SEC_FETCH_SITE')
+    if fetch_site is not None:
+        return fetch_site == 'same-origin'
+    origin = request.META.get('HTTP_ORIGIN')
+    if origin is not None:
+        return urlsplit(origin).netloc == request.get_host()
+    return True
+
+
+class ViewIngestor:
+    """Буфер просмотров с пакетным сбросом в базу"""
+
+    def __init__(self, flush_interval=2.0, max_pending=500, touch_window=60.0):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.touch_window = touch_window
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._counts = Counter()
+        self._last_viewed = {}
+        self._history = {}
+        # Хэши читателей каждого фанфика для скетчей уникальных читателей
+        self._visitors = {}
+        # Когда пара (пользователь, фанфик) последний раз попадала в историю
+        self._recent_touches = {}
+        # Просмотры для корзин, запись которых не удалась (счетчики уже записаны)
+        self._buckets = Counter()
+        self._task = PeriodicTask('view-ingest-flush', self.flush, flush_interval)
+
+    def record(self, fanfic_id, user_id=None, visitor=None):
+        """Добавляет просмотр в буфер; запись в базу произойдет при сбросе
+
+        visitor - идентификатор читателя (users.readers.visitor_key).
+        """
+        now = timezone.now()
+        visitor_hash = hash64(visitor) if visitor is not None else None
+        with self._lock:
+            self._counts[fanfic_id] += 1
+            self._last_viewed[fanfic_id] = now
+            if visitor_hash is not None:
+                self._visitors.setdefault(fanfic_id, set()).add(visitor_hash)
+            if user_id is not None:
+                self._touch((user_id, fanfic_id), now)
+            pending = len(self._counts) + len(self._history)
+
+        self._after_record(pending)
+
+    def touch(self, user_id, fanfic_id):
+        """Отмечает просмотр в истории пользователя, не увеличивая счетчик"""
+        with self._lock:
+            self._touch((user_id, fanfic_id), timezone.now())
+            pending = len(self._counts) + len(self._history)
+
+        self._after_record(pending)
+
+    def _touch(self, key, now):
+        # Повторные просмотры в пределах touch_window схлопываются в один
+        last = self._recent_touches.get(key)
+        if last is not None and (now - last).total_seconds() < self.touch_window:
+            return
+        self._recent_touches[key] = now
+        self._history[key] = now
+
+    def _after_record(self, pending):
+        self._task.start()
+
+        # Сбрасываем сразу, если буфер переполнен
+        if pending >= self.max_pending:
+            self.flush()
+
+    def pending(self):
+        with self._lock:
+            return sum(self._counts.values())
+
+    def _drain(self):
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+            last_viewed, self._last_viewed = self._last_viewed, {}
+            history, self._history = self._history, {}
+            visitors, self._visitors = self._visitors, {}
+            buckets, self._buckets = self._buckets, Counter()
+            # Забываем пары, окно которых уже прошло
+            threshold = timezone.now() - timedelta(seconds=self.touch_window)
+            self._recent_touches = {
+                key: touched_at for key, touched_at in self._recent_touches.items() if touched_at > threshold
+            }
+        return counts, last_viewed, history, visitors, buckets
+
+    def _restore(self, counts=None, last_viewed=None, history=None, visitors=None, buckets=None):
+        """Возвращает в буфер данные, запись которых не удалась"""
+        with self._lock:
+            self._counts.update(counts or {})
+            for fanfic_id, viewed_at in (last_viewed or {}).items():
+                current = self._last_viewed.get(fanfic_id)
+                self._last_viewed[fanfic_id] = max(current, viewed_at) if current else viewed_at
+            for key, viewed_at in (history or {}).items():
+                self._history[key] = max(self._history.get(key, viewed_at), viewed_at)
+            for fanfic_id, hashes in (visitors or {}).items():
+                self._visitors.setdefault(fanfic_id, set()).update(hashes)
+            self._buckets.update(buckets or {})
+
+    def _submit_analytics(self, func, *args, restore):
+        """Запись в базу аналитики без ожидания; при ошибке данные возвращаются в буфер"""
+        def done(future):
+            if future.exception() is not None:
+                logger.error('Фоновая запись просмотров не удалась, повторим при следующем сбросе',
+                             exc_info=future.exception())
+                self._restore(**restore)
+
+        try:
+            future = writer.submit(func, *args, using=analytics_db())
+        except Exception:
+            logger.exception('Очередь записи просмотров недоступна, повторим при следующем сбросе')
+            self._restore(**restore)
+            return
+        future.add_done_callback(done)
+
+    def flush(self):
+        """Записывает накопленные просмотры в базу через поток-писатель
+
+        Если запись не удалась, просмотры возвращаются в буфер и уходят со
+        следующим сбросом.
+        """
+        with self._flush_lock:
+            counts, last_viewed, history, visitors, retry_buckets = self._drain()
+            if not counts and not history and not visitors and not retry_buckets:
+                return 0
+
+            fanfic_ids = set(counts) | {fanfic_id for _, fanfic_id in history} | set(visitors)
+            try:
+                published_ids = writer.submit(
+                    _write_counts, fanfic_ids, counts, last_viewed
+                ).result(timeout=writer.WRITE_TIMEOUT)
+            except Exception:
+                logger.exception('Сброс просмотров не удался, повторим при следующем сбросе')
+                self._restore(counts, last_viewed, history, visitors, retry_buckets)
+                return 0
+
+            # История и корзины - в базе аналитики, их результат не ждем
+            history = {key: viewed_at for key, viewed_at in history.items() if key[1] in published_ids}
+            if history:
+                self._submit_analytics(_write_history, history, restore={'history': history})
+            buckets = Counter({fanfic_id: counts[fanfic_id] for fanfic_id in published_ids if counts[fanfic_id]})
+            buckets.update(retry_buckets)
+            if buckets:
+                self._submit_analytics(_write_buckets, buckets, timezone.now(), restore={'buckets': buckets})
+            visitors = {fanfic_id: hashes for fanfic_id, hashes in visitors.items() if fanfic_id in published_ids}
+            if visitors:
+                self._submit_analytics(
+                    write_sketches, visitors, timezone.now().date(), restore={'visitors': visitors},
+                )
+
+            return sum(counts[fanfic_id] for fanfic_id in published_ids)
+
+
+def _write_counts(fanfic_ids, counts, last_viewed):
+    """Один UPDATE на фанфик; возвращает id опубликованных фанфиков из fanfic_ids"""
+    from .models import Fanfic
+    from .object_cache import fanfic_cache
+
+    # Учитываем только существующие опубликованные фанфики
+    published_ids = set(Fanfic.objects.filter(
+        pk__in=list(fanfic_ids), status='published'
+    ).values_list('pk', flat=True))
+
+    updated = published_ids & set(counts)
+    for fanfic_id in updated:
+        Fanfic.objects.filter(pk=fanfic_id).update(
+            views_count=F('views_count') + counts[fanfic_id],
+            last_viewed_at=last_viewed[fanfic_id],
+        )
+    fanfic_cache.invalidate(*updated)
+    return published_ids
+
+
+def _write_history(history):
+    """Один upsert на весь пакет истории вместо SELECT + INSERT/UPDATE на запись"""
+    from .models import ViewHistory
+
+    ViewHistory.objects.bulk_create(
+        [
+            ViewHistory(user_id=user_id, fanfic_id=fanfic_id, viewed_at=viewed_at)
+            for (user_id, fanfic_id), viewed_at in history.items()
+        ],
+        update_conflicts=True,
+        unique_fields=['user', 'fanfic'],
+        update_fields=['viewed_at'],
+    )
+
+def _write_buckets(counts, now):
+    """Прибавляет просмотры к корзинам текущего часа одним upsert на фанфик"""
+    from .leaderboards import current_hour
+    from .models import ViewBucket
+
+    connection = connections[router.db_for_write(ViewBucket)]
+    ops = connection.ops
+    table = ops.quote_name(ViewBucket._meta.db_table)
+    hour = ops.adapt_datetimefield_value(current_hour(now))
+    updated_at = ops.adapt_datetimefield_value(now)
+    with connection.cursor() as cursor:
+        # bulk_create(update_conflicts) умеет только перезаписать views, а нужно прибавить
+        cursor.executemany(
+            f'INSERT INTO {table} (fanfic_id, hour, views, updated_at) VALUES (%s, %s, %s, %s) '
+            f'ON CONFLICT (fanfic_id, hour) DO UPDATE SET '
+            f'views = views + excluded.views, updated_at = excluded.updated_at',
+            [(fanfic_id, hour, views, updated_at) for fanfic_id, views in counts.items()],
+        )
+
+ingestor = ViewIngestor(
+    flush_interval=getattr(settings, 'VIEW_FLUSH_INTERVAL', 2.0),
+    max_pending=getattr(settings, 'VIEW_FLUSH_MAX_PENDING', 500),
+    touch_window=getattr(settings, 'VIEW_HISTORY_TOUCH_WINDOW', 60.0),
+)
+
+# Не теряем накопленные просмотры при штатной остановке процесса
+atexit.register(ingestor.flush)
@@ -0,0 +1,155 @@
+"""
+Закладки и лайки текущего пользователя для списков.
+
+Fanfic.is_bookmarked_by делает по запросу на каждый фанфик, и список с
+отметками закладок превращается в N+1. ViewerState загружает отметки для
+всех id страницы одним запросом и проставляет карточкам атрибуты
+fanfic.is_bookmarked и comment.is_liked - шаблон читает готовое значение.
+
+    state = get_viewer_state(request)
+    state.annotate_fanfics(page.object_list)
+
+Состояние живет в рамках одного запроса: повторные id берутся из памяти.
+У пользователей с большим числом закладок (VIEWER_BOOKMARKS_CACHE_MIN)
+весь набор id закладок хранится в кэше компактным отсортированным
+массивом и сбрасывается при каждом изменении закладок (forget_bookmarks)
+во всех процессах - через шину сброса.
+"""
+
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+
+from fanfiction import invalidation
+
+
+def _bookmarks_key(user_id):
+    return f'viewer:bookmarks:{user_id}'
+
+
+def forget_bookmarks(*user_ids):
+    """Сбрасывает кэшированные наборы закладок пользователей"""
+    keys = [_bookmarks_key(user_id) for user_id in user_ids]
+    if keys:
+        cache.delete_many(keys)
+    for user_id in user_ids:
+        invalidation.publish('bookmarks', user_id)
+
+
+invalidation.subscribe('bookmarks', lambda key: cache.delete(_bookmarks_key(int(key))))
+
+
+class _IdSet:
+    """Отсортированный массив id с проверкой вхождения за O(log n)"""
+
+    __slots__ = ('ids',)
+
+    def __init__(self, ids):
+        self.ids = ids
+
+    def __contains__(self, value):
+        index = bisect_left(self.ids, value)
+        return index < len(self.ids) and self.ids[index] == value
+
+
+class ViewerState:
+    """Отметки пользователя (закладки, лайки) для объектов одного запроса"""
+
+    def __init__(self, user):
+        self.user_id = user.pk if user.is_authenticated else None
+        self.bookmarks_count = getattr(user, 'bookmarks_count', 0) if self.user_id else 0
+        self._bookmarks = {}
+        self._likes = {}
+        self._all_bookmarks = None
+
+    def _cached_bookmarks(self):
+        """Весь набор закладок из кэша - только для пользователей с большим числом закладок"""
+        if self.bookmarks_count < getattr(settings, 'VIEWER_BOOKMARKS_CACHE_MIN', 100):
+            return None
+        if self._all_bookmarks is None:
+            from .models import Bookmark
+
+            key = _bookmarks_key(self.user_id)
+            packed = cache.get(key)
+            if packed is None:
+                ids = array('q', sorted(
+                    Bookmark.objects.filter(user_id=self.user_id).order_by().values_list('fanfic_id', flat=True)
+                ))
+                cache.set(key, ids.tobytes(), getattr(settings, 'VIEWER_BOOKMARKS_CACHE_TIMEOUT', 300))
+            else:
+                ids = array('q')
+                ids.frombytes(packed)
+            self._all_bookmarks = _IdSet(ids)
+        return self._all_bookmarks
+
+    def bookmarked_ids(self, fanfic_ids):
+        """id фанфиков из fanfic_ids, которые у пользователя в закладках"""
+        from .models import Bookmark
+
+        fanfic_ids = set(fanfic_ids)
+        if self.user_id is None:
+            return set()
+        missing = fanfic_ids - self._bookmarks.keys()
+        if missing:
+            cached = self._cached_bookmarks()
+            if cached is not None:
+                found = {fanfic_id for fanfic_id in missing if fanfic_id in cached}
+            else:
+                found = set(Bookmark.objects.filter(
+                    user_id=self.user_id, fanfic_id__in=missing
+                ).order_by().values_list('fanfic_id', flat=True))
+            for fanfic_id in missing:
+                self._bookmarks[fanfic_id] = fanfic_id in found
+        return {fanfic_id for fanfic_id in fanfic_ids if self._bookmarks[fanfic_id]}
+
+    def liked_ids(self, comment_ids):
+        """id комментариев из comment_ids, которые пользователь лайкнул"""
+        from .models import CommentLike
+
+        comment_ids = set(comment_ids)
+        if self.user_id is None:
+            return set()
+        missing = comment_ids - self._likes.keys()
+        if missing:
+            found = set(CommentLike.objects.filter(
+                user_id=self.user_id, comment_id__in=missing
+            ).order_by().values_list('comment_id', flat=True))
+            for comment_id in missing:
+                self._likes[comment_id] = comment_id in found
+        return {comment_id for comment_id in comment_ids if self._likes[comment_id]}
+
+    def annotate_fanfics(self, fanfics):
+        """Проставляет fanfic.is_bookmarked; возвращает фанфики списком"""
+        fanfics = list(fanfics)
+        bookmarked = self.bookmarked_ids(fanfic.pk for fanfic in fanfics)
+        for fanfic in fanfics:
+            fanfic.is_bookmarked = fanfic.pk in bookmarked
+        return fanfics
+
+    def annotate_comments(self, comments):
+        """Проставляет comment.is_liked; возвращает комментарии списком"""
+        comments = list(comments)
+        liked = self.liked_ids(comment.pk for comment in comments)
+        for comment in comments:
+            comment.is_liked = comment.pk in liked
+        return comments
+
+
+def get_viewer_state(request, user=None):
+    """Состояние текущего пользователя, одно на запрос
+
+    В async-view пользователя нужно передать явно (await request.auser()).
+    """
+    state = getattr(request, '_viewer_state', None)
+    if state is None:
+        state = ViewerState(user if user is not None else request.user)
+        request._viewer_state = state
+    return state
+
+
+def annotate_page(request, page, user=None):
+    """Проставляет отметки фанфикам страницы пагинатора"""
+    page.object_list = get_viewer_state(request, user).annotate_fanfics(page.object_list)
+    return page
@@ -1,17 +1,52 @@
+import asyncio
+import logging
+
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
 from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
 from datetime import timedelta
 from django.db.models import Q, F
 from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse, Http404
 from django.views.decorators.http import require_POST, require_http_methods
-from django.db import transaction
+from django.views.decorators.csrf import csrf_exempt
+from django.db import transaction, connection, close_old_connections
+from django.db.models import Count, Max, Sum
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers, quote_etag
+from hashlib import md5
+
+from fanfiction import metrics, writer
+from fanfiction.page_cache import anonymous_page_cache
+from fanfiction.routers import use_read_replica
+from fanfiction.single_flight import generation, single_flight
 
+from .cards import card_page, fanfic_cards
 from .forms import RegistrationForm, LoginForm, ProfileEditForm, FanficForm, CommentForm
-from .models import Fanfic, CustomUser, ViewHistory, Tag, Bookmark, Comment
+from .models import Fanfic, CustomUser, ViewHistory, Tag, Bookmark, Comment, LEADERBOARD_WINDOWS
+from .deletion import delete_fanfics, delete_in_batches
+from .hotlists import board, hot_cards
+from .leaderboards import WINDOWS, leaderboard, live_board
+from .object_cache import aget_fanfic, fanfic_cache, user_cache
+from .reactions import (
+    recount_bookmarks, set_bookmark, set_comment_like, switch_bookmark, unset_bookmark, unset_comment_like,
+)
+from .status import FANFICS_GENERATION, transition
+from .readers import unique_readers, visitor_key
+from .view_dedup import count_view, remember_seen_views
+from .view_tracking import ingestor, is_countable_request, is_same_origin_request
+from .viewer_state import annotate_page, get_viewer_state
+from .warmup import warmup_status
+
+logger = logging.getLogger(__name__)
+
+# Фанфиков на странице тега и в топе тега за неделю
+TAG_PAGE_SIZE = 12
+TAG_BOARD_SIZE = 5
 
 # ===== АУТЕНТИФИКАЦИЯ =====
 def register_view(request):
@@ -48,68 +83,21 @@ def logout_view(request):
     messages.info(request, 'Вы успешно вышли из системы.')
     return redirect('login')
 # ===== ГЛАВНАЯ =====
-def index_view(request):
+@anonymous_page_cache
+@use_read_replica
+async def index_view(request):
     """Главная страница - рекомендации по тегам из последнего фанфика"""
+    user = await request.auser()
     
-    print("=" * 80)
-    print("🚀 index_view ВЫЗВАНА")
-    print("=" * 80)
-    
-    # 1. ПОПУЛЯРНЫЕ
-    popular_fanfics = Fanfic.objects.filter(
-        status='published'
-    ).order_by('-views_count', '-created_at')[:10]
-    
-    print(f"🔥 ПОПУЛЯРНЫЕ: {popular_fanfics.count()} фанфиков")
-    
-    # 2. НОВИНКИ
-    new_fanfics = Fanfic.objects.filter(
-        status='published'
-    ).order_by('-created_at')[:10]
-    
-    print(f"✨ НОВИНКИ: {new_fanfics.count()} фанфиков")
-    
-    # 3. РЕКОМЕНДАЦИИ ПО ТЕГАМ ИЗ ПОСЛЕДНЕГО ФАНФИКА
-    print(f"\n🎯 ФОРМИРУЕМ РЕКОМЕНДАЦИИ ИЗ ПОСЛЕДНЕГО ФАНФИКА:")
-    
-    if request.user.is_authenticated:
-        # Получаем ТОЛЬКО последний просмотренный фанфик
-        last_view = ViewHistory.objects.filter(
-            user=request.user
-        ).select_related('fanfic').order_by('-viewed_at').first()
-        
-        if last_view:
-            print(f"   Последний фанфик: '{last_view.fanfic.title}'")
-            
-            # Берем теги только из этого фанфика
-            if last_view.fanfic.tags:
-                tags = last_view.fanfic.get_tags_list()
-                clean_tags = [tag.strip() for tag in tags if tag.strip()]
-                
-                print(f"   Теги последнего фанфика: {clean_tags}")
-                
-                if clean_tags:
-                    # Ищем фанфики по тегам последнего фанфика
-                    recommended_fanfics = get_recommendations_from_last_fanfic(
-                        tags=clean_tags,
-                        exclude_fanfic_id=last_view.fanfic.id,
-                        limit=10
-                    )
-                    print(f"   Найдено рекомендаций: {recommended_fanfics.count()}")
-                else:
-                    recommended_fanfics = Fanfic.objects.none()
-                    print("   Нет тегов в последнем фанфике - пустые рекомендации")
-            else:
-                recommended_fanfics = Fanfic.objects.none()
-                print("   Нет тегов в последнем фанфике - пустые рекомендации")
-        else:
-            recommended_fanfics = Fanfic.objects.none()
-            print("   Нет истории просмотров - пустые рекомендации")
-    else:
-        recommended_fanfics = Fanfic.objects.none()
-        print("   Пользователь не авторизован - пустые рекомендации")
+    # Популярные, новинки и рекомендации не зависят друг от друга -
+    # выполняем их одновременно
+    popular_fanfics, new_fanfics, recommended_fanfics = await _gather_queries(
+        _popular_fanfics_list,
+        _new_fanfics_list,
+        lambda: _recommended_fanfics_list(user),
+    )
     
-    print("=" * 80)
+    logger.debug('Главная: популярных %d, новинок %d', len(popular_fanfics), len(new_fanfics))
     
     context = {
         'popular_fanfics': popular_fanfics,
@@ -117,7 +105,106 @@ def index_view(request):
         'recommended_fanfics': recommended_fanfics,
     }
     
-    return render(request, 'index.html', context)
+    return await sync_to_async(render)(request, 'index.html', context)
+
+
+async def _gather_queries(*funcs):
+    """Выполняет независимые синхронные выборки одновременно.
+    
+    Асинхронный ORM выполняет запросы одного запроса последовательно в
+    одном потоке, поэтому для настоящей параллельности каждая выборка
+    идет в своем потоке со своим соединением. Внутри открытой транзакции
+    (например, в тестах) другие соединения не видят ее данных - тогда
+    выборки выполняются по очереди в потоке запроса.
+    """
+    if await sync_to_async(_in_transaction)():
+        return [await sync_to_async(func)() for func in funcs]
+    
+    return await asyncio.gather(*(
+        sync_to_async(_run_in_own_connection, thread_sensitive=False)(func)
+        for func in funcs
+    ))
+
+
+def _in_transaction():
+    return connection.in_atomic_block
+
+
+def _run_in_own_connection(func):
+    """Выполняет выборку в рабочем потоке и закрывает его соединение"""
+    try:
+        return func()
+    finally:
+        close_old_connections()
+
+
+def _popular_fanfics_list(limit=10):
+    """Топ опубликованных фанфиков по просмотрам
+    
+    Берется из общего сегмента горячих списков (users/hotlists.py); без
+    него пересчитывает один запрос на все процессы, остальные получают
+    прошлый топ (fanfiction/single_flight.py). Смена статуса и удаление
+    фанфиков поднимают версию топа - снятый с публикации в нем не задержится.
+    """
+    hot = board(window='all', limit=limit)
+    if hot is not None:
+        return hot[0]
+    return single_flight(f'popular:{limit}', lambda: fanfic_cards(Fanfic.objects.filter(
+        status='published'
+    ).order_by('-views_count', '-created_at')[:limit]), version=generation(FANFICS_GENERATION))
+
+
+def _new_fanfics_list(limit=10):
+    """Последние опубликованные фанфики (из сегмента горячих списков, если он есть)"""
+    hot = hot_cards('new', limit)
+    if hot is not None:
+        return hot
+    return fanfic_cards(Fanfic.objects.filter(
+        status='published'
+    ).order_by('-created_at').cached()[:limit])
+
+
+def _recommended_fanfics_list(user, limit=10):
+    """Рекомендации по тегам последнего просмотренного фанфика"""
+    if not user.is_authenticated:
+        logger.debug('Пользователь не авторизован - пустые рекомендации')
+        return []
+    
+    # Получаем ТОЛЬКО последний просмотренный фанфик. История лежит в базе
+    # аналитики, поэтому берем из нее только id, а фанфик - из основной базы
+    last_fanfic_id = ViewHistory.objects.filter(
+        user_id=user.pk
+    ).order_by('-viewed_at').values_list('fanfic_id', flat=True).first()
+    last_fanfic = Fanfic.objects.filter(pk=last_fanfic_id).first() if last_fanfic_id else None
+    
+    if not last_fanfic:
+        logger.debug('Нет истории просмотров - пустые рекомендации')
+        return []
+    
+    # Берем теги только из этого фанфика
+    tags = last_fanfic.get_tags_list()
+    clean_tags = [tag.strip() for tag in tags if tag.strip()]
+    
+    logger.debug('Рекомендации по фанфику %s, теги: %s', last_fanfic.pk, clean_tags)
+    
+    if not clean_tags:
+        logger.debug('Нет тегов в последнем фанфике - пустые рекомендации')
+        return []
+    
+    # Ищем фанфики по тегам последнего фанфика. Подборка одна для всех,
+    # кто последним читал этот фанфик, - считает ее один запрос. Смена
+    # статуса и удаление фанфиков поднимают ее версию, как у топа
+    recommended_fanfics = single_flight(
+        f'recommendations:{last_fanfic.id}:{limit}',
+        lambda: fanfic_cards(get_recommendations_from_last_fanfic(
+            tags=clean_tags,
+            exclude_fanfic_id=last_fanfic.id,
+            limit=limit
+        )),
+        version=(last_fanfic.tags, generation(FANFICS_GENERATION)),
+    )
+    logger.debug('Найдено рекомендаций: %d', len(recommended_fanfics))
+    return recommended_fanfics
 
 
 def get_recommendations_from_last_fanfic(tags, exclude_fanfic_id, limit=10):
@@ -126,17 +213,11 @@ def get_recommendations_from_last_fanfic(tags, exclude_fanfic_id, limit=10):
     if not tags:
         return Fanfic.objects.none()
     
-    print(f"\n   Поиск рекомендаций по тегам последнего фанфика:")
-    print(f"   Теги: {tags}")
-    print(f"   Исключаем фанфик ID: {exclude_fanfic_id}")
-    
     recommended_ids = set()
     result_fanfics = []
     
     # Если несколько тегов, сначала ищем фанфики со ВСЕМИ тегами
     if len(tags) > 1:
-        print(f"   Пробуем найти фанфики со всеми тегами...")
-        
         combined_query = Fanfic.objects.filter(status='published')
         
         for tag in tags:
@@ -144,12 +225,12 @@ def get_recommendations_from_last_fanfic(tags, exclude_fanfic_id, limit=10):
         
         combined_fanfics = combined_query.exclude(
             id=exclude_fanfic_id
-        ).order_by(
+        ).only('id').order_by(
             '-views_count', '-created_at'
         )[:limit]
         
         found_combined = combined_fanfics.count()
-        print(f"   Найдено со всеми тегами: {found_combined}")
+        logger.debug('Найдено со всеми тегами: %d', found_combined)
         
         if found_combined > 0:
             for fanfic in combined_fanfics:
@@ -158,14 +239,10 @@ def get_recommendations_from_last_fanfic(tags, exclude_fanfic_id, limit=10):
     
     # Добираем по отдельным тегам
     if len(result_fanfics) < limit:
-        print(f"   Добираем по отдельным тегам...")
-        
         for tag in tags:
             if len(result_fanfics) >= limit:
                 break
                 
-            print(f"   Ищем по тегу: '{tag}'")
-            
             tag_fanfics = Fanfic.objects.filter(
                 status='published',
                 tags__icontains=tag
@@ -173,12 +250,12 @@ def get_recommendations_from_last_fanfic(tags, exclude_fanfic_id, limit=10):
                 id=exclude_fanfic_id
             ).exclude(
                 id__in=recommended_ids
-            ).order_by(
+            ).only('id').order_by(
                 '-views_count', '-created_at'
             )[:limit - len(result_fanfics)]
             
             found_count = tag_fanfics.count()
-            print(f"   Найдено по тегу '{tag}': {found_count} фанфиков")
+            logger.debug('Найдено по тегу %r: %d', tag, found_count)
             
             if found_count > 0:
                 for fanfic in tag_fanfics:
@@ -189,7 +266,7 @@ def get_recommendations_from_last_fanfic(tags, exclude_fanfic_id, limit=10):
                         if len(result_fanfics) >= limit:
                             break
     
-    print(f"   Всего собрано: {len(result_fanfics)} фанфиков")
+    logger.debug('Всего собрано: %d', len(result_fanfics))
     
     # Возвращаем QuerySet
     if result_fanfics:
@@ -198,7 +275,8 @@ def get_recommendations_from_last_fanfic(tags, exclude_fanfic_id, limit=10):
     else:
         return Fanfic.objects.none()
 # ===== ПОИСК =====
-def advanced_search_view(request):
+@use_read_replica
+async def advanced_search_view(request):
     """Расширенный поиск"""
     title_query = request.GET.get('title', '').strip()
     tag_query = request.GET.get('tag', '').strip()
@@ -206,7 +284,7 @@ def advanced_search_view(request):
     page = request.GET.get('page', 1)
     
     # Базовый запрос
-    fanfics = Fanfic.objects.filter(status='published').select_related('author').order_by('-created_at')
+    fanfics = Fanfic.objects.filter(status='published').order_by('-created_at')
     
     has_search = False
     
@@ -235,13 +313,7 @@ def advanced_search_view(request):
         )
     
     # Пагинация
-    paginator = Paginator(fanfics, 12)
-    try:
-        fanfics_page = paginator.page(page)
-    except PageNotAnInteger:
-        fanfics_page = paginator.page(1)
-    except EmptyPage:
-        fanfics_page = paginator.page(paginator.num_pages)
+    fanfics_page = await sync_to_async(_card_page)(request, fanfics, page, 12, await request.auser())
     
     context = {
         'fanfics': fanfics_page,
@@ -249,33 +321,36 @@ def advanced_search_view(request):
         'tag_query': tag_query,
         'author_query': author_query,
         'has_search': has_search,
-        'total_results': fanfics.count(),
+        'total_results': fanfics_page.paginator.count,
     }
     
-    return render(request, 'users/search_results.html', context)
+    return await sync_to_async(render)(request, 'users/search_results.html', context)
+
+def _paginate(queryset, page, per_page):
+    """Страница пагинации с откатом на первую/последнюю при неверном номере"""
+    paginator = Paginator(queryset, per_page)
+    try:
+        return paginator.page(page)
+    except PageNotAnInteger:
+        return paginator.page(1)
+    except EmptyPage:
+        return paginator.page(paginator.num_pages)
+
+
+def _card_page(request, queryset, page, per_page, user=None):
+    """Страница карточек фанфиков с отметками закладок пользователя"""
+    return annotate_page(request, card_page(_paginate(queryset, page, per_page)), user)
 
 # ===== ПРОФИЛЬ =====
 @login_required
 def profile_view(request):
-    published_fanfics = Fanfic.objects.filter(
-        author=request.user, 
-        status='published'
-    ).order_by('-created_at')
-    
-    draft_fanfics = Fanfic.objects.filter(
-        author=request.user, 
-        status='draft'
-    ).order_by('-created_at')
-    
-    archived_fanfics = Fanfic.objects.filter(
-        author=request.user, 
-        status='archived'
-    ).order_by('-archived_at')
+    # Списки по статусам меняются только при записи фанфиков - кэшируем
+    own_fanfics = Fanfic.objects.filter(author=request.user).cached()
     
-    deleted_fanfics = Fanfic.objects.filter(
-        author=request.user,
-        status='deleted'
-    ).order_by('-deleted_at')
+    published_fanfics = own_fanfics.filter(status='published').order_by('-created_at')
+    draft_fanfics = own_fanfics.filter(status='draft').order_by('-created_at')
+    archived_fanfics = own_fanfics.filter(status='archived').order_by('-archived_at')
+    deleted_fanfics = own_fanfics.filter(status='deleted').order_by('-deleted_at')
     
     # Количество закладок пользователя
     bookmarks_count = Bookmark.objects.filter(user=request.user).count()
@@ -335,35 +410,49 @@ def fanfic_edit_view(request, pk):
         form = FanficForm(instance=fanfic)
     return render(request, 'users/fanfic_editor.html', {'form': form})
 
-def fanfic_detail_view(request, pk):
+@anonymous_page_cache
+async def fanfic_detail_view(request, pk):
     """Детальная страница фанфика"""
-    fanfic = get_object_or_404(Fanfic, pk=pk)
+    # Фанфик и автор - из кэша объектов процесса
+    fanfic = await aget_fanfic(pk)
+    if fanfic is None:
+        raise Http404('Фанфик не найден')
+    user = await request.auser()
     
     # Проверяем, что фанфик опубликован или пользователь - автор
-    if fanfic.status != 'published' and request.user != fanfic.author:
+    if fanfic.status != 'published' and user != fanfic.author:
         messages.error(request, 'Этот фанфик не доступен для просмотра.')
         return redirect('index')
     
     # Проверяем, в закладках ли фанфик
     is_bookmarked = False
-    if request.user.is_authenticated:
-        is_bookmarked = Bookmark.objects.filter(user=request.user, fanfic=fanfic).exists()
-    
-    # Увеличиваем счетчик просмотров
-    fanfic.increment_views(request.user if request.user.is_authenticated else None)
+    if user.is_authenticated:
+        is_bookmarked = await Bookmark.objects.filter(user=user, fanfic=fanfic).aexists()
+    
+    # Просмотр засчитывается beacon-запросом со страницы (fanfic_view_beacon),
+    # поэтому сама страница не пишет в базу и поддерживает условный GET
+    comments_state = await Comment.objects.filter(fanfic=fanfic).aaggregate(
+        last_update=Max('updated_at'), total=Count('id'), likes=Sum('likes_count')
+    )
+    etag = None
+    if not await sync_to_async(_has_pending_messages)(request):
+        etag = _fanfic_detail_etag(user, fanfic, is_bookmarked, comments_state)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
     
     # Получаем комментарии в древовидной структуре
-    comments = Comment.get_comments_for_fanfic(fanfic.id)
+    comments = await sync_to_async(Comment.get_comments_for_fanfic)(fanfic.id)
     
     # Форма для нового комментария
     comment_form = CommentForm()
     
     # Похожие фанфики
-    similar_fanfics = Fanfic.objects.filter(
+    similar_fanfics = [similar async for similar in Fanfic.objects.filter(
         status='published'
     ).exclude(
         pk=fanfic.pk
-    ).order_by('-views_count')[:5]
+    ).order_by('-views_count')[:5]]
     
     context = {
         'fanfic': fanfic,
@@ -371,22 +460,89 @@ def fanfic_detail_view(request, pk):
         'is_bookmarked': is_bookmarked,
         'comments': comments,
         'comment_form': comment_form,
-        'comments_count': fanfic.get_comments_count(),
+        'comments_count': await fanfic.comments.filter(is_deleted=False).acount(),
     }
     
     # Для AJAX запросов возвращаем только комментарии
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        comments_html = render(request, 'fanfic/comments_list.html', {'comments': comments}).content
+        comments_html = (await sync_to_async(render)(request, 'fanfic/comments_list.html', {'comments': comments})).content
         return JsonResponse({'comments_html': comments_html.decode('utf-8')})
     
-    return render(request, 'users/fanfic_detail.html', context)
+    response = await sync_to_async(render)(request, 'users/fanfic_detail.html', context)
+    
+    if etag:
+        response['ETag'] = etag
+        # Страница зависит от пользователя - кэш должен ее перепроверять
+        if user.is_authenticated:
+            patch_cache_control(response, private=True, no_cache=True)
+        else:
+            patch_cache_control(response, public=True, max_age=0, must_revalidate=True)
+        patch_vary_headers(response, ['Cookie'])
+    
+    return response
+
+def _has_pending_messages(request):
+    """Есть ли у запроса flash-сообщения (не помечая их прочитанными)"""
+    storage = messages.get_messages(request)
+    used = storage.used
+    try:
+        return len(storage) > 0
+    finally:
+        storage.used = used
+
+def _fanfic_detail_etag(user, fanfic, is_bookmarked, comments_state):
+    """ETag детальной страницы: меняется при изменении фанфика, счетчиков или комментариев"""
+    parts = [
+        fanfic.pk,
+        fanfic.updated_at.isoformat(),
+        fanfic.status,
+        fanfic.views_count,
+        fanfic.bookmarks_count,
+        comments_state['total'],
+        comments_state['last_update'].isoformat() if comments_state['last_update'] else '',
+        # Лайки меняют счетчик без updated_at
+        comments_state['likes'] or 0,
+        user.pk or 0,
+        int(is_bookmarked),
+    ]
+    digest = md5(':'.join(str(part) for part in parts).encode(), usedforsecurity=False).hexdigest()
+    return quote_etag(digest)
+
+@csrf_exempt
+@require_POST
+def fanfic_view_beacon(request, pk):
+    """Beacon просмотра: вызывается страницей фанфика после загрузки"""
+    # CSRF-токен sendBeacon не передает, поэтому чужие сайты отсекаем по Origin
+    if not is_same_origin_request(request):
+        return HttpResponse(status=403)
+    
+    # Повтор в пределах VIEW_DEDUP_WINDOW отбрасывается еще до буфера
+    if is_countable_request(request) and count_view(request, pk):
+        user_id = request.user.pk if request.user.is_authenticated else None
+        ingestor.record(pk, user_id, visitor_key(request))
+    
+    # Ответ без тела - navigator.sendBeacon его не читает
+    return remember_seen_views(request, HttpResponse(status=204))
+
+@login_required
+def fanfic_readers_view(request, pk):
+    """Уникальные читатели фанфика за день, неделю и месяц (оценка) - для автора"""
+    fanfic = fanfic_cache.get_or_404(pk)
+    if fanfic.author_id != request.user.pk and not request.user.is_staff:
+        raise Http404
+    
+    return JsonResponse({
+        'fanfic_id': fanfic.pk,
+        'views_count': fanfic.views_count,
+        'unique_readers': unique_readers(fanfic.pk),
+    })
 
 # ===== КОММЕНТАРИИ =====
 @login_required
 @require_POST
 def add_comment(request, fanfic_id):
     """Добавление нового комментария"""
-    fanfic = get_object_or_404(Fanfic, id=fanfic_id)
+    fanfic = fanfic_cache.get_or_404(fanfic_id)
     
     # Проверяем, что фанфик опубликован
     if fanfic.status != 'published':
@@ -398,30 +554,30 @@ def add_comment(request, fanfic_id):
     form = CommentForm(request.POST)
     
     if form.is_valid():
-        with transaction.atomic():
-            comment = form.save(commit=False)
-            comment.fanfic = fanfic
-            comment.author = request.user
-            
-            # Проверяем parent_id
-            parent_id = form.cleaned_data.get('parent_id')
-            if parent_id:
-                try:
-                    parent_comment = Comment.objects.get(id=parent_id, fanfic=fanfic)
-                    # Проверяем глубину вложенности
-                    if parent_comment.get_reply_depth() >= 5:
-                        return JsonResponse({
-                            'success': False,
-                            'error': 'Превышена максимальная глубина вложенности комментариев'
-                        })
-                    comment.parent = parent_comment
-                except Comment.DoesNotExist:
+        comment = form.save(commit=False)
+        comment.fanfic = fanfic
+        comment.author = request.user
+        
+        # Проверяем parent_id
+        parent_id = form.cleaned_data.get('parent_id')
+        if parent_id:
+            try:
+                parent_comment = Comment.objects.get(id=parent_id, fanfic=fanfic)
+                # Проверяем глубину вложенности
+                if parent_comment.get_reply_depth() >= 5:
                     return JsonResponse({
                         'success': False,
-                        'error': 'Родительский комментарий не найден'
+                        'error': 'Превышена максимальная глубина вложенности комментариев'
                     })
-            
-            comment.save()
+                comment.parent = parent_comment
+            except Comment.DoesNotExist:
+                return JsonResponse({
+                    'success': False,
+                    'error': 'Родительский комментарий не найден'
+                })
+        
+        # Сохраняет поток-писатель; ждем, чтобы вернуть id комментария
+        writer.submit(comment.save).result(timeout=writer.WRITE_TIMEOUT)
         
         # Возвращаем данные для AJAX
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -500,10 +656,10 @@ def edit_comment(request, comment_id):
     })
 
 @login_required
-def get_comments_json(request, fanfic_id):
+async def get_comments_json(request, fanfic_id):
     """Получение комментариев в формате JSON"""
-    fanfic = get_object_or_404(Fanfic, id=fanfic_id)
-    comments = Comment.get_comments_for_fanfic(fanfic.id)
+    fanfic = await fanfic_cache.aget_or_404(fanfic_id)
+    user = await request.auser()
     
     def serialize_comment(comment):
         return {
@@ -518,13 +674,27 @@ def get_comments_json(request, fanfic_id):
             'is_edited': comment.is_edited,
             'edited_count': comment.edited_count,
             'parent_id': comment.parent_id,
-            'replies': [serialize_comment(reply) for reply in comment.replies.filter(is_deleted=False)],
+            'replies': [serialize_comment(reply) for reply in comment.temp_children],
             'replies_count': comment.replies_count,
-            'can_edit': comment.can_edit(request.user) if request.user.is_authenticated else False,
-            'can_delete': comment.can_delete(request.user) if request.user.is_authenticated else False,
+            'likes_count': comment.likes_count,
+            'is_liked': comment.is_liked,
+            'can_edit': comment.can_edit(user) if user.is_authenticated else False,
+            'can_delete': comment.can_delete(user) if user.is_authenticated else False,
         }
     
-    serialized_comments = [serialize_comment(comment) for comment in comments]
+    def walk(comments):
+        for comment in comments:
+            yield comment
+            yield from walk(comment.temp_children)
+    
+    def serialize_comments():
+        comments = Comment.get_comments_for_fanfic(fanfic.id)
+        # Лайки пользователя для всей ветки - одним запросом
+        get_viewer_state(request, user).annotate_comments(walk(comments))
+        return [serialize_comment(comment) for comment in comments]
+    
+    # Сериализация обходит связи комментариев - выполняем ее в потоке
+    serialized_comments = await sync_to_async(serialize_comments)()
     
     return JsonResponse({
         'comments': serialized_comments,
@@ -549,13 +719,62 @@ def restore_comment(request, comment_id):
     return redirect('fanfic_detail', pk=comment.fanfic.id)
 
 # ===== ТЕГИ =====
-def all_tags_view(request):
+@login_required
+@require_POST
+def set_comment_like_view(request, comment_id):
+    """Лайкнуть комментарий (повторный запрос ничего не меняет)"""
+    return _like_response(comment_id, set_comment_like(request.user.pk, comment_id))
+
+@login_required
+@require_POST
+def unset_comment_like_view(request, comment_id):
+    """Снять лайк с комментария (повторный запрос ничего не меняет)"""
+    return _like_response(comment_id, unset_comment_like(request.user.pk, comment_id))
+
+def _like_response(comment_id, state):
+    if state is None:
+        raise Http404('Комментарий не найден')
+    return JsonResponse({
+        'is_liked': state['active'],
+        'changed': state['changed'],
+        'comment_id': comment_id,
+        'likes_count': state['count'],
+    })
+
+@anonymous_page_cache
+@use_read_replica
+async def all_tags_view(request):
     """Все теги"""
     published_fanfics = Fanfic.objects.filter(status='published')
     
-    # Собираем теги
+    # Версия облака - число опубликованных фанфиков и последняя правка.
+    # Теги собирает один запрос на все процессы, остальные тем временем
+    # получают прошлое облако; фрагменты шаблона кэшируются по версии
+    # облака, которое пришло, а не по текущей
+    state = await published_fanfics.aaggregate(total=Count('id'), last_update=Max('updated_at'))
+    tags_version = f"{state['total']}:{state['last_update'].timestamp() if state['last_update'] else 0}"
+    tag_cloud = SimpleLazyObject(lambda: _tag_cloud(published_fanfics, tags_version, state['total']))
+    
+    context = {
+        'tag_cloud': tag_cloud,
+        'tags_list': SimpleLazyObject(lambda: tag_cloud['tags']),
+        'total_fanfics': state['total'],
+    }
+    
+    return await sync_to_async(render)(request, 'users/all_tags.html', context)
+
+def _tag_cloud(published_fanfics, tags_version, total):
+    """Облако тегов версии tags_version (или прошлое, пока его пересчитывают)"""
+    return single_flight('all_tags', lambda: {
+        'version': tags_version,
+        'fanfics_count': total,
+        'tags': _collect_tags(published_fanfics),
+    }, version=tags_version, soft_ttl=600)
+
+def _collect_tags(published_fanfics):
+    """Теги опубликованных фанфиков с числом фанфиков, по алфавиту"""
     all_tags = {}
-    for fanfic in published_fanfics:
+    for fanfic in published_fanfics.only('tags'):
         tags = fanfic.get_tags_list()
         for tag in tags:
             tag = tag.strip()
@@ -568,57 +787,57 @@ def all_tags_view(request):
     # Сортируем
     tags_list = []
     for tag_name, count in sorted(all_tags.items()):
-        slug = tag_name.lower().replace(' ', '-')
-        slug = ''.join(c for c in slug if c.isalnum() or c == '-')
-        
         tags_list.append({
             'name': tag_name,
             'count': count,
-            'slug': slug
+            'slug': _tag_slug(tag_name)
         })
-    
-    context = {
-        'tags_list': tags_list,
-        'total_tags': len(all_tags),
-        'total_fanfics': published_fanfics.count(),
-    }
-    
-    return render(request, 'users/all_tags.html', context)
+    return tags_list
+
+def _tag_slug(tag_name):
+    """Адрес страницы тега: пробелы - дефисы, только буквы и цифры"""
+    slug = tag_name.lower().replace(' ', '-')
+    return ''.join(c for c in slug if c.isalnum() or c == '-')
+
+def _tag_fanfics(tag_name):
+    """Фанфики страницы тега, новые сначала"""
+    return Fanfic.objects.filter(
+        status='published',
+        tags__icontains=tag_name
+    ).order_by('-created_at').cached()
 
-def tag_detail_view(request, tag_slug):
+@anonymous_page_cache
+@use_read_replica
+async def tag_detail_view(request, tag_slug):
     """Фанфики по тегу"""
     if not tag_slug:
         return redirect('all_tags')
     
     tag_name = tag_slug.replace('-', ' ')
     
-    fanfics = Fanfic.objects.filter(
-        status='published',
-        tags__icontains=tag_name
-    ).select_related('author').order_by('-created_at')
+    fanfics = _tag_fanfics(tag_name)
     
     # Пагинация
-    paginator = Paginator(fanfics, 12)
-    page = request.GET.get('page')
+    fanfics_page = await sync_to_async(_card_page)(
+        request, fanfics, request.GET.get('page'), TAG_PAGE_SIZE, await request.auser()
+    )
     
-    try:
-        fanfics_page = paginator.page(page)
-    except PageNotAnInteger:
-        fanfics_page = paginator.page(1)
-    except EmptyPage:
-        fanfics_page = paginator.page(paginator.num_pages)
+    # Топ тега за неделю - из снимка рейтинга, без сортировки по LIKE
+    board = await sync_to_async(leaderboard)(tag=tag_name.lower(), window='7d', limit=TAG_BOARD_SIZE)
     
     context = {
         'tag_name': tag_name,
         'tag_slug': tag_slug,
         'fanfics': fanfics_page,
-        'fanfics_count': fanfics.count(),
+        'fanfics_count': fanfics_page.paginator.count,
         'page_obj': fanfics_page,
+        'popular_fanfics': board[0] if board else [],
     }
     
-    return render(request, 'users/tag_detail.html', context)
+    return await sync_to_async(render)(request, 'users/tag_detail.html', context)
 
-def search_by_tags_view(request):
+@use_read_replica
+async def search_by_tags_view(request):
     """Поиск по тегам"""
     query = request.GET.get('q', '').strip()
     
@@ -632,50 +851,73 @@ def search_by_tags_view(request):
             for tag in search_tags:
                 fanfics = fanfics.filter(tags__icontains=tag)
             
-            fanfics = fanfics.select_related('author').order_by('-created_at')
+            fanfics = await sync_to_async(fanfic_cards)(fanfics.order_by('-created_at'))
+            viewer = get_viewer_state(request, await request.auser())
+            fanfics = await sync_to_async(viewer.annotate_fanfics)(fanfics)
             
             context = {
                 'query': query,
                 'tags_list': search_tags,
                 'fanfics': fanfics,
-                'fanfics_count': fanfics.count(),
+                'fanfics_count': len(fanfics),
             }
             
-            return render(request, 'users/tag_search.html', context)
+            return await sync_to_async(render)(request, 'users/tag_search.html', context)
     
-    return render(request, 'users/tag_search.html', {})
+    return await sync_to_async(render)(request, 'users/tag_search.html', {})
 
 # ===== ЗАКЛАДКИ =====
 @login_required
 def toggle_bookmark(request, fanfic_id):
     """Добавить/удалить фанфик из закладок"""
-    fanfic = get_object_or_404(Fanfic, pk=fanfic_id, status='published')
+    fanfic = fanfic_cache.get_or_404(fanfic_id)
+    if fanfic.status != 'published':
+        raise Http404('Фанфик не найден')
     
-    # Проверяем, есть ли уже закладка
-    bookmark = Bookmark.objects.filter(user=request.user, fanfic=fanfic).first()
+    state = switch_bookmark(request.user.pk, fanfic.pk)
+    if state is None:
+        raise Http404('Фанфик не найден')
+    is_bookmarked = state['active']
     
-    if bookmark:
-        # Удаляем закладку
-        bookmark.delete()
-        messages.success(request, f'Фанфик "{fanfic.title}" удален из закладок')
-        is_bookmarked = False
-    else:
-        # Добавляем закладку
-        Bookmark.objects.create(user=request.user, fanfic=fanfic)
+    if is_bookmarked:
         messages.success(request, f'Фанфик "{fanfic.title}" добавлен в закладки')
-        is_bookmarked = True
+    else:
+        messages.success(request, f'Фанфик "{fanfic.title}" удален из закладок')
     
     # Если это AJAX запрос (без перезагрузки)
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
         return JsonResponse({
             'is_bookmarked': is_bookmarked,
             'fanfic_id': fanfic_id,
-            'bookmarks_count': request.user.bookmarks.count()
+            'bookmarks_count': state['user_count']
         })
     
     # Обычный запрос - возвращаем на страницу фанфика
     return redirect('fanfic_detail', pk=fanfic_id)
 
+@login_required
+@require_POST
+def set_bookmark_view(request, fanfic_id):
+    """Добавить в закладки (повторный запрос ничего не меняет)"""
+    return _bookmark_response(fanfic_id, set_bookmark(request.user.pk, fanfic_id))
+
+@login_required
+@require_POST
+def unset_bookmark_view(request, fanfic_id):
+    """Убрать из закладок (повторный запрос ничего не меняет)"""
+    return _bookmark_response(fanfic_id, unset_bookmark(request.user.pk, fanfic_id))
+
+def _bookmark_response(fanfic_id, state):
+    if state is None:
+        raise Http404('Фанфик не найден')
+    return JsonResponse({
+        'is_bookmarked': state['active'],
+        'changed': state['changed'],
+        'fanfic_id': fanfic_id,
+        'bookmarks_count': state['user_count'],
+        'fanfic_bookmarks_count': state['count'],
+    })
+
 @login_required
 def my_bookmarks(request):
     """Страница с закладками пользователя"""
@@ -704,8 +946,9 @@ def my_bookmarks(request):
 def clear_bookmarks(request):
     """Очистить все закладки"""
     if request.method == 'POST':
-        count = request.user.bookmarks.count()
-        request.user.bookmarks.all().delete()
+        fanfic_ids = list(Bookmark.objects.filter(user_id=request.user.pk).values_list('fanfic_id', flat=True))
+        count = delete_in_batches(Bookmark.objects.filter(user_id=request.user.pk))
+        recount_bookmarks(user_ids=[request.user.pk], fanfic_ids=fanfic_ids)
         messages.success(request, f'Очищено {count} закладок')
         return redirect('my_bookmarks')
     
@@ -717,9 +960,9 @@ def clear_bookmarks(request):
 @login_required
 def remove_bookmark(request, bookmark_id):
     """Удалить конкретную закладку"""
-    bookmark = get_object_or_404(Bookmark, pk=bookmark_id, user=request.user)
+    bookmark = get_object_or_404(Bookmark.objects.select_related('fanfic'), pk=bookmark_id, user=request.user)
     fanfic_title = bookmark.fanfic.title
-    bookmark.delete()
+    unset_bookmark(request.user.pk, bookmark.fanfic_id)
     messages.success(request, f'Фанфик "{fanfic_title}" удален из закладок')
     
     return redirect('my_bookmarks')
@@ -727,53 +970,69 @@ def remove_bookmark(request, bookmark_id):
 # ===== АРХИВ =====
 @login_required
 def archive_fanfic_view(request, fanfic_id):
-    fanfic = get_object_or_404(Fanfic, pk=fanfic_id, author=request.user)
+    applied, title = _apply_transition(request, fanfic_id, 'move_to_archive')
     
-    if fanfic.status == 'archived':
-        messages.warning(request, f'Фанфик "{fanfic.title}" уже в архиве')
+    if applied:
+        messages.success(request, f'Фанфик "{title}" перемещен в архив')
     else:
-        fanfic.move_to_archive()
-        messages.success(request, f'Фанфик "{fanfic.title}" перемещен в архив')
+        messages.warning(request, f'Фанфик "{title}" уже в архиве')
     
     return redirect('profile')
 
 @login_required
 def restore_from_archive_view(request, fanfic_id):
-    fanfic = get_object_or_404(Fanfic, pk=fanfic_id, author=request.user, status='archived')
+    applied, title = _apply_transition(request, fanfic_id, 'restore_from_archive')
     
-    fanfic.restore_from_archive()
-    messages.success(request, f'Фанфик "{fanfic.title}" восстановлен из архива')
+    if applied:
+        messages.success(request, f'Фанфик "{title}" восстановлен из архива')
+    else:
+        messages.warning(request, f'Фанфик "{title}" не в архиве')
     
     return redirect('profile')
 
 @login_required
 def publish_from_archive_view(request, fanfic_id):
-    fanfic = get_object_or_404(Fanfic, pk=fanfic_id, author=request.user, status='archived')
+    applied, title = _apply_transition(request, fanfic_id, 'publish_from_archive')
     
-    fanfic.publish_from_archive()
-    messages.success(request, f'Фанфик "{fanfic.title}" опубликован из архива')
+    if applied:
+        messages.success(request, f'Фанфик "{title}" опубликован из архива')
+    else:
+        messages.warning(request, f'Фанфик "{title}" не в архиве')
     
     return redirect('fanfic_detail', pk=fanfic_id)
 
+def _apply_transition(request, fanfic_id, name):
+    """Переход статуса фанфика текущего пользователя; возвращает (применен, название)"""
+    applied = transition(fanfic_id, name, author_id=request.user.pk)
+    
+    # Название нужно только для сообщения; заодно проверяем, что фанфик есть
+    title = Fanfic.objects.filter(
+        pk=fanfic_id, author=request.user
+    ).values_list('title', flat=True).first()
+    if title is None:
+        raise Http404('Фанфик не найден')
+    return applied, title
+
 # ===== КОРЗИНА =====
 @login_required
 def move_to_trash_view(request, fanfic_id):
-    fanfic = get_object_or_404(Fanfic, pk=fanfic_id, author=request.user)
+    applied, title = _apply_transition(request, fanfic_id, 'move_to_trash')
     
-    if fanfic.status == 'deleted':
-        messages.warning(request, f'Фанфик "{fanfic.title}" уже в корзине')
+    if applied:
+        messages.success(request, f'Фанфик "{title}" перемещен в корзину')
     else:
-        fanfic.move_to_trash()
-        messages.success(request, f'Фанфик "{fanfic.title}" перемещен в корзину')
+        messages.warning(request, f'Фанфик "{title}" уже в корзине')
     
     return redirect('profile')
 
 @login_required
 def restore_from_trash_view(request, fanfic_id):
-    fanfic = get_object_or_404(Fanfic, pk=fanfic_id, author=request.user, status='deleted')
+    applied, title = _apply_transition(request, fanfic_id, 'restore_from_trash')
     
-    fanfic.restore_from_trash()
-    messages.success(request, f'Фанфик "{fanfic.title}" восстановлен из корзины')
+    if applied:
+        messages.success(request, f'Фанфик "{title}" восстановлен из корзины')
+    else:
+        messages.warning(request, f'Фанфик "{title}" не в корзине')
     
     return redirect('profile')
 
@@ -782,20 +1041,22 @@ def delete_permanently_view(request, fanfic_id):
     fanfic = get_object_or_404(Fanfic, pk=fanfic_id, author=request.user, status='deleted')
     
     title = fanfic.title
-    fanfic.delete()
+    delete_fanfics([fanfic.pk])
     messages.success(request, f'Фанфик "{title}" удален навсегда')
     
     return redirect('profile')
 
 @login_required
 def empty_trash_view(request):
-    deleted_fanfics = Fanfic.objects.filter(author=request.user, status='deleted')
-    count = deleted_fanfics.count()
+    deleted_ids = list(Fanfic.objects.filter(
+        author=request.user, status='deleted'
+    ).values_list('pk', flat=True))
+    count = len(deleted_ids)
     
     if count == 0:
         messages.info(request, 'Корзина уже пуста')
     else:
-        deleted_fanfics.delete()
+        delete_fanfics(deleted_ids)
         messages.success(request, f'Корзина очищена. Удалено {count} фанфиков')
     
     return redirect('profile')
@@ -803,32 +1064,34 @@ def empty_trash_view(request):
 # ===== ПУБЛИКАЦИЯ =====
 @login_required
 def publish_fanfic_view(request, fanfic_id):
-    fanfic = get_object_or_404(Fanfic, pk=fanfic_id, author=request.user)
+    applied, title = _apply_transition(request, fanfic_id, 'publish')
     
-    if fanfic.status == 'published':
-        messages.warning(request, f'Фанфик "{fanfic.title}" уже опубликован')
+    if applied:
+        messages.success(request, f'Фанфик "{title}" опубликован')
     else:
-        fanfic.status = 'published'
-        fanfic.save()
-        messages.success(request, f'Фанфик "{fanfic.title}" опубликован')
+        messages.warning(request, f'Фанфик "{title}" уже опубликован')
     
     return redirect('fanfic_detail', pk=fanfic_id)
 
 # ===== ПУБЛИЧНЫЕ СТРАНИЦЫ =====
+@anonymous_page_cache
+@use_read_replica
 def new_fanfics_view(request):
     """Новые фанфики"""
-    last_month = timezone.now() - timedelta(days=30)
+    # Граница с точностью до минуты - иначе SQL (и ключ кэша запросов)
+    # менялся бы на каждый запрос
+    last_month = timezone.now().replace(second=0, microsecond=0) - timedelta(days=30)
     
     new_fanfics = Fanfic.objects.filter(
         status='published',  
         created_at__gte=last_month
-    ).select_related('author').order_by('-created_at')
+    ).order_by('-created_at').cached()
     
     # Если нет фанфиков за последний месяц, показываем просто последние опубликованные
     if not new_fanfics.exists():
         new_fanfics = Fanfic.objects.filter(
             status='published'
-        ).select_related('author').order_by('-created_at')
+        ).order_by('-created_at').cached()
         subtitle = "Последние опубликованные фанфики"
     else:
         subtitle = "Фанфики, добавленные за последние 30 дней"
@@ -843,6 +1106,7 @@ def new_fanfics_view(request):
         new_fanfics_page = paginator.page(1)
     except EmptyPage:
         new_fanfics_page = paginator.page(paginator.num_pages)
+    annotate_page(request, card_page(new_fanfics_page))
     
     context = {
         'new_fanfics': new_fanfics_page,  # ★★★ ИСПРАВЛЕНО: ключ должен быть 'new_fanfics', а не 'fanfics' ★★★
@@ -853,12 +1117,25 @@ def new_fanfics_view(request):
     
     return render(request, 'users/new_fanfics.html', context)
 
+@anonymous_page_cache
+@use_read_replica
 def popular_fanfics_view(request):
-    """Популярные фанфики (топ-50 по просмотрам)"""
-    # Получаем 50 самых популярных фанфиков
-    popular_fanfics = Fanfic.objects.filter(
-        status='published'
-    ).order_by('-views_count', '-created_at')[:50]
+    """Популярные фанфики (топ-50 по просмотрам за все время, неделю или сутки)"""
+    period = request.GET.get('period', 'all')
+    if period not in WINDOWS:
+        period = 'all'
+    
+    # Готовый снимок рейтинга (users/leaderboards.py)
+    board = leaderboard(window=period, limit=50)
+    if board is not None:
+        popular_fanfics, stats = board
+        total_fanfics, total_views, avg_views = stats.fanfics_count, stats.total_views, stats.avg_views
+    else:
+        # Снимка еще нет - считаем рейтинг за выбранный период на лету
+        popular_fanfics = live_board(window=period, limit=50)
+        total_fanfics = len(popular_fanfics)
+        total_views = sum(fanfic.period_views for fanfic in popular_fanfics)
+        avg_views = total_views // total_fanfics if total_fanfics else 0
     
     # Пагинация: 12 фанфиков на странице
     paginator = Paginator(popular_fanfics, 12)
@@ -870,19 +1147,18 @@ def popular_fanfics_view(request):
         fanfics_page = paginator.page(1)
     except EmptyPage:
         fanfics_page = paginator.page(paginator.num_pages)
-    
-    # Статистика
-    total_views = sum(fanfic.views_count for fanfic in popular_fanfics)
-    avg_views = total_views // len(popular_fanfics) if popular_fanfics else 0
+    annotate_page(request, fanfics_page)
     
     context = {
         'fanfics': fanfics_page,
         'title': '🔥 Самые популярные истории',
         'subtitle': 'Топ-50 фанфиков по количеству просмотров',
-        'total_fanfics': len(popular_fanfics),
+        'total_fanfics': total_fanfics,
         'total_views': total_views,
         'avg_views': avg_views,
         'page_obj': fanfics_page,
+        'period': period,
+        'periods': LEADERBOARD_WINDOWS,
     }
     
     return render(request, 'users/popular_fanfics.html', context)
@@ -891,9 +1167,17 @@ def popular_fanfics_view(request):
 @login_required
 def view_history_view(request):
     """История просмотров пользователя"""
-    history = ViewHistory.objects.filter(
-        user=request.user
-    ).select_related('fanfic', 'fanfic__author').order_by('-viewed_at')[:50]
+    history = list(ViewHistory.objects.filter(
+        user_id=request.user.pk
+    ).order_by('-viewed_at')[:50])
+    
+    # История лежит в базе аналитики: фанфики подгружаем по id из основной
+    fanfics = Fanfic.objects.select_related('author').in_bulk(
+        [entry.fanfic_id for entry in history]
+    )
+    history = [entry for entry in history if entry.fanfic_id in fanfics]
+    for entry in history:
+        entry.fanfic = fanfics[entry.fanfic_id]
     
     context = {
         'history': history,
@@ -904,7 +1188,8 @@ def view_history_view(request):
 @login_required
 def clear_view_history_view(request):
     """Очистка истории просмотров"""
-    ViewHistory.objects.filter(user=request.user).delete()
+    # Пачками - длинная история не держит блокировку записи
+    delete_in_batches(ViewHistory.objects.filter(user_id=request.user.pk))
     messages.success(request, 'История просмотров очищена')
     return redirect('view_history')
 
@@ -918,48 +1203,38 @@ def change_status_view(request, fanfic_id, new_status):
         messages.error(request, 'Недопустимый статус')
         return redirect('profile')
     
-    fanfic = get_object_or_404(Fanfic, pk=fanfic_id, author=request.user)
+    transitions = {
+        'draft': 'to_draft',
+        'published': 'publish',
+        'archived': 'move_to_archive',
+    }
+    applied, title = _apply_transition(request, fanfic_id, transitions[new_status])
     
-    if fanfic.status == new_status:
-        messages.warning(request, f'Фанфик "{fanfic.title}" уже имеет статус "{new_status}"')
+    if not applied:
+        messages.warning(request, f'Фанфик "{title}" уже имеет статус "{new_status}"')
     else:
-        fanfic.status = new_status
-        
-        # Автоматически устанавливаем даты
-        if new_status == 'archived':
-            fanfic.archived_at = timezone.now()
-            fanfic.deleted_at = None
-            fanfic.purge_at = None
-        elif new_status == 'deleted':
-            fanfic.deleted_at = timezone.now()
-            fanfic.purge_at = timezone.now() + timedelta(days=30)
-            fanfic.archived_at = None
-        elif new_status == 'published':
-            fanfic.archived_at = None
-            fanfic.deleted_at = None
-            fanfic.purge_at = None
-        
-        fanfic.save()
-        
         status_names = {
             'draft': 'черновик',
             'published': 'опубликован',
             'archived': 'архивирован'
         }
         
-        messages.success(request, f'Фанфик "{fanfic.title}" перемещен в {status_names.get(new_status, new_status)}')
+        messages.success(request, f'Фанфик "{title}" перемещен в {status_names.get(new_status, new_status)}')
     
     return redirect('profile')
 
 # ===== ПРОСМОТР ЧУЖИХ ФАНФИКОВ =====
+@use_read_replica
 def user_fanfics_view(request, username):
     """Фанфики конкретного пользователя"""
-    user = get_object_or_404(CustomUser, username=username)
+    user = user_cache.get_cached_by('username', username)
+    if user is None:
+        raise Http404('Пользователь не найден')
     
     published_fanfics = Fanfic.objects.filter(
         author=user, 
         status='published'
-    ).order_by('-created_at')
+    ).order_by('-created_at').cached()
     
     # Пагинация
     paginator = Paginator(published_fanfics, 12)
@@ -1008,6 +1283,17 @@ def my_comments_view(request):
     
     return render(request, 'users/my_comments.html', context)
 
+# ===== МЕТРИКИ =====
+@staff_member_required
+def metrics_view(request):
+    """Внутренние метрики процесса (база, кэши, очереди) в JSON"""
+    return JsonResponse(metrics.collect())
+
+def readiness_view(request):
+    """Готовность процесса к трафику: 503, пока кэши не прогреты"""
+    status = warmup_status()
+    return JsonResponse(status, status=200 if status['ready'] else 503)
+
 # ===== СТРАНИЦА ОШИБКИ 404 =====
 def custom_404_view(request, exception):
     return render(request, '404.html', status=404)
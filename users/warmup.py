@@ -0,0 +1,162 @@
+"""
+Прогрев кэшей при старте процесса.
+
+После выкладки все кэши процесса пусты, и первые минуты каждый запрос
+идет в базу. Процесс сервера (fanfiction/wsgi.py, fanfiction/asgi.py)
+сразу после загрузки запускает прогрев в фоновом потоке:
+
+  - самые читаемые фанфики за последние WARMUP_WINDOW_HOURS часов (по
+    почасовым корзинам просмотров) и их авторы загружаются в кэш
+    объектов пачками, одним запросом на WARM_BATCH объектов;
+  - списки главной - популярное и новинки;
+  - первые страницы WARMUP_TAGS самых частых тегов этих фанфиков и
+    недельные топы этих тегов.
+
+Списки и страницы тегов читаются так же, как их читают страницы (из
+реплики, если она свежая), поэтому попадают в кэш запросов под теми же
+ключами. Пока прогрев не закончился, readiness_view отвечает 503 -
+балансировщик не отправляет процессу трафик. Ошибка прогрева не держит
+процесс закрытым: он становится готовым с холодными кэшами.
+"""
+
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Sum
+
+from fanfiction import metrics
+from fanfiction.replica import PRIMARY_ALIAS
+from fanfiction.routers import replica_reads
+
+from .models import Fanfic, ViewBucket, parse_tags
+
+logger = logging.getLogger(__name__)
+
+_ready = threading.Event()
+_lock = threading.Lock()
+_thread = None
+_state = {
+    'state': 'idle', 'duration_ms': None, 'fanfics': 0, 'users': 0,
+    'tags': [], 'error': None,
+}
+
+
+def most_read_fanfics(hours, limit):
+    """id самых читаемых фанфиков за последние hours часов по убыванию просмотров
+
+    Пока корзин просмотров нет (новая база) - по общему числу просмотров.
+    """
+    from .leaderboards import current_hour
+
+    ids = list(ViewBucket.objects.filter(
+        hour__gt=current_hour() - timedelta(hours=hours)
+    ).order_by().values('fanfic_id').annotate(total=Sum('views')).order_by(
+        '-total', 'fanfic_id'
+    ).values_list('fanfic_id', flat=True)[:limit])
+    if ids:
+        return ids
+    return list(Fanfic.objects.filter(status='published').order_by(
+        '-views_count', '-created_at'
+    ).values_list('id', flat=True)[:limit])
+
+
+def top_tags(fanfics, limit):
+    """Теги, которые встречаются у читаемых фанфиков чаще всего (с учетом места)"""
+    weights = Counter()
+    for place, fanfic in enumerate(fanfics):
+        if fanfic is None or fanfic.status != 'published':
+            continue
+        for tag in parse_tags(fanfic.tags):
+            weights[tag] += len(fanfics) - place
+    return [tag for tag, _ in weights.most_common(limit)]
+
+
+def warm_up():
+    """Прогревает кэши этого процесса; возвращает итоги прогрева"""
+    from .cards import card_page
+    from .leaderboards import leaderboard
+    from .object_cache import fanfic_cache, user_cache
+    from .views import (
+        TAG_BOARD_SIZE, TAG_PAGE_SIZE, _new_fanfics_list, _paginate, _popular_fanfics_list,
+        _tag_fanfics, _tag_slug,
+    )
+
+    started = time.perf_counter()
+    with _lock:
+        _state.update(state='running', error=None)
+    try:
+        ids = most_read_fanfics(
+            getattr(settings, 'WARMUP_WINDOW_HOURS', 24), getattr(settings, 'WARMUP_FANFICS', 200),
+        )
+        fanfic_cache.warm(ids)
+        fanfics = [fanfic_cache.get_cached(pk) for pk in ids]
+        authors = {fanfic.author_id for fanfic in fanfics if fanfic is not None}
+        user_cache.warm(authors)
+        tags = top_tags(fanfics, getattr(settings, 'WARMUP_TAGS', 10))
+
+        with replica_reads():
+            _popular_fanfics_list()
+            _new_fanfics_list()
+            for tag in tags:
+                tag_name = _tag_slug(tag).replace('-', ' ')
+                card_page(_paginate(_tag_fanfics(tag_name), 1, TAG_PAGE_SIZE))
+                leaderboard(tag=tag_name, window='7d', limit=TAG_BOARD_SIZE)
+    except Exception as error:
+        logger.exception('Прогрев кэшей не удался - процесс начинает с холодными кэшами')
+        with _lock:
+            _state.update(state='failed', error=repr(error))
+    else:
+        with _lock:
+            _state.update(state='ready', fanfics=len(ids), users=len(authors), tags=tags)
+    finally:
+        with _lock:
+            _state['duration_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        _ready.set()
+    return warmup_status()
+
+
+def _run():
+    try:
+        warm_up()
+    finally:
+        # Поток закончился - его соединения больше никому не нужны
+        connections.close_all()
+
+
+def start_in_process_warmup():
+    """Запускает прогрев в фоновом потоке, если он включен"""
+    global _thread
+    # Тестовой базе в памяти прогревать нечего
+    if not getattr(settings, 'WARMUP_ON_START', True) or connections[PRIMARY_ALIAS].is_in_memory_db():
+        with _lock:
+            _state['state'] = 'disabled'
+        _ready.set()
+        return False
+    with _lock:
+        if _thread is not None:
+            return False
+        _thread = threading.Thread(target=_run, name='cache-warmup', daemon=True)
+    _thread.start()
+    return True
+
+
+def is_ready():
+    return _ready.is_set()
+
+
+def wait_ready(timeout=None):
+    """Ждет конца прогрева; True, если он закончился"""
+    return _ready.wait(timeout)
+
+
+def warmup_status():
+    with _lock:
+        return {'ready': _ready.is_set(), **_state}
+
+
+metrics.register('warmup', warmup_status)